@@ -0,0 +1,227 @@
+# coding: utf-8
+"""
+Benchmarks of hot paths on synthetic trees.
+
+Each scenario is run on every tree kind and reports latency and number
+of database queries. QUERY_BUDGETS are upper bounds of query counts
+checked by tests, so regressions fail the build.
+"""
+import random
+from collections import OrderedDict
+from timeit import default_timer
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from fci.index import bulk, models, views
+
+# tree kind -> generator parameters
+DEFAULT_TREES = OrderedDict([
+    ('chain', {'depth': 50}),
+    ('wide', {'width': 5000}),
+    ('mixed', {'depth': 4, 'fanout': 6, 'files': 10}),
+])
+
+# scenario -> max number of queries (not counting savepoints), assuming
+# warm ContentType cache
+QUERY_BUDGETS = OrderedDict([
+    ('get_object', 1),
+    ('retrieve', 4),
+    ('create', 16),
+    ('rename', 12),
+    ('move', 17),
+    ('path', 1),
+    ('clean_parent', 2),
+])
+
+
+def chain_tree(depth):
+    """ Returns spec of a chain of nested directories with a file."""
+    node = {'name': 'file.txt', 'size': 1}
+    for i in reversed(range(depth)):
+        node = {'name': 'd%d' % i, 'is_collection': True,
+                'children': [node]}
+    return [node]
+
+
+def wide_tree(width):
+    """ Returns spec of a single directory with many files."""
+    return [{'name': 'wide', 'is_collection': True, 'children': [
+        {'name': 'f%06d.txt' % i, 'size': i} for i in range(width)]}]
+
+
+def mixed_tree(depth, fanout, files, seed=0):
+    """ Returns spec of a tree of directories and files with metadata."""
+    rnd = random.Random(seed)
+    mime_types = ('image/jpeg', 'image/png', 'text/plain', 'video/mp4')
+
+    def level(remaining):
+        nodes = [{'name': 'file%d.dat' % i, 'size': rnd.randint(0, 1 << 20),
+                  'metadata': {'mime-type': rnd.choice(mime_types),
+                               'mtime': rnd.randint(0, 1 << 30)}}
+                 for i in range(rnd.randint(1, files))]
+        if remaining:
+            nodes.extend({'name': 'dir%d' % i, 'is_collection': True,
+                          'metadata': {'owner': 'user%d' % rnd.randint(1, 9)},
+                          'children': level(remaining - 1)}
+                         for i in range(fanout))
+        return nodes
+
+    return [{'name': 'mixed', 'is_collection': True,
+             'children': level(depth - 1)}]
+
+
+TREE_BUILDERS = {
+    'chain': chain_tree,
+    'wide': wide_tree,
+    'mixed': mixed_tree,
+}
+
+
+def get_root():
+    root = models.Directory.objects.filter(namespace='',
+                                           parent__isnull=True).first()
+    if root is None:
+        root = models.Directory.objects.create(name='/')
+    return root
+
+
+class Target(object):
+    """ Resources of a generated tree used by scenarios."""
+
+    def __init__(self, kind, collection, resource, other):
+        self.kind = kind
+        # collection for listings and creates
+        self.collection = collection
+        # deepest file, renamed and moved
+        self.resource = resource
+        # alternate parent for moves
+        self.other = other
+
+
+def build_tree(kind, params, parent=None):
+    """ Creates synthetic tree under parent collection, returns Target."""
+    parent = parent or get_root()
+    container = models.Directory.objects.create(name='bench-%s' % kind,
+                                                parent=parent)
+    bulk.create_tree(container, TREE_BUILDERS[kind](**params))
+    other = models.Directory.objects.create(name='other', parent=container)
+    resource = models.File.objects.filter(
+        namespace=container.namespace,
+        path__startswith=container.path + '/').order_by(
+        '-path').first()
+    collection = models.Directory.objects.get(pk=resource.parent_id)
+    return Target(kind, collection, resource, other)
+
+
+class Scenarios(object):
+    """ Benchmarked operations, each runs once per call."""
+
+    def __init__(self, target):
+        self.target = target
+        self.client = APIClient()
+        self.counter = 0
+
+    @staticmethod
+    def url(path):
+        return reverse('resource-detail', kwargs={'path': path})
+
+    def check(self, response, status):
+        if response.status_code != status:
+            raise AssertionError('Unexpected response %s: %s' % (
+                response.status_code, response.content))
+
+    def get_object(self):
+        view = views.ResourceView(kwargs={'path': self.target.resource.path})
+        view.get_object()
+
+    def retrieve(self):
+        response = self.client.get(self.url(self.target.collection.path),
+                                   format='json')
+        self.check(response, 200)
+
+    def create(self):
+        self.counter += 1
+        response = self.client.post(
+            self.url(self.target.collection.path),
+            {'name': 'new%d.txt' % self.counter, 'is_collection': False,
+             'metadata': {'n': self.counter}}, format='json')
+        self.check(response, 201)
+
+    def rename(self):
+        resource = self.target.resource
+        self.counter += 1
+        name = '%s.%d' % (resource.name.split('.')[0], self.counter)
+        response = self.client.patch(self.url(resource.path),
+                                     {'name': name}, format='json')
+        self.check(response, 200)
+        resource.refresh_from_db()
+
+    def move(self):
+        resource = self.target.resource
+        if resource.parent_id == self.target.other.pk:
+            parent = self.target.collection
+        else:
+            parent = self.target.other
+        response = self.client.patch(self.url(resource.path),
+                                     {'parent': parent.pk}, format='json')
+        self.check(response, 200)
+        resource.refresh_from_db()
+
+    def path(self):
+        models.Resource.objects.get(pk=self.target.resource.pk).path
+
+    def clean_parent(self):
+        self.target.collection.clean_parent()
+
+
+def is_savepoint(query):
+    return query['sql'].split(' ', 1)[0] in ('SAVEPOINT', 'RELEASE',
+                                             'ROLLBACK')
+
+
+def measure(func, repeat):
+    """ Runs func repeatedly, returns (timings in ms, max queries)."""
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as ctx:
+            started = default_timer()
+            func()
+            timings.append((default_timer() - started) * 1000)
+        count = len([q for q in ctx.captured_queries if not is_savepoint(q)])
+        queries = max(queries, count)
+    return timings, queries
+
+
+def run(trees=None, scenarios=None, repeat=10):
+    """
+    Builds trees and runs scenarios on each of them.
+
+    Returns list of result dicts ready for JSON serialization.
+    """
+    trees = trees or DEFAULT_TREES
+    scenarios = scenarios or list(QUERY_BUDGETS)
+    results = []
+    for kind, params in trees.items():
+        started = default_timer()
+        target = build_tree(kind, params)
+        build_ms = (default_timer() - started) * 1000
+        runner = Scenarios(target)
+        for name in scenarios:
+            timings, queries = measure(getattr(runner, name), repeat)
+            results.append(OrderedDict([
+                ('tree', kind),
+                ('params', params),
+                ('build_ms', round(build_ms, 3)),
+                ('scenario', name),
+                ('repeat', repeat),
+                ('min_ms', round(min(timings), 3)),
+                ('mean_ms', round(sum(timings) / len(timings), 3)),
+                ('max_ms', round(max(timings), 3)),
+                ('queries', queries),
+                ('budget', QUERY_BUDGETS.get(name)),
+            ]))
+    return results
@@ -0,0 +1,360 @@
+# coding: utf-8
+"""
+Batched creation of resource trees.
+
+Resources are inserted level by level with a fixed number of statements per
+batch: resource rows, closure links, metadata, metadata index, name
+trigrams and change journal.
+"""
+from collections import defaultdict, namedtuple
+
+import six
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, router, transaction
+
+from fci.index import cache, models
+
+# Parent collection of inserted resources: id, namespace, path and
+# list of (ancestor_id, depth) pairs including parent itself.
+ParentInfo = namedtuple('ParentInfo', ['id', 'namespace', 'path',
+                                       'ancestors'])
+
+
+def get_batch_size():
+    return getattr(settings, 'FCI_BULK_BATCH_SIZE', 500)
+
+
+def get_parent_info(parent):
+    """ Returns ParentInfo for existing collection."""
+    ancestors = models.ResourceClosure.objects.filter(
+        descendant=parent.pk).values_list('ancestor_id', 'depth')
+    return ParentInfo(parent.pk, parent.namespace, parent.path,
+                      list(ancestors))
+
+
+def join_path(parent_path, name):
+    return '%s/%s' % (parent_path, name) if parent_path else name
+
+
+def validate_node(node):
+    """ Checks node spec and fills defaults."""
+    if not isinstance(node, dict):
+        raise ValidationError('Resource must be an object')
+    name = node.get('name')
+    if not name or not isinstance(name, six.string_types):
+        raise ValidationError('Resource name is required')
+    field = models.Resource._meta.get_field('name')
+    try:
+        field.run_validators(name)
+    except ValidationError as e:
+        raise ValidationError('%s: %s' % (name, '; '.join(e.messages)))
+    if len(name) > field.max_length:
+        raise ValidationError('%s: name is too long' % name)
+    children = node.get('children')
+    if children is None:
+        children = []
+    if not isinstance(children, list):
+        raise ValidationError('%s: children must be a list' % name)
+    is_collection = node.get('is_collection', bool(children))
+    if not isinstance(is_collection, bool):
+        raise ValidationError('%s: is_collection must be a boolean' % name)
+    if children and not is_collection:
+        raise ValidationError('%s: parent must be a collection' % name)
+    size = node.get('size') or 0
+    if (not isinstance(size, six.integer_types) or isinstance(size, bool) or
+            not 0 <= size <= models.MAX_SIZE):
+        raise ValidationError('%s: invalid size' % name)
+    metadata = node.get('metadata') or {}
+    if not isinstance(metadata, dict):
+        raise ValidationError('%s: metadata must be an object' % name)
+    return {
+        'name': name,
+        'is_collection': is_collection,
+        'size': size,
+        'metadata': metadata,
+        'children': children,
+    }
+
+
+def manifest_to_tree(records):
+    """
+    Converts flat manifest records with relative paths to nested nodes.
+
+    Missing intermediate directories are created implicitly.
+    """
+    root = {'children': [], 'index': {}}
+    for record in records:
+        if not isinstance(record, dict) or not record.get('path'):
+            raise ValidationError('Manifest record must have a path')
+        if not isinstance(record['path'], six.string_types):
+            raise ValidationError('Manifest record path must be a string')
+        parts = record['path'].strip('/').split('/')
+        node = root
+        for part in parts[:-1]:
+            child = node['index'].get(part)
+            if child is None:
+                child = {'name': part, 'is_collection': True,
+                         'children': [], 'index': {}}
+                node['index'][part] = child
+                node['children'].append(child)
+            node = child
+        name = parts[-1]
+        child = node['index'].get(name)
+        spec = dict((k, v) for k, v in record.items() if k != 'path')
+        spec['name'] = name
+        if child is None:
+            child = dict(spec, children=[], index={})
+            node['index'][name] = child
+            node['children'].append(child)
+        else:
+            child.update(spec)
+    return root['children']
+
+
+class TreeBuilder(object):
+    """
+    Creates whole trees of resources with batched inserts.
+
+    With deferred indexes name trigrams and metadata index are not
+    inserted and rollup deltas are accumulated instead of being applied
+    per batch; caller builds them once with finish() after last batch.
+    """
+
+    def __init__(self, batch_size=None, using=None, defer_indexes=False):
+        self.batch_size = batch_size or get_batch_size()
+        self.using = using or router.db_for_write(models.Resource)
+        self.defer_indexes = defer_indexes
+        self.created = 0
+        self.content_type = ContentType.objects.get_for_model(models.Resource)
+        self.rollups = defaultdict(lambda: [0, 0, 0])
+        # with deferred indexes: ids of inserted collections, ids of
+        # inserted resources with pre-existing parents and these parents
+        self.collection_ids = set()
+        self.root_ids = []
+        self.root_parents = {}
+
+    def create_tree(self, parent, nodes):
+        """
+        Creates nested nodes under existing collection in one transaction.
+
+        Node is a dict with "name", "is_collection", "size", "metadata" and
+        "children" keys.
+        """
+        if not parent.is_collection:
+            raise ValidationError('Parent must be a collection')
+        created = self.created
+        try:
+            with transaction.atomic(using=self.using):
+                info = get_parent_info(parent)
+                level = [(info, node) for node in nodes]
+                while level:
+                    next_level = []
+                    for start in range(0, len(level), self.batch_size):
+                        batch = level[start:start + self.batch_size]
+                        for info, node in self.insert_batch(batch):
+                            next_level.extend(
+                                (info, child)
+                                for child in node.get('children') or ())
+                    level = next_level
+        except IntegrityError:
+            self.created = created
+            self.rollups.clear()
+            raise ValidationError('Resource already exists')
+        return self.created - created
+
+    def insert_batch(self, batch):
+        """
+        Inserts (ParentInfo, node) pairs.
+
+        Returns (ParentInfo, node) pairs for inserted collections, in order
+        of batch.
+        """
+        specs = []
+        seen = set()
+        for parent, node in batch:
+            spec = validate_node(node)
+            path = join_path(parent.path, spec['name'])
+            if path in seen:
+                raise ValidationError('%s: duplicate resource' % path)
+            seen.add(path)
+            specs.append((parent, spec, path, node))
+
+        resources = [models.Resource(name=spec['name'], parent_id=parent.id,
+                                     is_collection=spec['is_collection'],
+                                     namespace=parent.namespace, path=path,
+                                     path_hash=models.hash_path(path),
+                                     reversed_name=spec['name'][::-1],
+                                     size=(0 if spec['is_collection']
+                                           else spec['size']))
+                     for parent, spec, path, _ in specs]
+        ids = self.insert_resources(resources)
+
+        files, links, metadata, collections = 0, [], [], []
+        metadata_index, trigrams, changes = [], [], []
+        rollups = self.rollups
+        for (parent, spec, path, node), pk in zip(specs, ids):
+            ancestors = [(pk, 0)] + [(a, d + 1) for a, d in parent.ancestors]
+            rollups[parent.id][2] += 1
+            if self.defer_indexes:
+                if parent.id not in self.collection_ids:
+                    self.root_ids.append(pk)
+                    self.root_parents[parent.id] = parent
+                if spec['is_collection']:
+                    self.collection_ids.add(pk)
+            if spec['is_collection']:
+                collections.append((ParentInfo(pk, parent.namespace, path,
+                                               ancestors), node))
+            else:
+                files += 1
+                for a, _ in parent.ancestors:
+                    rollups[a][0] += spec['size']
+                    rollups[a][1] += 1
+            links.extend(models.ResourceClosure(ancestor_id=a,
+                                                descendant_id=pk, depth=d)
+                         for a, d in ancestors)
+            if not self.defer_indexes:
+                trigrams.extend(models.NameTrigram(resource_id=pk, trigram=t)
+                                for t in models.name_trigrams(spec['name']))
+            changes.append(models.Change(
+                action=models.Change.CREATE, resource_id=pk,
+                parent_id=parent.id, is_collection=spec['is_collection'],
+                namespace=parent.namespace, path=path))
+            if spec['metadata']:
+                metadata.append(models.Metadata(
+                    object_id=pk, content_type=self.content_type,
+                    data=spec['metadata']))
+                if not self.defer_indexes:
+                    metadata_index.extend(
+                        models.MetadataIndex.from_data(pk, spec['metadata']))
+
+        models.ResourceClosure.objects.using(self.using).bulk_create(links)
+        models.Metadata.objects.using(self.using).bulk_create(metadata)
+        models.MetadataIndex.objects.using(self.using).bulk_create(
+            metadata_index)
+        models.NameTrigram.objects.using(self.using).bulk_create(trigrams)
+        models.Change.objects.using(self.using).bulk_create(changes)
+        if not self.defer_indexes:
+            self.flush_rollups()
+            self.invalidate_cache(batch, bool(files))
+        self.created += len(resources)
+        return collections
+
+    def flush_rollups(self):
+        """ Applies accumulated rollup deltas of parent collections."""
+        models.apply_rollup_deltas(self.rollups, using=self.using)
+        self.rollups.clear()
+
+    def finish(self):
+        """
+        Builds deferred indexes and rollups, invalidates cached responses.
+        """
+        self.build_indexes()
+        totals = any(size or files for size, files, _ in
+                     self.rollups.values())
+        self.flush_rollups()
+        self.invalidate_cache([(parent, None) for parent in
+                               self.root_parents.values()], totals)
+        self.collection_ids.clear()
+        self.root_ids = []
+        self.root_parents.clear()
+
+    def build_indexes(self):
+        """
+        Builds name trigrams and metadata index of resources inserted with
+        deferred indexes.
+
+        Inserted subtrees are read in batches of ids, with a fixed number
+        of queries per batch.
+        """
+        resources = models.Resource.objects.using(self.using)
+        for root in self.root_ids:
+            last = 0
+            while True:
+                rows = list(resources.filter(
+                    ancestor_links__ancestor=root, pk__gt=last).order_by(
+                    'pk').values_list('pk', 'name')[:self.batch_size])
+                if not rows:
+                    break
+                last = rows[-1][0]
+                metadata = models.Metadata.objects.using(self.using).filter(
+                    content_type=self.content_type,
+                    object_id__in=[pk for pk, _ in rows]).values_list(
+                    'object_id', 'data')
+                models.NameTrigram.objects.using(self.using).bulk_create(
+                    models.NameTrigram(resource_id=pk, trigram=t)
+                    for pk, name in rows for t in models.name_trigrams(name))
+                models.MetadataIndex.objects.using(self.using).bulk_create(
+                    row for pk, data in metadata
+                    for row in models.MetadataIndex.from_data(pk, data))
+
+    def invalidate_cache(self, batch, totals):
+        """ Invalidates cached responses of parents of inserted resources."""
+        paths = defaultdict(set)
+        for parent, _ in batch:
+            if totals:
+                paths[parent.namespace].update(
+                    cache.ancestor_paths(parent.path))
+            else:
+                # parent is touched, its listing in grandparent changes too
+                paths[parent.namespace].update(
+                    [parent.path, cache.parent_path(parent.path)])
+        for namespace, namespace_paths in paths.items():
+            cache.invalidate(namespace_paths, using=self.using,
+                             namespace=namespace)
+
+    def insert_resources(self, resources):
+        """ Inserts resource rows and returns their ids."""
+        manager = models.Resource.objects.using(self.using)
+        resources = manager.bulk_create(resources)
+        if all(r.pk for r in resources):
+            return [r.pk for r in resources]
+        # backend doesn't return ids from bulk insert, path is unique
+        # within namespace of batch
+        paths = [r.path for r in resources]
+        ids = dict(manager.filter(
+            namespace=resources[0].namespace,
+            path__in=paths).values_list('path', 'id'))
+        return [ids[p] for p in paths]
+
+
+def create_tree(parent, nodes, batch_size=None):
+    """ Creates nested nodes under parent collection, returns count."""
+    return TreeBuilder(batch_size=batch_size).create_tree(parent, nodes)
+
+
+def subtree_to_tree(resource):
+    """
+    Returns nested node of resource with whole subtree.
+
+    Subtree is loaded with one closure query plus one for metadata.
+    """
+    rows = resource.descendants(include_self=True).with_metadata().rows()
+    nodes = {}
+    children = defaultdict(list)
+    for row in rows:
+        node = {
+            'name': row['name'],
+            'is_collection': row['is_collection'],
+            'size': row['size'],
+            'metadata': row['metadata'],
+        }
+        nodes[row['id']] = node
+        children[row['parent_id']].append(node)
+    for pk, node in nodes.items():
+        node['children'] = children[pk]
+    return nodes[resource.pk]
+
+
+def copy_tree(resource, parent, name=None, batch_size=None):
+    """
+    Copies resource with whole subtree to parent collection.
+
+    Returns number of created resources.
+    """
+    if resource.is_ancestor_of(parent.pk):
+        raise ValidationError('Resource cannot be copied into itself')
+    node = subtree_to_tree(resource)
+    node['name'] = name or resource.name
+    return create_tree(parent, [node], batch_size=batch_size)
@@ -0,0 +1,122 @@
+# coding: utf-8
+"""
+Shared cache of rendered resource responses.
+
+Enabled by FCI_CACHE setting naming one of CACHES aliases. Responses are
+keyed by namespace, resource path, request variant and generation tokens,
+so cache hits don't touch the database at all. Writes invalidate entries
+by dropping generation tokens:
+
+* node token of a path covers representation of resource at that path;
+* subtree token of a path covers all paths below it (moves and deletes).
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+
+def get_cache():
+    """ Returns configured cache or None if caching is disabled."""
+    alias = getattr(settings, 'FCI_CACHE', None)
+    if not alias:
+        return None
+    return caches[alias]
+
+
+def get_timeout():
+    return getattr(settings, 'FCI_CACHE_TIMEOUT', 300)
+
+
+def parent_path(path):
+    """ Returns path of parent collection, None for root."""
+    if not path:
+        return None
+    return path.rsplit('/', 1)[0] if '/' in path else ''
+
+
+def ancestor_paths(path):
+    """ Returns paths from root down to path itself."""
+    if not path:
+        return ['']
+    parts = path.split('/')
+    return [''] + ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+def digest(value):
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+
+def node_key(path, namespace=''):
+    return 'fci:node:%s:%s' % (namespace, digest(path))
+
+
+def subtree_key(path, namespace=''):
+    return 'fci:tree:%s:%s' % (namespace, digest(path))
+
+
+def get_response_key(cache, path, variant, namespace=''):
+    """
+    Returns cache key of response for resource path and request variant.
+
+    Must be called before resource is read from database: tokens dropped
+    by concurrent writes make the key stale.
+    """
+    keys = [node_key(path, namespace)] + [subtree_key(p, namespace)
+                                          for p in ancestor_paths(path)]
+    tokens = cache.get_many(keys)
+    missing = dict((k, uuid.uuid4().hex) for k in keys if k not in tokens)
+    if missing:
+        cache.set_many(missing, None)
+        tokens.update(missing)
+    key = '\n'.join([variant] + [tokens[k] for k in keys])
+    return 'fci:response:%s' % digest(key)
+
+
+def get_response(cache, key):
+    """ Returns cached response or None."""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    content, headers = entry
+    response = HttpResponse(content)
+    for header, value in headers:
+        response[header] = value
+    return response
+
+
+def store_response(cache, key, response):
+    """ Stores rendered response in cache."""
+    if response.status_code != 200 or response.streaming:
+        return
+    headers = list(response.items())
+    cache.set(key, (response.content, headers), get_timeout())
+
+
+def invalidate(paths=(), subtree_paths=(), using=None, namespace=''):
+    """
+    Invalidates cached responses.
+
+    :param paths: paths of resources with changed representation.
+    :param subtree_paths: paths of moved or deleted subtrees.
+    :param using: database alias, invalidation is repeated after commit
+        to drop entries computed from data read before it.
+    :param namespace: namespace of all paths.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+    keys = [node_key(p, namespace) for p in paths if p is not None]
+    keys.extend(subtree_key(p, namespace) for p in subtree_paths
+                if p is not None)
+    if not keys:
+        return
+
+    def delete():
+        cache.delete_many(keys)
+
+    delete()
+    transaction.on_commit(delete, using=using)
@@ -0,0 +1,72 @@
+# coding: utf-8
+"""
+Conditional GET support for resource responses.
+
+ETag is computed from resource id, version and modification time, so it
+is known right after path resolution, before children or metadata are
+loaded. Collections have no Last-Modified: their listings change when
+modification time of a child changes, while their own one stays.
+"""
+import calendar
+import hashlib
+
+from django.utils.http import http_date, parse_http_date_safe
+
+
+def get_etag(request, instance):
+    """ Returns strong ETag of resource representation for request."""
+    # representation depends on query parameters (page, filters) too
+    key = '%s:%s:%s:%s:%s' % (instance.pk, instance.version,
+                              instance.modified.isoformat(),
+                              request.get_full_path(),
+                              request.META.get('HTTP_ACCEPT', ''))
+    return '"%s"' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def get_last_modified(instance):
+    """
+    Returns resource modification time as unix timestamp, None for
+    collections.
+    """
+    if instance.is_collection:
+        return None
+    return calendar.timegm(instance.modified.utctimetuple())
+
+
+def parse_etags(header):
+    """ Returns list of entity tags from If-None-Match header."""
+    etags = []
+    for etag in header.split(','):
+        etag = etag.strip()
+        if etag.startswith('W/'):
+            # If-None-Match uses weak comparison
+            etag = etag[2:]
+        if etag:
+            etags.append(etag)
+    return etags
+
+
+def is_not_modified(request, etag, last_modified):
+    """
+    Checks If-None-Match and If-Modified-Since request headers.
+
+    If-Modified-Since is ignored when If-None-Match is present or
+    last_modified is None.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag in etags or '*' in etags
+    if last_modified is None:
+        return False
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and \
+        last_modified <= if_modified_since
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,75 @@
+# coding: utf-8
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from fci.index.models import prefix_range
+
+
+class MetadataFilter(BaseFilterBackend):
+    """
+    Filters resources by indexed metadata values.
+
+    Query parameters look like "meta.<key>=<value>" for equality and
+    "meta.<key>__<lookup>=<value>" for prefix and range lookups. Range
+    lookups use numeric value when argument is a number. Every filter is
+    a join to MetadataIndex backed by (key, value) or (key, number) index.
+    """
+
+    prefix = 'meta.'
+    range_lookups = ('gt', 'gte', 'lt', 'lte')
+    lookups = ('startswith',) + range_lookups
+
+    def parse_param(self, param):
+        """ Returns (key, lookup) pair for query parameter name."""
+        key = param[len(self.prefix):]
+        lookup = 'exact'
+        if '__' in key:
+            name, suffix = key.rsplit('__', 1)
+            if suffix in self.lookups:
+                key, lookup = name, suffix
+        if not key:
+            raise ValidationError({param: 'Metadata key is required'})
+        return key, lookup
+
+    def get_lookups(self, key, lookup, value):
+        lookups = {'metadata_index__key': key}
+        if lookup == 'exact':
+            lookups['metadata_index__value'] = value
+        elif lookup == 'startswith':
+            if value:
+                lookups.update(prefix_range('metadata_index__value', value))
+        else:
+            try:
+                lookups['metadata_index__number__' + lookup] = float(value)
+            except ValueError:
+                lookups['metadata_index__value__' + lookup] = value
+        return lookups
+
+    def filter_queryset(self, request, queryset, view):
+        for param, values in request.query_params.lists():
+            if not param.startswith(self.prefix):
+                continue
+            key, lookup = self.parse_param(param)
+            for value in values:
+                # separate filter() calls join separate index rows
+                queryset = queryset.filter(
+                    **self.get_lookups(key, lookup, value))
+        return queryset
+
+
+class NameFilter(BaseFilterBackend):
+    """
+    Filters resources by name.
+
+    Supports "glob" (with "*", "?" and "[...]" wildcards), "prefix",
+    "suffix" and "contains" query parameters.
+    """
+
+    params = ('glob', 'prefix', 'suffix', 'contains')
+
+    def filter_queryset(self, request, queryset, view):
+        for param in self.params:
+            value = request.query_params.get(param)
+            if value:
+                queryset = getattr(queryset, 'name_' + param)(value)
+        return queryset
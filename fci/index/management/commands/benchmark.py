@@ -0,0 +1,61 @@
+# coding: utf-8
+import json
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from fci.index import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks hot paths on synthetic trees and prints results as '
+            'JSON. All changes are rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10,
+                            help='Number of runs of each scenario')
+        parser.add_argument('--scenario', action='append', default=None,
+                            choices=list(benchmark.QUERY_BUDGETS),
+                            help='Scenario to run (all by default)')
+        parser.add_argument('--tree', action='append', default=None,
+                            choices=list(benchmark.DEFAULT_TREES),
+                            help='Tree kind to build (all by default)')
+        parser.add_argument('--depth', type=int, default=None,
+                            help='Depth of chain and mixed trees')
+        parser.add_argument('--width', type=int, default=None,
+                            help='Width of wide tree')
+        parser.add_argument('--check', action='store_true', default=False,
+                            help='Fail if query budget is exceeded')
+
+    def get_trees(self, options):
+        trees = OrderedDict()
+        for kind, params in benchmark.DEFAULT_TREES.items():
+            if options['tree'] and kind not in options['tree']:
+                continue
+            params = dict(params)
+            if options['depth'] and 'depth' in params:
+                params['depth'] = options['depth']
+            if options['width'] and 'width' in params:
+                params['width'] = options['width']
+            trees[kind] = params
+        return trees
+
+    def handle(self, *args, **options):
+        trees = self.get_trees(options)
+        # test client requests are sent to "testserver" host
+        with override_settings(ALLOWED_HOSTS=['*']):
+            with transaction.atomic():
+                results = benchmark.run(trees=trees,
+                                        scenarios=options['scenario'],
+                                        repeat=options['repeat'])
+                transaction.set_rollback(True)
+        self.stdout.write(json.dumps(results, indent=2))
+        if options['check']:
+            exceeded = ['%(scenario)s on %(tree)s tree: %(queries)s > '
+                        '%(budget)s' % r for r in results
+                        if r['queries'] > r['budget']]
+            if exceeded:
+                raise CommandError('Query budget exceeded: %s' %
+                                   '; '.join(exceeded))
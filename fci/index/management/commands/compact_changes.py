@@ -0,0 +1,25 @@
+# coding: utf-8
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from fci.index import models
+
+
+class Command(BaseCommand):
+    help = 'Deletes change journal entries older than retention window.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Retention window in days (default is '
+                                 'FCI_CHANGES_RETENTION_DAYS setting)')
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = getattr(settings, 'FCI_CHANGES_RETENTION_DAYS', 30)
+        before = timezone.now() - timedelta(days=days)
+        count = models.Change.compact(before)
+        self.stdout.write('Deleted %d journal entries' % count)
@@ -0,0 +1,39 @@
+# coding: utf-8
+from django.core.management.base import BaseCommand, CommandError
+
+from fci.index import models, snapshot
+
+
+class Command(BaseCommand):
+    help = 'Exports FCI tree or subtree to NDJSON snapshot.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='',
+                            help='Path of exported resource (root by '
+                                 'default)')
+        parser.add_argument('--namespace', default='',
+                            help='Namespace of exported resource')
+        parser.add_argument('--output', default='-',
+                            help='Snapshot file, "-" for stdout')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Number of resources read at once')
+
+    def handle(self, *args, **options):
+        try:
+            resource = models.Resource.objects.at_path(
+                options['path'].strip('/'), options['namespace']).get()
+        except models.Resource.DoesNotExist:
+            raise CommandError('Resource does not exist')
+        lines = snapshot.export_lines(resource,
+                                      chunk_size=options['chunk_size'])
+        if options['output'] == '-':
+            for line in lines:
+                self.stdout.write(line)
+            return
+        # first line is header
+        count = -1
+        with open(options['output'], 'w') as output:
+            for line in lines:
+                output.write(line + '\n')
+                count += 1
+        self.stdout.write('Exported %d resources' % count)
@@ -0,0 +1,42 @@
+# coding: utf-8
+import sys
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from fci.index import models, snapshot
+
+
+class Command(BaseCommand):
+    help = 'Imports NDJSON snapshot made by export_tree into FCI collection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Snapshot file, "-" for stdin')
+        parser.add_argument('--target', default='',
+                            help='Path of existing FCI collection to import '
+                                 'into (root by default)')
+        parser.add_argument('--namespace', default='',
+                            help='Namespace of target collection')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Number of resources inserted at once')
+
+    def handle(self, *args, **options):
+        try:
+            target = models.Resource.objects.at_path(
+                options['target'].strip('/'), options['namespace']).get()
+        except models.Resource.DoesNotExist:
+            raise CommandError('Target collection does not exist')
+        importer = snapshot.TreeImporter(target,
+                                         batch_size=options['batch_size'])
+        started = time.time()
+        try:
+            if options['input'] == '-':
+                count = importer.run(sys.stdin)
+            else:
+                with open(options['input']) as lines:
+                    count = importer.run(lines)
+        except ValidationError as e:
+            raise CommandError('; '.join(e.messages))
+        self.stdout.write('Imported %d resources in %.1fs' %
+                          (count, time.time() - started))
@@ -0,0 +1,205 @@
+# coding: utf-8
+import mimetypes
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from fci.index import bulk, models
+
+try:
+    from os import scandir
+except ImportError:  # pragma: no cover
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+NAME_MAX_LENGTH = models.Resource._meta.get_field('name').max_length
+
+
+def is_valid_name(name):
+    if len(name) > NAME_MAX_LENGTH:
+        return False
+    try:
+        name.encode('utf-8')
+    except UnicodeError:
+        return False
+    return True
+
+
+def scan_directory(local_path, mtime=False, mime_type=False):
+    """
+    Lists local directory.
+
+    Returns (nodes, error) pair, where nodes are bulk create specs with
+    extra "local_path" key for subdirectories.
+    """
+    nodes = []
+    try:
+        entries = list(scandir(local_path))
+    except OSError as e:
+        return nodes, e
+    for entry in entries:
+        if not is_valid_name(entry.name):
+            continue
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                is_collection = True
+            elif entry.is_file(follow_symlinks=False):
+                is_collection = False
+            else:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        metadata = {}
+        if mtime:
+            metadata['mtime'] = stat.st_mtime
+        if mime_type and not is_collection:
+            guessed = mimetypes.guess_type(entry.name)[0]
+            if guessed:
+                metadata['mime-type'] = guessed
+        node = {
+            'name': entry.name,
+            'is_collection': is_collection,
+            'size': 0 if is_collection else stat.st_size,
+            'metadata': metadata,
+        }
+        if is_collection:
+            node['local_path'] = entry.path
+        nodes.append(node)
+    return nodes, None
+
+
+class Command(BaseCommand):
+    help = 'Indexes local directory tree into FCI collection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Local directory to index')
+        parser.add_argument('--target', default='',
+                            help='Path of existing FCI collection to index '
+                                 'into (root by default)')
+        parser.add_argument('--namespace', default='',
+                            help='Namespace of target collection')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Number of resources inserted at once')
+        parser.add_argument('--threads', type=int, default=1,
+                            help='Number of threads scanning directories')
+        parser.add_argument('--resume', action='store_true', default=False,
+                            help='Skip resources indexed by previous run')
+        parser.add_argument('--mtime', action='store_true', default=False,
+                            help='Store modification time in metadata')
+        parser.add_argument('--mime-type', action='store_true',
+                            default=False,
+                            help='Store guessed mime type in metadata')
+        parser.add_argument('--progress', type=int, default=10000,
+                            help='Report progress every N resources')
+
+    def handle(self, *args, **options):
+        if scandir is None:
+            raise CommandError('scandir package is required on Python 2')
+        source = os.path.abspath(options['source'])
+        if not os.path.isdir(source):
+            raise CommandError('%s is not a directory' % source)
+        try:
+            target = models.Resource.objects.polymorphic().at_path(
+                options['target'].strip('/'), options['namespace']).get()
+        except models.Resource.DoesNotExist:
+            raise CommandError('Target collection does not exist')
+        if not target.is_collection:
+            raise CommandError('Target must be a collection')
+
+        self.options = options
+        self.resume = options['resume']
+        self.builder = bulk.TreeBuilder(batch_size=options['batch_size'])
+        self.batch_size = self.builder.batch_size
+        self.started = time.time()
+        self.reported = 0
+
+        executor = None
+        if options['threads'] > 1:
+            try:
+                from concurrent.futures import ThreadPoolExecutor
+            except ImportError:  # pragma: no cover
+                raise CommandError('futures package is required on Python 2')
+            executor = ThreadPoolExecutor(max_workers=options['threads'])
+        try:
+            self.index(bulk.get_parent_info(target), source, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        elapsed = time.time() - self.started
+        self.stdout.write('Indexed %d resources in %.1fs' %
+                          (self.builder.created, elapsed))
+
+    def scan(self, local_path):
+        return scan_directory(local_path, mtime=self.options['mtime'],
+                              mime_type=self.options['mime_type'])
+
+    def index(self, target, source, executor):
+        # depth-first order keeps queue of unscanned directories small
+        stack = [(target, source)]
+        pending = []
+        window = max(self.options['threads'], 1) * 4
+        while stack or pending:
+            chunk = [stack.pop() for _ in range(min(len(stack), window))]
+            paths = [local_path for _, local_path in chunk]
+            if executor is not None:
+                results = executor.map(self.scan, paths)
+            else:
+                results = map(self.scan, paths)
+            for (info, local_path), (nodes, error) in zip(chunk, results):
+                if error is not None:
+                    self.stderr.write('Skipping %s: %s' % (local_path, error))
+                    continue
+                if self.resume:
+                    nodes = self.skip_existing(info, nodes, stack)
+                pending.extend((info, node) for node in nodes)
+                while len(pending) >= self.batch_size:
+                    self.flush(pending[:self.batch_size], stack)
+                    del pending[:self.batch_size]
+            if not stack and pending:
+                self.flush(pending, stack)
+                pending = []
+
+    def skip_existing(self, info, nodes, stack):
+        """
+        Filters out already indexed nodes, queues existing subdirectories.
+        """
+        existing = models.Resource.objects.filter(parent=info.id).values_list(
+            'name', 'id', 'is_collection')
+        existing = dict((name, (pk, c)) for name, pk, c in existing)
+        if not existing:
+            return nodes
+        result = []
+        for node in nodes:
+            if node['name'] not in existing:
+                result.append(node)
+                continue
+            pk, is_collection = existing[node['name']]
+            if is_collection and node['is_collection']:
+                path = bulk.join_path(info.path, node['name'])
+                ancestors = [(pk, 0)] + [(a, d + 1) for a, d in info.ancestors]
+                stack.append((bulk.ParentInfo(pk, info.namespace, path,
+                                              ancestors),
+                              node['local_path']))
+        return result
+
+    def flush(self, batch, stack):
+        try:
+            with transaction.atomic(using=self.builder.using):
+                collections = self.builder.insert_batch(batch)
+        except IntegrityError:
+            raise CommandError('Resources already exist, use --resume')
+        for info, node in collections:
+            stack.append((info, node['local_path']))
+        if self.builder.created - self.reported >= self.options['progress']:
+            self.reported = self.builder.created
+            elapsed = time.time() - self.started
+            self.stdout.write(
+                'Indexed %d resources, %d directories queued, %.0f/s' %
+                (self.builder.created, len(stack),
+                 self.builder.created / max(elapsed, 0.001)))
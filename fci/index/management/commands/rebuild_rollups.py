@@ -0,0 +1,12 @@
+# coding: utf-8
+from django.core.management.base import BaseCommand
+
+from fci.index import models
+
+
+class Command(BaseCommand):
+    help = 'Recomputes directory size and count rollups.'
+
+    def handle(self, *args, **options):
+        count = models.rebuild_rollups()
+        self.stdout.write('Rebuilt rollups of %d directories' % count)
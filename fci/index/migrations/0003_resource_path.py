@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+
+
+# number of rows updated with one statement
+BATCH_SIZE = 100
+
+
+def hash_path(path):
+    return hashlib.md5(path.encode('utf-8')).hexdigest()
+
+
+def update_paths(Resource, paths):
+    """ Sets paths of a batch of resources with one statement."""
+    values = {}
+    for field, func in (('path', lambda p: p), ('path_hash', hash_path)):
+        whens = [models.When(pk=pk, then=models.Value(func(path)))
+                 for pk, path in paths]
+        values[field] = models.Case(*whens, output_field=models.CharField())
+    Resource.objects.filter(pk__in=[pk for pk, _ in paths]).update(**values)
+
+
+def fill_paths(apps, schema_editor):
+    """
+    Computes materialized paths top-down starting from root.
+
+    Each level is read in chunks of parents and written in batches, so
+    neither the whole table nor a statement per row is needed.
+    """
+    Resource = apps.get_model('index', 'Resource')
+    Resource.objects.filter(parent=None).update(path_hash=hash_path(''))
+    level = list(Resource.objects.filter(
+        parent=None, is_collection=True).values_list('id', flat=True))
+    while level:
+        next_level = []
+        for start in range(0, len(level), BATCH_SIZE):
+            chunk = level[start:start + BATCH_SIZE]
+            parent_paths = dict(Resource.objects.filter(
+                pk__in=chunk).values_list('id', 'path'))
+            children = Resource.objects.filter(parent_id__in=chunk)
+            paths = []
+            for pk, name, parent_id, is_collection in children.values_list(
+                    'id', 'name', 'parent_id', 'is_collection').iterator():
+                parent_path = parent_paths[parent_id]
+                paths.append((pk, '%s/%s' % (parent_path, name)
+                               if parent_path else name))
+                if is_collection:
+                    next_level.append(pk)
+                if len(paths) >= BATCH_SIZE:
+                    update_paths(Resource, paths)
+                    paths = []
+            if paths:
+                update_paths(Resource, paths)
+        level = next_level
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0002_metadata_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=4096),
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='path_hash',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='resource',
+            name='path_hash',
+            field=models.CharField(default='', editable=False, max_length=32, unique=True),
+        ),
+    ]
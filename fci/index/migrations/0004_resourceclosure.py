@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+# number of parents read or links inserted with one statement
+BATCH_SIZE = 100
+
+
+def fill_closure(apps, schema_editor):
+    """
+    Builds closure table top-down starting from root.
+
+    Each level is read in chunks of parents, ancestors of parents are read
+    back from closure table and links are inserted in batches, so neither
+    the whole level nor one statement for it is needed.
+    """
+    Resource = apps.get_model('index', 'Resource')
+    ResourceClosure = apps.get_model('index', 'ResourceClosure')
+    roots = Resource.objects.filter(parent=None)
+    ResourceClosure.objects.bulk_create(
+        [ResourceClosure(ancestor_id=pk, descendant_id=pk, depth=0)
+         for pk in roots.values_list('id', flat=True)],
+        batch_size=BATCH_SIZE)
+    level = list(roots.filter(is_collection=True).values_list(
+        'id', flat=True))
+    while level:
+        next_level = []
+        for start in range(0, len(level), BATCH_SIZE):
+            chunk = level[start:start + BATCH_SIZE]
+            ancestors = defaultdict(list)
+            for pk, ancestor_id, depth in ResourceClosure.objects.filter(
+                    descendant_id__in=chunk).values_list(
+                    'descendant_id', 'ancestor_id', 'depth'):
+                ancestors[pk].append((ancestor_id, depth))
+            children = Resource.objects.filter(parent_id__in=chunk)
+            links = []
+            for pk, parent_id, is_collection in children.values_list(
+                    'id', 'parent_id', 'is_collection').iterator():
+                links.append(ResourceClosure(ancestor_id=pk, descendant_id=pk,
+                                             depth=0))
+                links.extend(ResourceClosure(ancestor_id=a, descendant_id=pk,
+                                             depth=d + 1)
+                             for a, d in ancestors[parent_id])
+                if is_collection:
+                    next_level.append(pk)
+                if len(links) >= BATCH_SIZE:
+                    ResourceClosure.objects.bulk_create(links)
+                    links = []
+            ResourceClosure.objects.bulk_create(links)
+        level = next_level
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0003_resource_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(related_name='descendant_links', to='index.Resource')),
+                ('descendant', models.ForeignKey(related_name='ancestor_links', to='index.Resource')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='resourceclosure',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='resourceclosure',
+            index_together=set([('descendant', 'depth')]),
+        ),
+        migrations.RunPython(fill_closure, migrations.RunPython.noop),
+    ]
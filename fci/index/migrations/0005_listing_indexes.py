@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0004_resourceclosure'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='resource',
+            index_together=set([('parent', 'name', 'id'), ('parent', 'modified', 'id')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0005_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='resourceclosure',
+            index_together=set([('descendant', 'depth'), ('ancestor', 'depth')]),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_rollups(apps, schema_editor):
+    """ Computes directory rollups using closure table."""
+    qn = schema_editor.connection.ops.quote_name
+    Directory = apps.get_model('index', 'Directory')
+    File = apps.get_model('index', 'File')
+    Resource = apps.get_model('index', 'Resource')
+    ResourceClosure = apps.get_model('index', 'ResourceClosure')
+    sql = """
+        UPDATE {directory} SET
+        total_size = COALESCE((
+            SELECT SUM(f.size) FROM {closure} c
+            INNER JOIN {file} f ON f.resource_ptr_id = c.descendant_id
+            WHERE c.ancestor_id = {directory}.resource_ptr_id), 0),
+        file_count = (
+            SELECT COUNT(*) FROM {closure} c
+            INNER JOIN {file} f ON f.resource_ptr_id = c.descendant_id
+            WHERE c.ancestor_id = {directory}.resource_ptr_id),
+        child_count = (
+            SELECT COUNT(*) FROM {resource} r
+            WHERE r.parent_id = {directory}.resource_ptr_id)
+    """.format(directory=qn(Directory._meta.db_table),
+               file=qn(File._meta.db_table),
+               closure=qn(ResourceClosure._meta.db_table),
+               resource=qn(Resource._meta.db_table))
+    schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0006_closure_depth_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directory',
+            name='child_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='directory',
+            name='file_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='directory',
+            name='total_size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
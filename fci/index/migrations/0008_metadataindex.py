@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+import six
+from django.db import migrations, models
+
+
+# number of metadata rows read at once
+BATCH_SIZE = 500
+
+
+def index_rows(MetadataIndex, object_id, data):
+    if isinstance(data, six.string_types):
+        data = json.loads(data or '{}')
+    for key, value in (data or {}).items():
+        if isinstance(value, bool):
+            text, number = 'true' if value else 'false', None
+        elif isinstance(value, six.integer_types + (float,)):
+            text, number = json.dumps(value), value
+        elif isinstance(value, six.string_types):
+            text, number = value, None
+        else:
+            continue
+        if len(key) > 255 or len(text) > 255:
+            continue
+        yield MetadataIndex(resource_id=object_id, key=key, value=text,
+                            number=number)
+
+
+def fill_metadata_index(apps, schema_editor):
+    """ Indexes existing metadata in batches."""
+    Metadata = apps.get_model('index', 'Metadata')
+    MetadataIndex = apps.get_model('index', 'MetadataIndex')
+    metadata = Metadata.objects.order_by('pk').values_list(
+        'pk', 'object_id', 'data')
+    last = 0
+    while True:
+        rows = list(metadata.filter(pk__gt=last)[:BATCH_SIZE])
+        if not rows:
+            break
+        MetadataIndex.objects.bulk_create(
+            row for _, object_id, data in rows
+            for row in index_rows(MetadataIndex, object_id, data))
+        last = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0007_directory_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetadataIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('value', models.CharField(max_length=255)),
+                ('number', models.FloatField(null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='metadataindex',
+            name='resource',
+            field=models.ForeignKey(related_name='metadata_index', to='index.Resource'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='metadataindex',
+            unique_together=set([('resource', 'key')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='metadataindex',
+            index_together=set([('key', 'number'), ('key', 'value')]),
+        ),
+        migrations.RunPython(fill_metadata_index, migrations.RunPython.noop),
+    ]
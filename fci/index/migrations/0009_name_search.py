@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# number of resources processed with one statement
+BATCH_SIZE = 100
+
+
+def fill_batch(Resource, NameTrigram, rows):
+    """ Sets reversed names and inserts trigrams of a batch of resources."""
+    whens = [models.When(pk=pk, then=models.Value(name[::-1]))
+             for pk, name in rows]
+    Resource.objects.filter(pk__in=[pk for pk, _ in rows]).update(
+        reversed_name=models.Case(*whens, output_field=models.CharField()))
+    NameTrigram.objects.bulk_create(
+        NameTrigram(resource_id=pk, trigram=trigram)
+        for pk, name in rows
+        for trigram in set(name[i:i + 3] for i in range(len(name) - 2)))
+
+
+def fill_names(apps, schema_editor):
+    """ Indexes names of existing resources in batches."""
+    Resource = apps.get_model('index', 'Resource')
+    NameTrigram = apps.get_model('index', 'NameTrigram')
+    resources = Resource.objects.order_by('pk').values_list('id', 'name')
+    last = 0
+    while True:
+        rows = list(resources.filter(pk__gt=last)[:BATCH_SIZE])
+        if not rows:
+            break
+        fill_batch(Resource, NameTrigram, rows)
+        last = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0008_metadataindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NameTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='reversed_name',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AlterIndexTogether(
+            name='resource',
+            index_together=set([('parent', 'modified', 'id'), ('name', 'id'), ('reversed_name', 'id'), ('parent', 'name', 'id')]),
+        ),
+        migrations.AddField(
+            model_name='nametrigram',
+            name='resource',
+            field=models.ForeignKey(related_name='name_trigrams', to='index.Resource'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='nametrigram',
+            unique_together=set([('trigram', 'resource')]),
+        ),
+        migrations.RunPython(fill_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0009_name_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0010_resource_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, db_index=True)),
+                ('action', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('move', 'Move'), ('rename', 'Rename'), ('metadata', 'Metadata change'), ('delete', 'Delete')], max_length=10)),
+                ('resource_id', models.IntegerField(db_index=True)),
+                ('parent_id', models.IntegerField(null=True)),
+                ('is_collection', models.BooleanField(default=False)),
+                ('path', models.CharField(db_index=True, max_length=4096)),
+                ('old_path', models.CharField(db_index=True, max_length=4096, null=True)),
+            ],
+        ),
+    ]
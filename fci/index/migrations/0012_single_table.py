@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# subclass model -> fields moved to resource table, subclass fields are
+# renamed to "old_<field>" first to avoid clash with resource fields
+SUBCLASS_FIELDS = (
+    ('Directory', True, ('total_size', 'file_count', 'child_count')),
+    ('File', False, ('size',)),
+)
+
+
+def get_content_type(apps, model):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    ct, _ = ContentType.objects.get_or_create(app_label='index', model=model)
+    return ct
+
+
+def merge_tables(apps, schema_editor):
+    Resource = apps.get_model('index', 'Resource')
+    Metadata = apps.get_model('index', 'Metadata')
+    qn = schema_editor.connection.ops.quote_name
+    resource = qn(Resource._meta.db_table)
+    for name, _, fields in SUBCLASS_FIELDS:
+        table = qn(apps.get_model('index', name)._meta.db_table)
+        assignments = ', '.join(
+            '{field} = (SELECT s.{old} FROM {table} s '
+            'WHERE s.resource_ptr_id = {resource}.id)'.format(
+                field=qn(f), old=qn('old_' + f), table=table,
+                resource=resource) for f in fields)
+        schema_editor.execute(
+            'UPDATE {resource} SET {assignments} WHERE id IN '
+            '(SELECT resource_ptr_id FROM {table})'.format(
+                resource=resource, assignments=assignments, table=table))
+    # proxy models share content type of resource
+    Metadata.objects.filter(
+        content_type__app_label='index',
+        content_type__model__in=['directory', 'file']).update(
+        content_type=get_content_type(apps, 'resource'))
+
+
+def split_tables(apps, schema_editor):
+    Resource = apps.get_model('index', 'Resource')
+    Metadata = apps.get_model('index', 'Metadata')
+    qn = schema_editor.connection.ops.quote_name
+    resource_ct = get_content_type(apps, 'resource')
+    for name, is_collection, fields in SUBCLASS_FIELDS:
+        table = qn(apps.get_model('index', name)._meta.db_table)
+        schema_editor.execute(
+            'INSERT INTO {table} (resource_ptr_id, {old}) '
+            'SELECT id, {columns} FROM {resource} '
+            'WHERE is_collection = %s'.format(
+                table=table, old=', '.join(qn('old_' + f) for f in fields),
+                columns=', '.join(qn(f) for f in fields),
+                resource=qn(Resource._meta.db_table)), [is_collection])
+        resources = Resource.objects.filter(is_collection=is_collection)
+        Metadata.objects.filter(
+            content_type=resource_ct,
+            object_id__in=resources.values('pk')).update(
+            content_type=get_content_type(apps, name.lower()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0011_change'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='directory',
+            old_name='total_size',
+            new_name='old_total_size',
+        ),
+        migrations.RenameField(
+            model_name='directory',
+            old_name='file_count',
+            new_name='old_file_count',
+        ),
+        migrations.RenameField(
+            model_name='directory',
+            old_name='child_count',
+            new_name='old_child_count',
+        ),
+        migrations.RenameField(
+            model_name='file',
+            old_name='size',
+            new_name='old_size',
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='child_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='file_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='size',
+            field=models.BigIntegerField(blank=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='total_size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(merge_tables, split_tables),
+        migrations.DeleteModel(
+            name='Directory',
+        ),
+        migrations.DeleteModel(
+            name='File',
+        ),
+        migrations.CreateModel(
+            name='Directory',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+            },
+            bases=('index.resource',),
+        ),
+        migrations.CreateModel(
+            name='File',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+            },
+            bases=('index.resource',),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# indexed prefix of path on MySQL, whole path exceeds index key size limit
+MYSQL_PATH_PREFIX = 255
+PATH_INDEX = ('namespace', 'path')
+
+
+def add_path_index(apps, schema_editor):
+    Resource = apps.get_model('index', 'Resource')
+    if schema_editor.connection.vendor != 'mysql':
+        schema_editor.alter_index_together(Resource, [], [PATH_INDEX])
+        return
+    qn = schema_editor.quote_name
+    name = schema_editor._create_index_name(Resource, list(PATH_INDEX),
+                                            suffix='_idx')
+    schema_editor.execute('CREATE INDEX %s ON %s (%s, %s(%d))' % (
+        qn(name), qn(Resource._meta.db_table), qn('namespace'), qn('path'),
+        MYSQL_PATH_PREFIX))
+
+
+def remove_path_index(apps, schema_editor):
+    Resource = apps.get_model('index', 'Resource')
+    schema_editor.alter_index_together(Resource, [PATH_INDEX], [])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0012_single_table'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='change',
+            name='namespace',
+            field=models.SlugField(blank=True, db_index=False, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='namespace',
+            field=models.SlugField(blank=True, db_index=False, default='', editable=False, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='change',
+            name='old_path',
+            field=models.CharField(max_length=4096, null=True),
+        ),
+        migrations.AlterField(
+            model_name='change',
+            name='path',
+            field=models.CharField(max_length=4096),
+        ),
+        migrations.AlterField(
+            model_name='resource',
+            name='path_hash',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AlterUniqueTogether(
+            name='resource',
+            unique_together=set([('namespace', 'path_hash'), ('name', 'parent')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='change',
+            index_together=set([('namespace', 'id'), ('namespace', 'old_path'), ('namespace', 'path')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='resource',
+            index_together=set([('namespace', 'name', 'id'), ('namespace', 'reversed_name', 'id'), ('parent', 'modified', 'id'), ('parent', 'name', 'id')]),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(add_path_index, remove_path_index),
+            ],
+            state_operations=[
+                migrations.AlterIndexTogether(
+                    name='resource',
+                    index_together=set([('namespace', 'name', 'id'), ('namespace', 'path'), ('namespace', 'reversed_name', 'id'), ('parent', 'modified', 'id'), ('parent', 'name', 'id')]),
+                ),
+            ],
+        ),
+    ]
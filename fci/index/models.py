@@ -1,41 +1,549 @@
 # coding: utf-8
+import hashlib
+import json
+import re
 from collections import defaultdict
+from datetime import timedelta
 
+import six
+
+from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import Q
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone
+from django_extensions.db.fields import CreationDateTimeField
 from django_extensions.db.fields.json import JSONField
 from django_extensions.db.models import TimeStampedModel
 
+from fci.index import cache
+
+# glob wildcards: "*", "?" and "[...]" character classes
+GLOB_TOKEN = re.compile(r'\*|\?|\[[^\]]+\]')
+# number of trigram joins used for substring search
+SEARCH_TRIGRAMS = 3
+
+
+def prefix_range(field, prefix):
+    """
+    Returns lookup kwargs matching all values of field starting with prefix.
+
+    Unlike `startswith` lookup (LIKE), range comparison is case-sensitive
+    on all backends and always uses plain btree index.
+    """
+    upper = prefix[:-1] + six.unichr(ord(prefix[-1]) + 1)
+    return {field + '__gte': prefix, field + '__lt': upper}
+
+
+def hash_path(path):
+    """ Returns hex digest of path stored for unique path lookups."""
+    return hashlib.md5(path.encode('utf-8')).hexdigest()
+
+
+class MD5(models.Func):
+    """ Hex MD5 digest of text, same as hash_path() gives."""
+    function = 'MD5'
+
+    def __init__(self, expression, **extra):
+        extra.setdefault('output_field', models.CharField())
+        super(MD5, self).__init__(expression, **extra)
+
+
+def register_functions(sender, connection, **kwargs):
+    """ Adds SQL functions missing in SQLite."""
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(
+            'MD5', 1, lambda value: None if value is None else hash_path(value))
+
+
+connection_created.connect(register_functions)
+
+
+def name_trigrams(name):
+    """ Returns set of all 3-character substrings of name."""
+    return set(name[i:i + 3] for i in range(len(name) - 2))
+
+
+def split_glob(pattern):
+    """ Returns literal parts of glob pattern between wildcards."""
+    return GLOB_TOKEN.split(pattern)
+
+
+def glob_to_regex(pattern):
+    """ Translates glob pattern to anchored regular expression."""
+    parts = ['^']
+    pos = 0
+    for match in GLOB_TOKEN.finditer(pattern):
+        parts.append(re.escape(pattern[pos:match.start()]))
+        token = match.group()
+        if token == '*':
+            parts.append('.*')
+        elif token == '?':
+            parts.append('.')
+        else:
+            body = token[1:-1].replace('\\', '\\\\')
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            parts.append('[%s]' % body)
+        pos = match.end()
+    parts.append(re.escape(pattern[pos:]))
+    parts.append('$')
+    return ''.join(parts)
+
+
+def prefetch_metadata(resources):
+    """ Fills metadata cache for a list of resources with a single query."""
+    by_key = {}
+    for resource in resources:
+        ct = ContentType.objects.get_for_model(resource)
+        by_key[(ct.pk, resource.pk)] = resource
+    if not by_key:
+        return
+    object_ids = defaultdict(list)
+    for ct_id, pk in by_key:
+        object_ids[ct_id].append(pk)
+    query = models.Q()
+    for ct_id, pks in object_ids.items():
+        query |= models.Q(content_type_id=ct_id, object_id__in=pks)
+    found = Metadata.objects.filter(query).values_list(
+        'content_type_id', 'object_id', 'data')
+    for ct_id, pk, data in found:
+        by_key.pop((ct_id, pk)).metadata = data
+    for resource in by_key.values():
+        resource.metadata = {}
+
+
+def prefetch_row_metadata(rows):
+    """ Adds "metadata" to resource rows returned by values() query."""
+    by_pk = dict((row['id'], row) for row in rows)
+    if not by_pk:
+        return
+    ct = ContentType.objects.get_for_model(Resource)
+    found = Metadata.objects.filter(
+        content_type_id=ct.pk, object_id__in=list(by_pk)).values_list(
+        'object_id', 'data')
+    for row in rows:
+        row['metadata'] = {}
+    for pk, data in found:
+        by_pk[pk]['metadata'] = data
+
+
+def get_resource_model(is_collection):
+    """ Returns proxy model of resource type."""
+    return Directory if is_collection else File
+
+
+class PolymorphicIterable(models.query.ModelIterable):
+    """ Yields Directory and File proxy instances."""
+
+    def __iter__(self):
+        for resource in super(PolymorphicIterable, self).__iter__():
+            if type(resource) is Resource:
+                # proxies have exactly same fields as base model
+                resource.__class__ = get_resource_model(
+                    resource.is_collection)
+            yield resource
+
+
+# resource fields meaningful for one resource type only
+DIRECTORY_FIELDS = ('total_size', 'file_count', 'child_count')
+FILE_FIELDS = ('size',)
+
+# largest file size, limited by size column
+MAX_SIZE = models.BigIntegerField.MAX_BIGINT
+
+# resource fields updated in db only by set-based statements or on moves
+MAINTAINED_FIELDS = ('namespace', 'path', 'path_hash') + DIRECTORY_FIELDS
+
+# resource fields fetched by ResourceQuerySet.rows()
+ROW_FIELDS = ('id', 'created', 'modified', 'name', 'is_collection',
+              'parent_id', 'namespace', 'path') + DIRECTORY_FIELDS + \
+    FILE_FIELDS
+
+
+def get_type_fields(is_collection):
+    """ Returns names of fields exposed for resource type only."""
+    return DIRECTORY_FIELDS if is_collection else FILE_FIELDS
+
+
+class ResourceQuerySet(models.QuerySet):
+    """ Resource queryset with bulk metadata loading support."""
+
+    _with_metadata = False
+
+    def with_metadata(self):
+        """ Loads metadata for all fetched resources with one extra query."""
+        clone = self._clone()
+        clone._with_metadata = True
+        return clone
+
+    def _clone(self, **kwargs):
+        clone = super(ResourceQuerySet, self)._clone(**kwargs)
+        clone._with_metadata = self._with_metadata
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super(ResourceQuerySet, self)._fetch_all()
+        if not self._with_metadata or fetched:
+            return
+        if issubclass(self._iterable_class, models.query.ModelIterable):
+            prefetch_metadata(self._result_cache)
+        elif self._iterable_class is models.query.ValuesIterable:
+            prefetch_row_metadata(self._result_cache)
+
+    def polymorphic(self):
+        """ Returns Directory and File instances instead of base resources."""
+        clone = self._clone()
+        clone._iterable_class = PolymorphicIterable
+        return clone
+
+    def rows(self):
+        """
+        Returns resources as dicts of ROW_FIELDS.
+
+        Rows are rendered by serializers.ResourceRowSerializer without
+        instantiating models; with_metadata() adds "metadata" key.
+        """
+        return self.values(*ROW_FIELDS)
+
+    def at_path(self, path, namespace=''):
+        """ Filters resource by path with unique path digest index."""
+        return self.filter(namespace=namespace, path_hash=hash_path(path),
+                           path=path)
+
+    def name_prefix(self, prefix):
+        """ Filters resources with names starting with prefix."""
+        if not prefix:
+            return self.all()
+        return self.filter(**prefix_range('name', prefix))
+
+    def name_suffix(self, suffix):
+        """ Filters resources with names ending with suffix."""
+        if not suffix:
+            return self.all()
+        return self.filter(**prefix_range('reversed_name', suffix[::-1]))
+
+    def name_contains(self, substring):
+        """
+        Filters resources with names containing substring.
+
+        Candidates are selected by a few trigrams of substring with index
+        lookups, then checked with exact match.
+        """
+        trigrams = sorted(name_trigrams(substring))
+        if len(trigrams) > SEARCH_TRIGRAMS:
+            step = (len(trigrams) - 1) / float(SEARCH_TRIGRAMS - 1)
+            trigrams = [trigrams[int(round(i * step))]
+                        for i in range(SEARCH_TRIGRAMS)]
+        queryset = self.all()
+        for trigram in trigrams:
+            # separate filter() calls join separate trigram rows
+            queryset = queryset.filter(name_trigrams__trigram=trigram)
+        return queryset.filter(name__regex=re.escape(substring))
+
+    def name_glob(self, pattern):
+        """
+        Filters resources with names matching glob pattern.
+
+        Literal prefix, suffix and longest inner part of pattern narrow
+        the search using indexes before matching the whole pattern.
+        """
+        parts = split_glob(pattern)
+        if len(parts) == 1:
+            return self.filter(name=pattern)
+        queryset = self.name_prefix(parts[0]).name_suffix(parts[-1])
+        inner = max(parts[1:-1] or [''], key=len)
+        if len(inner) >= 3:
+            queryset = queryset.name_contains(inner)
+        return queryset.filter(name__regex=glob_to_regex(pattern))
+
+
+def touch_resources(resources, modified=None):
+    """
+    Bumps version and modification time of resources in queryset.
+
+    Collections are touched when their children or rollups change, so
+    conditional requests see the change.
+
+    :param modified: ids of resources getting new modification time,
+        other resources get new version only; all by default.
+    """
+    now = timezone.now()
+    if modified is not None:
+        now = models.Case(
+            models.When(pk__in=modified, then=models.Value(now)),
+            default=models.F('modified'),
+            output_field=models.DateTimeField())
+    return resources.update(version=models.F('version') + 1, modified=now)
+
+
+def with_parents(ids, using=None):
+    """
+    Returns subquery of resource ids together with ids of their parents.
+
+    Touched collections are rendered with new modification time in
+    listings of their parents, so parents need a new version too.
+    """
+    return ResourceClosure.objects.using(using).filter(
+        descendant__in=ids, depth__lte=1).values('ancestor_id')
+
+
+def update_rollups(parent_id, rollup, children=0, using=None):
+    """
+    Adds (total size, file count) delta to parent and all its ancestors,
+    children delta to parent child count.
+
+    Parent is touched, ancestors are touched too when their totals change.
+    Returns whether ancestors were changed.
+    """
+    if not parent_id:
+        return False
+    size, files = rollup
+    # proxy model updates select ids with extra query, so base model is used
+    directories = Resource.objects.using(using)
+    if size or files:
+        ancestors = ResourceClosure.objects.using(using).filter(
+            descendant=parent_id).values('ancestor_id')
+        directories.filter(pk__in=ancestors).update(
+            total_size=models.F('total_size') + size,
+            file_count=models.F('file_count') + files)
+        resources = Resource.objects.using(using).filter(pk__in=ancestors)
+        modified = None
+    else:
+        resources = Resource.objects.using(using).filter(
+            pk__in=with_parents([parent_id], using))
+        modified = [parent_id]
+    if children:
+        directories.filter(pk=parent_id).update(
+            child_count=models.F('child_count') + children)
+    touch_resources(resources, modified)
+    return bool(size or files)
+
+
+def apply_rollup_deltas(deltas, using=None, chunk_size=100):
+    """
+    Updates rollups of many directories with one statement per chunk and
+    touches them.
+
+    :param deltas: mapping of directory id to (size, files, children) delta.
+    """
+    items = sorted(deltas.items())
+    directories = Resource.objects.using(using)
+    fields = ('total_size', 'file_count', 'child_count')
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start:start + chunk_size]
+        values = {}
+        for i, field in enumerate(fields):
+            whens = [models.When(pk=pk, then=models.Value(delta[i]))
+                     for pk, delta in chunk if delta[i]]
+            if whens:
+                values[field] = models.F(field) + models.Case(
+                    *whens, default=models.Value(0),
+                    output_field=models.BigIntegerField())
+        ids = [pk for pk, _ in chunk]
+        if values:
+            directories.filter(pk__in=ids).update(**values)
+        touch_resources(Resource.objects.using(using).filter(
+            pk__in=with_parents(ids, using)), ids)
+
+
+def rebuild_rollups(using=None, chunk_size=100):
+    """
+    Recomputes rollups of all directories from scratch.
+
+    Directories with drifted rollups and their parents, which list them
+    with rollups, get a new version. Returns number of fixed directories.
+    """
+    connection = connections[using or router.db_for_write(Resource)]
+    qn = connection.ops.quote_name
+    sql = dict(closure=qn(ResourceClosure._meta.db_table),
+               resource=qn(Resource._meta.db_table))
+    sql['total_size'] = """COALESCE((
+            SELECT SUM(f.size) FROM {closure} c
+            INNER JOIN {resource} f ON f.id = c.descendant_id
+            WHERE c.ancestor_id = {resource}.id AND f.is_collection = %s), 0)
+    """.format(**sql)
+    sql['file_count'] = """(
+            SELECT COUNT(*) FROM {closure} c
+            INNER JOIN {resource} f ON f.id = c.descendant_id
+            WHERE c.ancestor_id = {resource}.id AND f.is_collection = %s)
+    """.format(**sql)
+    sql['child_count'] = """(
+            SELECT COUNT(*) FROM {resource} r
+            WHERE r.parent_id = {resource}.id)
+    """.format(**sql)
+    sql['drifted'] = """is_collection = %s AND (
+        total_size <> {total_size} OR file_count <> {file_count} OR
+        child_count <> {child_count})
+    """.format(**sql)
+    select = 'SELECT id FROM {resource} WHERE {drifted}'.format(**sql)
+    update = """
+        UPDATE {resource} SET total_size = {total_size},
+        file_count = {file_count}, child_count = {child_count}
+        WHERE {drifted}
+    """.format(**sql)
+    resources = Resource.objects.using(connection.alias)
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute(select, [True, False, False])
+            ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(update, [False, False, True, False, False])
+            rowcount = cursor.rowcount
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            resources.filter(pk__in=with_parents(chunk, connection.alias)
+                             ).update(version=models.F('version') + 1)
+    namespaces = Resource.objects.using(connection.alias).filter(
+        parent__isnull=True).values_list('namespace', flat=True)
+    for namespace in namespaces:
+        cache.invalidate(subtree_paths=[''], using=connection.alias,
+                         namespace=namespace)
+    return rowcount
+
+
+def delete_resources(ids, using):
+    """
+    Deletes resources with given ids and all rows referencing them.
+
+    Caller must ensure that descendants of these resources are already
+    deleted or are deleted within same call.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(ids))
+    ct = ContentType.objects.db_manager(using).get_for_model(Resource)
+    statements = [
+        (Metadata, 'object_id', 'AND %s = %%s' % qn('content_type_id'),
+         [ct.pk]),
+        (MetadataIndex, 'resource_id', '', []),
+        (NameTrigram, 'resource_id', '', []),
+        (ResourceClosure, 'descendant_id', '', []),
+        (Resource, 'id', '', []),
+    ]
+    with connection.cursor() as cursor:
+        for model, column, extra, params in statements:
+            sql = 'DELETE FROM %s WHERE %s IN (%s) %s' % (
+                qn(model._meta.db_table), qn(column), placeholders, extra)
+            cursor.execute(sql, list(ids) + params)
+
+
+def get_stored_rollup(row):
+    """ Returns (total size, file count) of subtree from stored row."""
+    if row is None:
+        return 0, 0
+    if row['is_collection']:
+        return row['total_size'], row['file_count']
+    return row['size'], 1
+
 
 class Resource(TimeStampedModel):
     """ Resource model."""
 
     class Meta:
-        unique_together = ('name', 'parent')
+        unique_together = [('name', 'parent'),
+                           # path lookup
+                           ('namespace', 'path_hash')]
+        # keyset pagination of directory listings
+        index_together = [('parent', 'name', 'id'),
+                          ('parent', 'modified', 'id'),
+                          # subtree scans by path prefix
+                          ('namespace', 'path'),
+                          # name search
+                          ('namespace', 'name', 'id'),
+                          ('namespace', 'reversed_name', 'id')]
 
     name = models.CharField(max_length=255,
                             validators=[RegexValidator(r"^[^/]+$")])
     is_collection = models.BooleanField(blank=True, editable=False)
     # parent may be null only for root resource
     parent = models.ForeignKey('Resource', null=True, blank=True)
+    # independent tree with own root, inherited from parent;
+    # leads indexes, so lookups stay within one tree
+    namespace = models.SlugField(max_length=64, blank=True, default='',
+                                 db_index=False, editable=False)
+    # materialized full path from root to resource, root path is empty
+    path = models.CharField(max_length=4096, editable=False, default='')
+    # unique index on long path exceeds index key size limits of MySQL
+    # and PostgreSQL, so uniqueness is checked for path digest
+    path_hash = models.CharField(max_length=32, editable=False, default='')
+    # incremented on every change of resource or its children
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # name spelled backwards for suffix search
+    reversed_name = models.CharField(max_length=255, editable=False,
+                                     default='')
+    # file size, zero for collections
+    size = models.BigIntegerField(blank=True, default=0)
+    # recursive rollups of collections maintained on changes of descendants
+    total_size = models.BigIntegerField(default=0, editable=False)
+    file_count = models.IntegerField(default=0, editable=False)
+    child_count = models.IntegerField(default=0, editable=False)
 
-    @property
-    def path(self):
-        """ Returns full path from root to resource."""
-        parts = [self.name]
-        parts.extend(p.name for p in self.parents)
-        return '/'.join(reversed(parts)).strip('/')
+    objects = ResourceQuerySet.as_manager()
+
+    def build_path(self, parent_path):
+        """ Computes resource path from parent path and name."""
+        if not self.parent_id:
+            return ''
+        if not parent_path:
+            return self.name
+        return '%s/%s' % (parent_path, self.name)
+
+    def get_stored_rows(self):
+        """
+        Fetches stored paths and rollups of resource and its parent.
+
+        Instance and cached parent may be stale after rename or move of an
+        ancestor or after changes of children, so these fields are never
+        taken from them.
+        """
+        ids = [pk for pk in (self.pk, self.parent_id) if pk]
+        rows = Resource.objects.filter(pk__in=ids).values(
+            'id', 'namespace', 'path', 'is_collection', 'size',
+            'total_size', 'file_count')
+        stored = dict((row['id'], row) for row in rows)
+        return stored.get(self.pk), stored.get(self.parent_id)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Resource, cls).from_db(db, field_names, values)
+        # remember parent and name stored in db to detect moves on save
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        instance._loaded_name = instance.__dict__.get('name')
+        instance._loaded_size = instance.__dict__.get('size')
+        return instance
 
     @property
     def parents(self):
-        """ Yields parent dirs up to root resource."""
-        parent = self.parent
-        while parent:
-            yield parent
-            parent = parent.parent
+        """ Returns parent dirs up to root resource, nearest first."""
+        return self.ancestors().order_by('descendant_links__depth')
+
+    def ancestors(self, include_self=False):
+        """ Returns queryset of all resource ancestors."""
+        lookups = {'descendant_links__descendant': self.pk}
+        if not include_self:
+            lookups['descendant_links__depth__gt'] = 0
+        return Resource.objects.filter(**lookups)
+
+    def descendants(self, include_self=False, max_depth=None):
+        """ Returns queryset of all resource descendants at any depth."""
+        # all lookups go to single filter() call to share one closure join
+        lookups = {'ancestor_links__ancestor': self.pk}
+        if not include_self:
+            lookups['ancestor_links__depth__gt'] = 0
+        if max_depth is not None:
+            lookups['ancestor_links__depth__lte'] = max_depth
+        return Resource.objects.filter(**lookups)
+
+    def is_ancestor_of(self, resource_id):
+        """ Checks whether resource is an ancestor of (or same as) other."""
+        return ResourceClosure.objects.filter(
+            ancestor=self.pk, descendant=resource_id).exists()
 
     def __str__(self):
         return self.path
@@ -51,12 +559,13 @@ class Resource(TimeStampedModel):
         errors = defaultdict(list)
         if self.parent and not self.parent.is_collection:
             errors['parent'].append('Parent must be a collection')
-        if not self.pk:
+        if self.parent and self.pk and \
+                self.parent.namespace != self.namespace:
+            errors['parent'].append('Parent must be in the same namespace')
+        if not self.pk or not self.parent_id:
             return errors
-        for p in self.parents:
-            if p.pk == self.pk:
-                errors['parent'].append("Resource is a parent of itself")
-                break
+        if self.is_ancestor_of(self.parent_id):
+            errors['parent'].append("Resource is a parent of itself")
         return errors
 
     @property
@@ -77,14 +586,250 @@ class Resource(TimeStampedModel):
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
-        super(Resource, self).save(force_insert=force_insert,
-                                   force_update=force_update,
-                                   using=using,
-                                   update_fields=update_fields)
-        if hasattr(self, '_metadata'):
-            self.save_metadata()
+        adding = self._state.adding
+        old_parent_id = getattr(self, '_loaded_parent_id', self.parent_id)
+        reparented = not adding and old_parent_id != self.parent_id
+        renamed = adding or getattr(self, '_loaded_name',
+                                    self.name) != self.name
+        if not adding and update_fields is None and not force_insert:
+            # fields maintained by set-based updates are not written back
+            # from possibly stale instance
+            update_fields = [f.name for f in self._meta.concrete_fields
+                             if not f.primary_key and
+                             f.name not in MAINTAINED_FIELDS]
+        self.reversed_name = self.name[::-1]
+        if renamed and update_fields is not None:
+            update_fields = set(update_fields) | {'reversed_name'}
+        if not adding:
+            # children changes bump version in db concurrently
+            self.version = models.F('version') + 1
+            if update_fields is not None:
+                update_fields = set(update_fields) | {'version', 'modified'}
+        resized = not adding and self.is_resized()
+        with transaction.atomic(using=using):
+            old_path = None
+            current, parent = self.get_stored_rows()
+            if current is not None:
+                # path may have been changed by move of an ancestor
+                old_path = self.path = current['path']
+            if adding and parent is not None:
+                self.namespace = parent['namespace']
+            if renamed or reparented:
+                self.path = self.build_path(parent['path'] if parent else '')
+                self.path_hash = hash_path(self.path)
+                if update_fields is not None:
+                    update_fields = set(update_fields) | {'path', 'path_hash'}
+            moved = old_path is not None and old_path != self.path
+            stored = None
+            if reparented or resized:
+                stored = get_stored_rollup(current)
+            super(Resource, self).save(force_insert=force_insert,
+                                       force_update=force_update,
+                                       using=using,
+                                       update_fields=update_fields)
+            if adding:
+                self.insert_closure()
+                totals = update_rollups(self.parent_id, self.get_rollup(),
+                                        children=1)
+            elif reparented:
+                self.move_closure()
+                size, files = stored
+                totals = update_rollups(old_parent_id, (-size, -files),
+                                        children=-1)
+                totals |= update_rollups(self.parent_id,
+                                         self.get_rollup(stored), children=1)
+            elif stored is not None:
+                size, files = self.get_rollup(stored)
+                totals = update_rollups(self.parent_id,
+                                        (size - stored[0], files - stored[1]))
+            else:
+                totals = update_rollups(self.parent_id, (0, 0))
+            if not adding:
+                # actual version is loaded from db on access
+                del self.__dict__['version']
+            self._loaded_parent_id = self.parent_id
+            self._loaded_name = self.name
+            self._loaded_size = self.size
+            if renamed:
+                self.index_name(adding)
+            if moved:
+                self.move_descendants(old_path)
+            changed = hasattr(self, '_metadata') and self.write_metadata()
+            if adding:
+                actions = [Change.CREATE]
+            else:
+                actions = []
+                if reparented:
+                    actions.append(Change.MOVE)
+                elif renamed:
+                    actions.append(Change.RENAME)
+                if resized:
+                    actions.append(Change.UPDATE)
+                if changed:
+                    actions.append(Change.METADATA)
+            Change.record(self, actions, old_path if moved else None)
+            self.invalidate_cache(old_path if moved else None, totals)
+
+    def invalidate_cache(self, old_path=None, totals=False, using=None):
+        """
+        Invalidates cached responses affected by resource change.
+
+        :param old_path: path before move, subtree below it is invalidated.
+        :param totals: whether subtree totals of ancestors have changed.
+        """
+        paths = set()
+        for path in (self.path, old_path):
+            if path is None:
+                continue
+            paths.add(path)
+            if totals:
+                paths.update(cache.ancestor_paths(path))
+            else:
+                # parent is touched, its listing in grandparent changes too
+                parent_path = cache.parent_path(path)
+                paths.add(parent_path)
+                paths.add(cache.parent_path(parent_path))
+        cache.invalidate(paths, [old_path], using=using or self._state.db,
+                         namespace=self.namespace)
+
+    def is_resized(self):
+        """ Checks whether resource changes subtree size on save."""
+        if self.is_collection:
+            return False
+        return self.size != getattr(self, '_loaded_size', self.size)
+
+    def get_rollup(self, stored=None):
+        """
+        Returns (total size, file count) of resource subtree.
+
+        :param stored: values stored in db before save.
+        """
+        if self.is_collection:
+            return stored or (0, 0)
+        return self.size, 1
+
+    def move_descendants(self, old_path):
+        """ Rewrites paths of all descendants with two UPDATEs."""
+        if not old_path or not self.is_collection:
+            return
+        descendants = Resource.objects.filter(
+            namespace=self.namespace, **prefix_range('path', old_path + '/'))
+        descendants.update(path=Concat(
+            models.Value(self.path), Substr('path', len(old_path) + 1),
+            output_field=models.CharField()))
+        # separate statement: MySQL evaluates assignments left to right
+        descendants = Resource.objects.filter(
+            namespace=self.namespace, **prefix_range('path', self.path + '/'))
+        descendants.update(path_hash=MD5('path'))
 
-    def save_metadata(self):
+    def index_name(self, adding=False):
+        """ Replaces name trigrams of resource."""
+        if not adding:
+            NameTrigram.objects.filter(resource=self.pk).delete()
+        NameTrigram.objects.bulk_create(
+            NameTrigram(resource_id=self.pk, trigram=trigram)
+            for trigram in name_trigrams(self.name))
+
+    def insert_closure(self):
+        """ Links new resource with itself and all ancestors of parent."""
+        links = [ResourceClosure(ancestor_id=self.pk, descendant_id=self.pk,
+                                 depth=0)]
+        if self.parent_id:
+            ancestors = ResourceClosure.objects.filter(
+                descendant=self.parent_id).values_list('ancestor_id', 'depth')
+            links.extend(ResourceClosure(ancestor_id=a, descendant_id=self.pk,
+                                         depth=d + 1)
+                         for a, d in ancestors)
+        ResourceClosure.objects.bulk_create(links)
+
+    def move_closure(self):
+        """
+        Relinks whole subtree from old parent ancestors to the new ones.
+        """
+        subtree = ResourceClosure.objects.filter(
+            ancestor=self.pk).values('descendant_id')
+        old_ancestors = ResourceClosure.objects.filter(
+            descendant=self.pk).exclude(ancestor=self.pk).values('ancestor_id')
+        ResourceClosure.objects.filter(descendant__in=subtree,
+                                       ancestor__in=old_ancestors).delete()
+        if not self.parent_id:
+            return
+        table = ResourceClosure._meta.db_table
+        sql = ('INSERT INTO {table} (ancestor_id, descendant_id, depth) '
+               'SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1 '
+               'FROM {table} a, {table} d '
+               'WHERE a.descendant_id = %s AND d.ancestor_id = %s')
+        with connections[self._state.db].cursor() as cursor:
+            cursor.execute(sql.format(table=table), [self.parent_id, self.pk])
+
+    def delete(self, using=None, keep_parents=False):
+        """ Deletes resource with whole subtree, see delete_subtree."""
+        count = self.delete_subtree(using=using)
+        return count, {Resource._meta.label: count}
+
+    def delete_subtree(self, using=None, batch_size=None):
+        """
+        Deletes resource, all its descendants and their metadata.
+
+        Subtree is deleted deepest first in batches with a fixed number of
+        set-based statements per batch; each batch runs in own transaction,
+        so tree stays consistent after each of them.
+        """
+        using = using or self._state.db or router.db_for_write(Resource)
+        batch_size = batch_size or getattr(settings, 'FCI_DELETE_BATCH_SIZE',
+                                           500)
+        subtree = ResourceClosure.objects.using(using).filter(
+            ancestor=self.pk).order_by('-depth')
+        subtree = subtree.values_list('descendant_id', flat=True)
+        files = File.objects.using(using)
+        count = 0
+        changed = False
+        while True:
+            with transaction.atomic(using=using):
+                ids = list(subtree[:batch_size])
+                if not ids:
+                    break
+                totals = files.filter(pk__in=ids).aggregate(
+                    size=models.Sum('size'), count=models.Count('pk'))
+                children = -1 if self.pk in ids else 0
+                if children:
+                    Change.record(self, [Change.DELETE], using=using)
+                changed |= update_rollups(
+                    self.parent_id, (-(totals['size'] or 0), -totals['count']),
+                    children=children, using=using)
+                delete_resources(ids, using)
+            count += len(ids)
+        self.invalidate_cache(self.path, changed, using=using)
+        setattr(self, self._meta.pk.attname, None)
+        return count
+
+    def save_metadata(self, using=None):
+        """
+        Stores metadata without saving resource, returns whether it has
+        changed.
+
+        Changed resource and its parent are touched, change is journaled
+        and cached responses are invalidated, as with save().
+        """
+        using = using or self._state.db or router.db_for_write(Resource)
+        with transaction.atomic(using=using):
+            changed = self.write_metadata()
+            if not changed:
+                return False
+            # path may have been changed by move of an ancestor
+            self.path = Resource.objects.using(using).filter(
+                pk=self.pk).values_list('path', flat=True).get()
+            touch_resources(Resource.objects.using(using).filter(pk=self.pk))
+            update_rollups(self.parent_id, (0, 0), using=using)
+            Change.record(self, [Change.METADATA], using=using)
+            for field in ('version', 'modified'):
+                # actual values are loaded from db on access
+                self.__dict__.pop(field, None)
+            self.invalidate_cache(using=using)
+        return True
+
+    def write_metadata(self):
+        """ Writes metadata and its index, returns whether it has changed."""
         data = self._metadata
         ct = ContentType.objects.get_for_model(self)
         try:
@@ -93,16 +838,40 @@ class Resource(TimeStampedModel):
         except Metadata.DoesNotExist:
             meta = Metadata(object_id=self.pk, content_type=ct)
 
+        if (meta.data if meta.pk else {}) == (data or {}):
+            return False
         if data:
             meta.data = data
             meta.save()
         elif meta.pk:
             meta.delete()
 
+        MetadataIndex.objects.filter(resource=self.pk).delete()
+        MetadataIndex.objects.bulk_create(
+            MetadataIndex.from_data(self.pk, data))
+        return True
+
+
+class ResourceTypeManager(models.Manager.from_queryset(ResourceQuerySet)):
+    """ Manager of resources of a single type."""
+
+    def __init__(self, is_collection):
+        super(ResourceTypeManager, self).__init__()
+        self.is_collection = is_collection
+
+    def get_queryset(self):
+        queryset = super(ResourceTypeManager, self).get_queryset()
+        return queryset.filter(is_collection=self.is_collection)
+
 
 class Directory(Resource):
     """ Directory model."""
 
+    class Meta:
+        proxy = True
+
+    objects = ResourceTypeManager(is_collection=True)
+
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
         if not update_fields or 'is_collection' in update_fields:
@@ -116,7 +885,11 @@ class Directory(Resource):
 
 class File(Resource):
     """ File model."""
-    size = models.IntegerField(blank=True, default=0)
+
+    class Meta:
+        proxy = True
+
+    objects = ResourceTypeManager(is_collection=False)
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
@@ -129,8 +902,182 @@ class File(Resource):
                                update_fields=update_fields)
 
 
+class ResourceClosure(models.Model):
+    """ Ancestor-descendant relation for each pair of resources in a tree."""
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        index_together = [('descendant', 'depth'), ('ancestor', 'depth')]
+
+    ancestor = models.ForeignKey(Resource, related_name='descendant_links')
+    descendant = models.ForeignKey(Resource, related_name='ancestor_links')
+    # 0 for resource itself, 1 for direct children and so on
+    depth = models.PositiveIntegerField()
+
+
 class Metadata(models.Model):
     resource = GenericForeignKey()
     object_id = models.IntegerField()
     content_type = models.ForeignKey(ContentType)
     data = JSONField()
+
+
+class MetadataIndex(models.Model):
+    """
+    Indexed projection of resource metadata.
+
+    Each top-level scalar metadata value is stored as a separate row, so
+    resources can be searched by metadata with plain index lookups.
+    """
+
+    class Meta:
+        unique_together = ('resource', 'key')
+        index_together = [('key', 'value'), ('key', 'number')]
+
+    resource = models.ForeignKey(Resource, related_name='metadata_index')
+    key = models.CharField(max_length=255)
+    # text representation of value, strings are stored as is
+    value = models.CharField(max_length=255)
+    # numeric value for range lookups
+    number = models.FloatField(null=True)
+
+    @classmethod
+    def from_data(cls, resource_id, data):
+        """ Returns index rows for metadata dict."""
+        rows = []
+        for key, value in (data or {}).items():
+            if isinstance(value, bool):
+                text, number = 'true' if value else 'false', None
+            elif isinstance(value, six.integer_types + (float,)):
+                text, number = json.dumps(value), value
+            elif isinstance(value, six.string_types):
+                text, number = value, None
+            else:
+                # nested objects, lists and nulls are not indexed
+                continue
+            if len(key) > 255 or len(text) > 255:
+                continue
+            rows.append(cls(resource_id=resource_id, key=key, value=text,
+                            number=number))
+        return rows
+
+
+class NameTrigram(models.Model):
+    """ Resource name trigram for substring search."""
+
+    class Meta:
+        unique_together = ('trigram', 'resource')
+
+    resource = models.ForeignKey(Resource, related_name='name_trigrams')
+    trigram = models.CharField(max_length=3)
+
+
+class ChangeQuerySet(models.QuerySet):
+
+    def visible(self):
+        """
+        Filters entries older than FCI_CHANGES_VISIBILITY_LAG seconds,
+        see Change.
+        """
+        lag = getattr(settings, 'FCI_CHANGES_VISIBILITY_LAG', 5)
+        if not lag:
+            return self
+        return self.filter(
+            created__lt=timezone.now() - timedelta(seconds=lag))
+
+    def in_subtree(self, path, namespace=''):
+        """ Filters changes inside a subtree, including moves out of it."""
+        queryset = self.filter(namespace=namespace)
+        if not path:
+            return queryset
+        prefix = path + '/'
+        return queryset.filter(
+            Q(path=path) | Q(**prefix_range('path', prefix)) |
+            Q(old_path=path) | Q(**prefix_range('old_path', prefix)))
+
+
+class Change(models.Model):
+    """
+    Append-only journal of resource changes.
+
+    Written in the same transaction as the change itself. Change ids are
+    assigned on insert, not on commit, so entries of a slow transaction may
+    become visible after entries with greater ids. Feed serves only entries
+    older than visibility lag, so id is a cursor for incremental sync as
+    long as transactions are shorter than the lag. Moves of collections and
+    deletes of subtrees are recorded for subtree root only.
+    """
+    CREATE = 'create'
+    UPDATE = 'update'
+    MOVE = 'move'
+    RENAME = 'rename'
+    METADATA = 'metadata'
+    DELETE = 'delete'
+    ACTIONS = (
+        (CREATE, 'Create'),
+        (UPDATE, 'Update'),
+        (MOVE, 'Move'),
+        (RENAME, 'Rename'),
+        (METADATA, 'Metadata change'),
+        (DELETE, 'Delete'),
+    )
+
+    class Meta:
+        # feed of namespace and its subtrees
+        index_together = [('namespace', 'id'),
+                          ('namespace', 'path'),
+                          ('namespace', 'old_path')]
+
+    created = CreationDateTimeField(db_index=True)
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    # not a foreign key: journal outlives deleted resources
+    resource_id = models.IntegerField(db_index=True)
+    parent_id = models.IntegerField(null=True)
+    is_collection = models.BooleanField(default=False)
+    namespace = models.SlugField(max_length=64, blank=True, default='',
+                                 db_index=False)
+    # path after change, path before delete
+    path = models.CharField(max_length=4096)
+    # path before move or rename
+    old_path = models.CharField(max_length=4096, null=True)
+
+    objects = ChangeQuerySet.as_manager()
+
+    @classmethod
+    def record(cls, resource, actions, old_path=None, using=None):
+        """ Adds journal entries for resource change."""
+        changes = [cls(action=action, resource_id=resource.pk,
+                       parent_id=resource.parent_id,
+                       is_collection=resource.is_collection,
+                       namespace=resource.namespace,
+                       path=resource.path,
+                       old_path=old_path if action in (cls.MOVE, cls.RENAME)
+                       else None)
+                   for action in actions]
+        cls.objects.using(using or resource._state.db).bulk_create(changes)
+
+    @classmethod
+    def compact(cls, before, using=None):
+        """
+        Deletes entries created before given time.
+
+        Latest entry is always kept, so clients can detect expired cursors.
+        """
+        changes = cls.objects.using(using)
+        latest = changes.order_by('-pk').values_list('pk', flat=True).first()
+        if latest is None:
+            return 0
+        return changes.filter(created__lt=before, pk__lt=latest).delete()[0]
+
+    @classmethod
+    def exists_after(cls, cursor, path='', namespace='', using=None):
+        """
+        Checks whether subtree feed has entries after cursor.
+
+        Expired cursor counts as a change, so client gets 410 right away.
+        """
+        changes = cls.objects.using(using)
+        if cursor and not changes.filter(pk=cursor).exists():
+            return True
+        return changes.in_subtree(path, namespace).visible().filter(
+            pk__gt=cursor).exists()
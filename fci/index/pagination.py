@@ -0,0 +1,212 @@
+# coding: utf-8
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def get_field(obj, field):
+    """ Returns field value of model instance or values() row."""
+    if isinstance(obj, dict):
+        return obj['id' if field == 'pk' else field]
+    return getattr(obj, field)
+
+
+def keyset_filter(queryset, field, descending, value, pk):
+    """ Filters queryset to rows following (value, pk) in given ordering."""
+    op = 'lt' if descending else 'gt'
+    return queryset.filter(Q(**{'%s__%s' % (field, op): value}) |
+                           Q(**{field: value, 'pk__%s' % op: pk}))
+
+
+def keyset_order(queryset, field, descending):
+    prefix = '-' if descending else ''
+    return queryset.order_by(prefix + field, prefix + 'pk')
+
+
+def iterate_chunks(queryset, chunk_size, field='name', descending=False):
+    """
+    Yields queryset rows in lists of chunk_size length.
+
+    Each chunk is fetched with separate keyset query, so memory usage does
+    not depend on the total number of rows.
+    """
+    chunk_queryset = keyset_order(queryset, field, descending)
+    while True:
+        chunk = list(chunk_queryset[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+        chunk_queryset = keyset_order(
+            keyset_filter(queryset, field, descending,
+                          get_field(last, field), get_field(last, 'pk')),
+            field, descending)
+
+
+class DescendantsPagination(BasePagination):
+    """
+    Keyset (cursor) pagination for directory listings.
+
+    Page is selected by (ordering field, id) of the last resource on
+    previous page, so every page costs a single index range scan no matter
+    how deep into directory it is.
+    """
+
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    page_size_query_param = 'page_size'
+
+    # ordering name -> model field, both backed by (parent, field, id) index
+    orderings = {
+        'name': 'name',
+        'modified': 'modified',
+    }
+    default_ordering = 'name'
+
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.request = None
+        self.next_cursor = None
+
+    @staticmethod
+    def get_default_page_size():
+        return getattr(settings, 'FCI_PAGE_SIZE', 100)
+
+    @staticmethod
+    def get_max_page_size():
+        return getattr(settings, 'FCI_MAX_PAGE_SIZE', 1000)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.get_default_page_size()
+        if page_size <= 0:
+            return self.get_default_page_size()
+        return min(page_size, self.get_max_page_size())
+
+    def get_ordering(self, request):
+        """ Returns (field, descending) pair for requested ordering."""
+        ordering = request.query_params.get(self.ordering_query_param,
+                                            self.default_ordering)
+        descending = ordering.startswith('-')
+        field = self.orderings.get(ordering.lstrip('-'))
+        if field is None:
+            field = self.orderings[self.default_ordering]
+            descending = False
+        return field, descending
+
+    def encode_cursor(self, field, obj):
+        value = get_field(obj, field)
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        data = json.dumps([value, get_field(obj, 'pk')]).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii')
+
+    def decode_cursor(self, field, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor.encode('ascii'))
+            value, pk = json.loads(data.decode('utf-8'))
+            pk = int(pk)
+            if field == 'modified':
+                value = parse_datetime(value)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        field, descending = self.get_ordering(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(field, cursor)
+            queryset = keyset_filter(queryset, field, descending, value, pk)
+        queryset = keyset_order(queryset, field, descending)
+
+        # one extra row tells whether there is a next page
+        page = list(queryset[:page_size + 1])
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = self.encode_cursor(field, page[-1])
+        else:
+            self.next_cursor = None
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.next_cursor)
+
+    def get_headers(self):
+        """ Returns RFC 5988 Link header pointing to next page."""
+        next_link = self.get_next_link()
+        if next_link is None:
+            return {}
+        return {'Link': '<%s>; rel="next"' % next_link}
+
+    def get_paginated_response(self, data):
+        """ Returns page with Link header pointing to next page."""
+        return Response(data, headers=self.get_headers())
+
+
+class ChangesPagination(DescendantsPagination):
+    """
+    Pagination of change journal.
+
+    Cursor is id of the last seen change and may be stored by clients to
+    continue sync later. Queryset must be limited to visible entries, see
+    Change.
+    """
+
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        super(ChangesPagination, self).__init__()
+        self.cursor = 0
+
+    def get_cursor(self, request):
+        """ Returns change id passed in request, 0 if missing."""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return 0
+        try:
+            cursor = int(cursor)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if cursor < 0:
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.cursor = self.get_cursor(request)
+        queryset = queryset.filter(pk__gt=self.cursor).order_by('pk')
+        page = list(queryset[:page_size + 1])
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = str(page[-1].pk)
+        else:
+            self.next_cursor = None
+        if page:
+            self.cursor = page[-1].pk
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({'cursor': self.cursor, 'changes': data},
+                        headers=self.get_headers())
@@ -0,0 +1,30 @@
+# coding: utf-8
+import json
+
+import six
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """ Parses newline-delimited JSON to a list of records."""
+
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        records = []
+        for lineno, line in enumerate(stream, 1):
+            if isinstance(line, six.binary_type):
+                line = line.decode(encoding)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError as exc:
+                raise ParseError('NDJSON parse error at line %s - %s' %
+                                 (lineno, six.text_type(exc)))
+        return records
@@ -0,0 +1,105 @@
+# coding: utf-8
+"""
+Read replica routing.
+
+ReplicaRouter sends reads to one of FCI_READ_DATABASES and writes to
+primary ("default") database. Reads stay on primary inside transactions
+and while current thread is pinned to primary: PrimaryPinMiddleware pins
+write requests and, for FCI_PRIMARY_PIN_SECONDS after a write, all
+requests of the same client, so clients always read their own writes.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+PRIMARY = DEFAULT_DB_ALIAS
+
+_local = threading.local()
+
+
+def get_read_databases():
+    return getattr(settings, 'FCI_READ_DATABASES', [])
+
+
+def get_pin_seconds():
+    return getattr(settings, 'FCI_PRIMARY_PIN_SECONDS', 5)
+
+
+def is_pinned():
+    """ Checks whether current thread reads from primary."""
+    return getattr(_local, 'pinned', 0) > 0
+
+
+@contextmanager
+def use_primary():
+    """ Routes all reads of current thread to primary."""
+    _local.pinned = getattr(_local, 'pinned', 0) + 1
+    try:
+        yield
+    finally:
+        _local.pinned -= 1
+
+
+class ReplicaRouter(object):
+    """ Routes reads to replicas and writes to primary database."""
+
+    def db_for_read(self, model, **hints):
+        replicas = get_read_databases()
+        if not replicas or is_pinned():
+            return PRIMARY
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # related objects are read from the same database
+            return instance._state.db
+        if connections[PRIMARY].in_atomic_block:
+            # transaction must see its own changes
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = set(get_read_databases())
+        databases.add(PRIMARY)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+def pinned_iterator(iterable):
+    """ Reads from primary while streamed response is generated."""
+    with use_primary():
+        for chunk in iterable:
+            yield chunk
+
+
+class PrimaryPinMiddleware(object):
+    """
+    Pins requests of a client to primary database after a write.
+
+    Write requests are served from primary and set a short-living cookie,
+    requests carrying it are served from primary too.
+    """
+    cookie_name = 'fci_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        write = request.method not in SAFE_METHODS
+        if not write and self.cookie_name not in request.COOKIES:
+            return self.get_response(request)
+        with use_primary():
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = pinned_iterator(
+                response.streaming_content)
+        if write and response.status_code < 400:
+            response.set_cookie(self.cookie_name, '1',
+                                max_age=get_pin_seconds(), httponly=True)
+        return response
@@ -1,13 +1,39 @@
 # coding: utf-8
 import json
+import re
+from collections import OrderedDict
+from datetime import datetime
 
 import six
-from rest_framework import serializers
+from django.utils.http import RFC3986_SUBDELIMS
+from django.utils.timezone import utc
+from rest_framework import ISO_8601, serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
+from six.moves.urllib.parse import quote
 
 from fci.index import models
 
+# internal model fields not exposed via API
+EXCLUDED_FIELDS = ('namespace', 'path', 'path_hash', 'reversed_name',
+                   'version')
+
+# ISO 8601 formats of UTC datetimes, same as DRF renders
+UTC_FORMAT = '%04d-%02d-%02dT%02d:%02d:%02dZ'
+UTC_FORMAT_MICROSECONDS = '%04d-%02d-%02dT%02d:%02d:%02d.%06dZ'
+
+# paths left as is by URL quoting
+UNQUOTED_PATH = re.compile(r"[A-Za-z0-9_.\-~!$&'()*+,;=/:@]*\Z")
+
+
+def resource_url(path, namespace='', name='resource-detail'):
+    """ Returns URL of resource view for path in namespace."""
+    if namespace:
+        return reverse('namespace-' + name,
+                       kwargs={'namespace': namespace, 'path': path})
+    return reverse(name, kwargs={'path': path})
+
 
 class PlainResourceSerializer(serializers.ModelSerializer):
 
@@ -23,11 +49,15 @@ class PlainResourceSerializer(serializers.ModelSerializer):
 
         if self.instance:
             model_class = type(self.instance)
+            # fields of other resource type are not exposed
+            hidden = models.get_type_fields(not self.instance.is_collection)
         else:
             model_class = models.Resource
+            hidden = models.DIRECTORY_FIELDS
 
         class Meta:
             model = model_class
+            exclude = EXCLUDED_FIELDS + hidden
          #   read_only_fields = ('parent',)
 
         setattr(self, '_meta', Meta)
@@ -41,7 +71,7 @@ class PlainResourceSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_url(obj):
-        return reverse('resource-detail', kwargs={'path': obj.path})
+        return resource_url(obj.path, obj.namespace)
 
     @staticmethod
     def validate_parent(value):
@@ -55,20 +85,74 @@ class PlainResourceSerializer(serializers.ModelSerializer):
                 "Resource type cannot be changed after creation")
         return value
 
+    @staticmethod
+    def validate_size(value):
+        if not 0 <= value <= models.MAX_SIZE:
+            raise ValidationError("Size is out of range")
+        return value
+
     def validate_metadata(self, value):
         if isinstance(value, six.text_type):
             return json.loads(value)
         return value
 
+    def create(self, validated_data):
+        is_collection = validated_data['is_collection']
+        for field in models.get_type_fields(not is_collection):
+            validated_data.pop(field, None)
+        model = models.get_resource_model(is_collection)
+        return model.objects.create(**validated_data)
+
 
 class DirectorySerializer(PlainResourceSerializer):
     class Meta:
         model = models.Directory
+        exclude = EXCLUDED_FIELDS + models.FILE_FIELDS
 
 
 class FileSerializer(PlainResourceSerializer):
     class Meta:
         model = models.File
+        exclude = EXCLUDED_FIELDS + models.DIRECTORY_FIELDS
+
+
+class CopySerializer(serializers.Serializer):
+    """
+    Validates destination of resource copy.
+
+    Parent and name default to those of copied resource passed as
+    "resource" in context.
+    """
+    parent = serializers.PrimaryKeyRelatedField(
+        queryset=models.Resource.objects.all(), required=False)
+    name = serializers.CharField(
+        max_length=255, required=False,
+        validators=models.Resource._meta.get_field('name').validators)
+
+    def get_fields(self):
+        fields = super(CopySerializer, self).get_fields()
+        fields['parent'].queryset = models.Resource.objects.filter(
+            namespace=self.context['resource'].namespace)
+        return fields
+
+    @staticmethod
+    def validate_parent(value):
+        return PlainResourceSerializer.validate_parent(value)
+
+    def validate(self, attrs):
+        resource = self.context['resource']
+        attrs.setdefault('parent', resource.parent)
+        attrs.setdefault('name', resource.name)
+        if attrs['parent'] is None:
+            raise ValidationError({'parent': ['This field is required.']})
+        return attrs
+
+
+class ChangeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Change
+        fields = ('id', 'created', 'action', 'resource_id', 'parent_id',
+                  'is_collection', 'path', 'old_path')
 
 
 class ResourceSerializer(PlainResourceSerializer):
@@ -76,10 +160,139 @@ class ResourceSerializer(PlainResourceSerializer):
     def get_fields(self):
         fields = super(ResourceSerializer, self).get_fields()
         if self.instance and self.instance.is_collection:
-            kwargs = dict(source='resource_set.all', many=True, read_only=True)
-            fields['descendants'] = PlainResourceSerializer(**kwargs)
+            fields['descendants'] = serializers.SerializerMethodField()
         if self.instance:
             fields['parent'].read_only = False
             fields['parent'].queryset = models.Resource.objects.filter(
-                is_collection=True)
+                namespace=self.instance.namespace, is_collection=True)
         return fields
+
+    def validate(self, attrs):
+        instance = self.instance
+        parent = attrs.get('parent')
+        if instance is None or parent is None or \
+                parent.pk == instance.parent_id:
+            return attrs
+        if parent.pk == instance.pk or instance.is_ancestor_of(parent.pk):
+            raise ValidationError(
+                {'parent': ["Resource is a parent of itself"]})
+        return attrs
+
+    def get_descendants(self, obj):
+        """
+        Serializes collection children.
+
+        View may limit children to a single page by passing a callable
+        returning resource rows as "descendants" in serializer context, and
+        add nested levels by passing a callable returning children rows of
+        page collections as "subtree".
+        """
+        paginate = self.context.get('descendants')
+        if paginate is not None:
+            descendants = paginate(obj)
+        else:
+            descendants = obj.resource_set.with_metadata().rows()
+        subtree = self.context.get('subtree')
+        children = subtree(descendants) if subtree is not None else {}
+        return serialize_tree(descendants, children)
+
+
+class ResourceRowSerializer(object):
+    """
+    Read-only serializer of resource rows for listings.
+
+    Renders dicts returned by `ResourceQuerySet.rows()` to the same
+    representation as PlainResourceSerializer gives for resource instances,
+    without model instances, per-row field binding and URL resolving.
+    """
+
+    # same characters are left unquoted by reverse()
+    url_safe = RFC3986_SUBDELIMS + str('/~:@')
+
+    def __init__(self):
+        self.url_prefixes = {}
+        field = serializers.DateTimeField()
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if output_format and output_format.lower() == ISO_8601 and \
+                renders_utc(field):
+            self.format_datetime = format_iso_datetime
+        else:
+            self.format_datetime = field.to_representation
+        self.type_fields = {
+            True: models.get_type_fields(True),
+            False: models.get_type_fields(False),
+        }
+
+    def get_url(self, path, namespace=''):
+        prefix = self.url_prefixes.get(namespace)
+        if prefix is None:
+            prefix = self.url_prefixes[namespace] = resource_url('', namespace)
+        if UNQUOTED_PATH.match(path):
+            return prefix + path
+        if six.PY2:
+            path = path.encode('utf-8')
+        return prefix + quote(path, safe=self.url_safe)
+
+    def to_representation(self, rows):
+        format_datetime = self.format_datetime
+        get_url = self.get_url
+        type_fields = self.type_fields
+        data = []
+        for row in rows:
+            item = OrderedDict()
+            item['id'] = row['id']
+            item['is_collection'] = bool(row['is_collection'])
+            item['url'] = get_url(row['path'], row['namespace'])
+            item['metadata'] = row.get('metadata', {})
+            item['created'] = format_datetime(row['created'])
+            item['modified'] = format_datetime(row['modified'])
+            item['name'] = row['name']
+            for field in type_fields[item['is_collection']]:
+                item[field] = row[field]
+            item['parent'] = row['parent_id']
+            data.append(item)
+        return data
+
+
+def renders_utc(field):
+    """
+    Checks that datetime field renders UTC values without conversion to
+    current timezone, as format_iso_datetime() does.
+    """
+    sample = datetime(2000, 1, 1, 12, 30, tzinfo=utc)
+    return field.to_representation(sample) == '2000-01-01T12:30:00Z'
+
+
+def format_iso_datetime(value):
+    """ Formats datetime like DRF DateTimeField with ISO 8601 format."""
+    if not value:
+        return None
+    if value.tzinfo is utc:
+        # stored values are in UTC, formatted without isoformat() and
+        # utcoffset() calls
+        if value.microsecond:
+            return UTC_FORMAT_MICROSECONDS % (
+                value.year, value.month, value.day, value.hour,
+                value.minute, value.second, value.microsecond)
+        return UTC_FORMAT % (value.year, value.month, value.day, value.hour,
+                             value.minute, value.second)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def serialize_tree(rows, children, serializer=None):
+    """
+    Serializes resource rows with nested descendants.
+
+    :param children: mapping of collection id to list of its children
+        rows, collections missing in mapping are not expanded.
+    """
+    serializer = serializer or ResourceRowSerializer()
+    data = serializer.to_representation(rows)
+    for item, row in zip(data, rows):
+        if row['id'] in children:
+            item['descendants'] = serialize_tree(children[row['id']],
+                                                 children, serializer)
+    return data
@@ -0,0 +1,180 @@
+# coding: utf-8
+"""
+Tree snapshots in NDJSON format.
+
+First line is a header with format version, namespace and path of
+exported resource, each next line is a resource record with id of its
+parent in the snapshot:
+
+    {"format":"fci-tree","version":1,"namespace":"","path":"dir"}
+    {"id":2,"parent":null,"name":"dir","is_collection":true}
+    {"id":3,"parent":2,"name":"f.txt","is_collection":false,"size":10}
+
+Records are ordered by path, so parents always precede children. Zero
+size and empty metadata are omitted.
+"""
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from fci.index import bulk, models
+
+FORMAT = 'fci-tree'
+VERSION = 1
+
+RECORD_FIELDS = ('id', 'name', 'is_collection', 'size')
+
+
+def get_chunk_size():
+    return getattr(settings, 'FCI_STREAM_CHUNK_SIZE', 1000)
+
+
+def dumps(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
+def to_record(row, parent):
+    """ Returns snapshot record of resource row."""
+    record = OrderedDict([('id', row['id']), ('parent', parent),
+                          ('name', row['name']),
+                          ('is_collection', row['is_collection'])])
+    if row['size']:
+        record['size'] = row['size']
+    if row['metadata']:
+        record['metadata'] = row['metadata']
+    return record
+
+
+def export_lines(resource, chunk_size=None):
+    """
+    Yields snapshot lines of resource with whole subtree.
+
+    Subtree is read by path in chunks with keyset pagination, so memory
+    usage doesn't depend on tree size.
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    yield dumps(OrderedDict([('format', FORMAT), ('version', VERSION),
+                             ('namespace', resource.namespace),
+                             ('path', resource.path)]))
+    resources = models.Resource.objects.filter(
+        namespace=resource.namespace).with_metadata()
+    row = resources.filter(pk=resource.pk).values(*RECORD_FIELDS)[0]
+    yield dumps(to_record(row, None))
+    if not resource.is_collection:
+        return
+    if resource.path:
+        resources = resources.filter(
+            **models.prefix_range('path', resource.path + '/'))
+    else:
+        resources = resources.filter(parent__isnull=False)
+    fields = RECORD_FIELDS + ('parent_id', 'path')
+    last = None
+    while True:
+        chunk = resources if last is None else resources.filter(
+            path__gt=last)
+        rows = list(chunk.order_by('path').values(*fields)[:chunk_size])
+        if not rows:
+            break
+        for row in rows:
+            yield dumps(to_record(row, row['parent_id']))
+        last = rows[-1]['path']
+
+
+def parse_line(line, number):
+    try:
+        data = json.loads(line)
+    except ValueError:
+        raise ValidationError('Line %d: invalid JSON' % number)
+    if not isinstance(data, dict):
+        raise ValidationError('Line %d: expected an object' % number)
+    return data
+
+
+class TreeImporter(object):
+    """
+    Restores snapshot under existing collection.
+
+    Records are inserted in batches by bulk.TreeBuilder with deferred
+    indexes: name trigrams, metadata index and rollups are built once
+    after all records are inserted. Snapshot of the whole tree is restored
+    into target collection itself (with metadata of snapshot root, if
+    any), snapshot of a subtree - as its child.
+    """
+
+    def __init__(self, target, batch_size=None):
+        self.target = target
+        self.builder = bulk.TreeBuilder(batch_size=batch_size,
+                                        defer_indexes=True)
+        # snapshot id -> ParentInfo of imported collection
+        self.parents = {}
+        self.batch = []
+        self.batch_ids = set()
+
+    def run(self, lines):
+        """ Imports snapshot lines in one transaction, returns count."""
+        if not self.target.is_collection:
+            raise ValidationError('Target must be a collection')
+        lines = iter(lines)
+        header = parse_line(next(lines, '{}'), 1)
+        if header.get('format') != FORMAT or \
+                header.get('version') != VERSION:
+            raise ValidationError('Unsupported snapshot format')
+        try:
+            with transaction.atomic(using=self.builder.using):
+                target = bulk.get_parent_info(self.target)
+                whole_tree = header.get('path') == ''
+                for number, line in enumerate(lines, 2):
+                    if not line.strip():
+                        continue
+                    record = parse_line(line, number)
+                    if whole_tree and record.get('parent') is None:
+                        # root of snapshot is replaced by target
+                        self.restore_root(record, number)
+                        self.parents[record.get('id')] = target
+                        continue
+                    self.add(record, target, number)
+                self.flush()
+                self.builder.finish()
+        except IntegrityError:
+            raise ValidationError('Resource already exists')
+        return self.builder.created
+
+    def restore_root(self, record, number):
+        """ Copies metadata of snapshot root to target collection."""
+        metadata = record.get('metadata')
+        if not metadata:
+            # empty metadata is omitted in snapshot
+            return
+        if not isinstance(metadata, dict):
+            raise ValidationError('Line %d: metadata must be an object' %
+                                  number)
+        self.target.metadata = metadata
+        self.target.save_metadata(using=self.builder.using)
+
+    def add(self, record, target, number):
+        """ Adds record to batch, flushes batch if parent is in it."""
+        parent_id = record.get('parent')
+        if parent_id is None:
+            parent = target
+        else:
+            if parent_id in self.batch_ids:
+                self.flush()
+            parent = self.parents.get(parent_id)
+            if parent is None:
+                raise ValidationError('Line %d: unknown parent' % number)
+        self.batch.append((parent, record))
+        if record.get('is_collection'):
+            self.batch_ids.add(record.get('id'))
+        if len(self.batch) >= self.builder.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        for info, record in self.builder.insert_batch(self.batch):
+            self.parents[record['id']] = info
+        self.batch = []
+        self.batch_ids.clear()
@@ -0,0 +1,49 @@
+# coding: utf-8
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.utils import encoders
+
+from fci.index import pagination, serializers
+
+
+def get_chunk_size():
+    return getattr(settings, 'FCI_STREAM_CHUNK_SIZE', 1000)
+
+
+def dumps(data):
+    return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False,
+                      separators=(',', ':'))
+
+
+def iter_resource_json(instance, context, chunk_size=None, queryset=None):
+    """
+    Yields JSON representation of collection with all its children.
+
+    Children are fetched and rendered chunk by chunk, so memory usage does
+    not depend on directory size.
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    data = serializers.PlainResourceSerializer(instance, context=context).data
+    head = dumps(data)
+    yield head[:-1] + ',"descendants":['
+
+    child = serializers.ResourceRowSerializer()
+    if queryset is None:
+        queryset = instance.resource_set.with_metadata()
+    queryset = queryset.rows()
+    first = True
+    for chunk in pagination.iterate_chunks(queryset, chunk_size):
+        items = ','.join(dumps(item)
+                         for item in child.to_representation(chunk))
+        yield items if first else ',' + items
+        first = False
+    yield ']}'
+
+
+def stream_resource(instance, queryset, context):
+    """ Returns streaming JSON response for collection resource."""
+    return StreamingHttpResponse(
+        iter_resource_json(instance, context, queryset=queryset),
+        content_type='application/json')
@@ -0,0 +1,165 @@
+# coding: utf-8
+"""
+Per-request performance instrumentation.
+
+Enabled by FCI_TIMING setting. Views mixing in TimingMixin report number
+of queries, database time and time of request phases in Server-Timing
+header and in "fci.timing" log records. Requests slower than
+FCI_SLOW_REQUEST_MS are logged with warning level and slowest SQL.
+"""
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+from django.conf import settings
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.response import Response
+
+logger = logging.getLogger('fci.timing')
+
+
+def is_enabled():
+    return getattr(settings, 'FCI_TIMING', False)
+
+
+def get_slow_threshold():
+    """ Returns slow request threshold in milliseconds."""
+    return getattr(settings, 'FCI_SLOW_REQUEST_MS', 500)
+
+
+class RequestTimer(object):
+    """ Collects query stats and phase durations of a single request."""
+
+    slowest_queries = 3
+
+    def __init__(self, using=None):
+        # request may read from replica and write to primary, so queries
+        # of all databases are captured by default
+        aliases = [using] if using else list(connections)
+        self.captures = [CaptureQueriesContext(connections[alias])
+                         for alias in aliases]
+        self.phases = OrderedDict()
+        self.started = None
+        self.total = 0.0
+
+    def __enter__(self):
+        for capture in self.captures:
+            capture.__enter__()
+        self.started = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.total = (default_timer() - self.started) * 1000
+        for capture in self.captures:
+            capture.__exit__(exc_type, exc_val, exc_tb)
+
+    @property
+    def captured_queries(self):
+        """ Returns captured queries of all databases."""
+        return [query for capture in self.captures
+                for query in capture.captured_queries]
+
+    @contextmanager
+    def phase(self, name):
+        """ Adds duration of block to named phase, in milliseconds."""
+        started = default_timer()
+        try:
+            yield
+        finally:
+            elapsed = (default_timer() - started) * 1000
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    @property
+    def query_count(self):
+        return len(self.captured_queries)
+
+    @property
+    def db_time(self):
+        return sum(float(q['time']) for q in
+                   self.captured_queries) * 1000
+
+    def get_slowest_queries(self):
+        queries = sorted(self.captured_queries,
+                         key=lambda q: float(q['time']), reverse=True)
+        return [(round(float(q['time']) * 1000, 3), q['sql'])
+                for q in queries[:self.slowest_queries]]
+
+    def get_stats(self):
+        """ Returns dict of collected metrics."""
+        stats = OrderedDict([('queries', self.query_count),
+                             ('db', round(self.db_time, 3))])
+        for name, duration in self.phases.items():
+            stats[name] = round(duration, 3)
+        stats['total'] = round(self.total, 3)
+        return stats
+
+    def get_header(self):
+        """ Returns Server-Timing header value."""
+        metrics = ['db;dur=%.3f;desc="%d queries"' % (self.db_time,
+                                                       self.query_count)]
+        metrics.extend('%s;dur=%.3f' % item for item in self.phases.items())
+        metrics.append('total;dur=%.3f' % self.total)
+        return ', '.join(metrics)
+
+    def report(self, request, response):
+        """ Adds Server-Timing header to response and logs stats."""
+        response['Server-Timing'] = self.get_header()
+        stats = self.get_stats()
+        message = '%s %s %s %s' % (
+            request.method, request.get_full_path(), response.status_code,
+            ' '.join('%s=%s' % item for item in stats.items()))
+        extra = {'timing': stats, 'path': request.path,
+                 'status_code': response.status_code}
+        if self.total >= get_slow_threshold():
+            extra['slowest_queries'] = self.get_slowest_queries()
+            logger.warning('Slow request: %s; slowest queries: %s', message,
+                           extra['slowest_queries'], extra=extra)
+        else:
+            logger.info(message, extra=extra)
+
+
+class TimingMixin(object):
+    """
+    Instruments view with RequestTimer.
+
+    Path resolution and rendering are timed automatically, other phases
+    may be timed with `timing(name)` context manager.
+    """
+
+    timer = None
+
+    def timing(self, name):
+        """ Returns context manager timing named phase of request."""
+        if self.timer is None:
+            return _null_phase()
+        return self.timer.phase(name)
+
+    def dispatch(self, request, *args, **kwargs):
+        if not is_enabled():
+            return super(TimingMixin, self).dispatch(request, *args, **kwargs)
+        self.timer = RequestTimer()
+        with self.timer:
+            response = super(TimingMixin, self).dispatch(request, *args,
+                                                         **kwargs)
+        self.timer.report(request, response)
+        return response
+
+    def get_object(self):
+        with self.timing('resolve'):
+            return super(TimingMixin, self).get_object()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(TimingMixin, self).finalize_response(
+            request, response, *args, **kwargs)
+        if self.timer is not None and isinstance(response, Response):
+            # render now to measure it, Django won't render it again
+            with self.timing('render'):
+                response.render()
+        return response
+
+
+@contextmanager
+def _null_phase():
+    yield
@@ -1,4 +1,5 @@
 # coding: utf-8
+from django.conf.urls import url
 from rest_framework.routers import DefaultRouter
 
 from fci.index import views
@@ -7,4 +8,24 @@ from fci.index import views
 router = DefaultRouter(trailing_slash=False)
 router.register('resources', views.ResourceView)
 
-urlpatterns = router.urls
+# resources of default namespace are served without namespace prefix
+resource_urlpatterns = [
+    url(r'^bulk/(?P<path>.*)$', views.BulkCreateView.as_view(),
+        name='resource-bulk'),
+    url(r'^search/(?P<path>.*)$', views.SearchView.as_view(),
+        name='resource-search'),
+    url(r'^changes/(?P<path>.*)$', views.ChangesView.as_view(),
+        name='resource-changes'),
+] + [p for p in router.urls if p.name != 'api-root']
+
+
+def namespaced(patterns):
+    """ Returns copies of url patterns prefixed with namespace."""
+    return [url(r'^ns/(?P<namespace>[-a-zA-Z0-9_]+)/' +
+                p.regex.pattern.lstrip('^'),
+                p.callback, name='namespace-%s' % p.name)
+            for p in patterns]
+
+
+urlpatterns = resource_urlpatterns + namespaced(resource_urlpatterns) + [
+    p for p in router.urls if p.name == 'api-root']
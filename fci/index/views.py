@@ -1,70 +1,306 @@
 # coding: utf-8
-from rest_framework import exceptions, viewsets, status
+import functools
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_http_date
+from rest_framework import exceptions, generics, viewsets, status
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 
-from fci.index import models, serializers
+from fci.index import bulk, cache, conditional, filters, models, \
+    pagination, parsers, routers, serializers, streaming, timing
 
 
-class ResourceView(viewsets.ModelViewSet):
-    serializer_class = serializers.ResourceSerializer
+class NamespaceMixin(object):
+    """ Resolves namespace of resource tree from URL."""
+
+    def get_namespace(self):
+        """ Returns namespace from URL, default namespace is empty."""
+        return self.kwargs.get('namespace') or ''
+
+
+class ResourceLookupMixin(NamespaceMixin):
+    """ Resolves resource by materialized path from URL."""
 
-    queryset = models.Resource.objects.all()
     lookup_field = 'path'
     lookup_value_regex = '.*'
+
+    def get_object(self):
+        path = (self.kwargs.get('path') or '').strip('/')
+        try:
+            return models.Resource.objects.polymorphic().at_path(
+                path, self.get_namespace()).get()
+        except ObjectDoesNotExist:
+            raise exceptions.NotFound()
+
+
+class ResourceView(timing.TimingMixin, ResourceLookupMixin,
+                   viewsets.ModelViewSet):
+    serializer_class = serializers.ResourceSerializer
+
+    queryset = models.Resource.objects.all()
+    pagination_class = pagination.DescendantsPagination
+    filter_backends = (filters.NameFilter, filters.MetadataFilter)
     #
     # def get_queryset(self):
     #     resource = self.get_object()
     #     return type(resource).objects.get_queryset()
-
-    def get_object(self):
-        path = self.kwargs.get('path') or None
-        root = models.Directory.objects.get(parent=None)
-        parts = path.strip('/').split('/') if path is not None else []
-        resource = root
-        i = 0
-        for part in parts:
-            try:
-                resource = models.Directory.objects.get(parent=resource,
-                                                        name=part)
-                i += 1
-            except models.Directory.DoesNotExist:
-                break
-
-        if i < len(parts) - 1:
-            # не дошли до конца
-            raise exceptions.NotFound()
-        elif i < len(parts):
-            try:
-                resource = models.File.objects.get(parent=resource,
-                                                   name=parts[-1])
-            except models.File.DoesNotExist:
-                raise exceptions.NotFound()
-        return resource
     #
     # def list(self, request, *args, **kwargs):
     #     return self.retrieve(request, *args, **kwargs)
 
+    depth_query_param = 'depth'
+    http_method_names = viewsets.ModelViewSet.http_method_names + ['copy']
+
+    def get_serializer_context(self):
+        context = super(ResourceView, self).get_serializer_context()
+        context['descendants'] = self.paginate_descendants
+        if self.get_depth() > 1:
+            context['subtree'] = self.get_subtree
+        return context
+
+    def get_depth(self):
+        """ Returns requested depth of nested listing, 1 by default."""
+        try:
+            depth = int(self.request.query_params[self.depth_query_param])
+        except (KeyError, ValueError):
+            return 1
+        max_depth = getattr(settings, 'FCI_MAX_DEPTH', 5)
+        return min(max(depth, 1), max_depth)
+
+    def get_subtree(self, page):
+        """
+        Returns children of page collections for nested listing levels.
+
+        Whole subtree is fetched with one closure query (plus one for
+        metadata) and grouped by parent in Python.
+        """
+        depth = self.get_depth()
+        roots = [r['id'] for r in page if r['is_collection']]
+        if not roots:
+            return {}
+        max_nodes = getattr(settings, 'FCI_MAX_TREE_NODES', 10000)
+        nodes = models.Resource.objects.filter(
+            ancestor_links__ancestor__in=roots,
+            ancestor_links__depth__gt=0,
+            ancestor_links__depth__lt=depth).order_by('name', 'pk')
+        nodes = list(nodes.with_metadata().rows()[:max_nodes + 1])
+        if len(nodes) > max_nodes:
+            raise exceptions.ValidationError(
+                {self.depth_query_param: 'Subtree is too large'})
+        by_parent = defaultdict(list)
+        for node in nodes:
+            by_parent[node['parent_id']].append(node)
+        children = {}
+        level = roots
+        for _ in range(depth - 1):
+            next_level = []
+            for pk in level:
+                children[pk] = by_parent[pk]
+                next_level.extend(r['id'] for r in children[pk]
+                                  if r['is_collection'])
+            level = next_level
+        return children
+
+    def get_descendants_queryset(self, instance):
+        """
+        Returns filtered queryset of collection children.
+
+        With "recursive" query parameter all subtree resources are returned.
+        """
+        if self.request.query_params.get('recursive'):
+            queryset = instance.descendants()
+        else:
+            queryset = instance.resource_set.all()
+        return self.filter_queryset(queryset.with_metadata())
+
+    def paginate_descendants(self, instance):
+        """ Returns current page of collection children rows."""
+        queryset = self.get_descendants_queryset(instance)
+        return self.paginate_queryset(queryset.rows())
+
+    def get_cache_key(self, response_cache):
+        """ Returns cache key of current response."""
+        path = (self.kwargs.get('path') or '').strip('/')
+        variant = '%s\n%s' % (self.request.get_full_path(),
+                              self.request.META.get('HTTP_ACCEPT', ''))
+        return cache.get_response_key(response_cache, path, variant,
+                                      self.get_namespace())
+
     def retrieve(self, request, *args, **kwargs):
-        resp = super(ResourceView, self).retrieve(request, *args, **kwargs)
-        # resp.data.serializer.instance = None
-        return resp
+        # nested levels and recursive listings don't bump resource
+        # version, so neither conditional requests nor cache are
+        # supported for them
+        nested = self.get_depth() > 1
+        recursive = bool(request.query_params.get('recursive'))
+        response_cache = cache.get_cache()
+        # cached response may have been read from lagging replica, so
+        # requests pinned to primary after a write bypass cache
+        if response_cache is not None and not nested and not recursive and \
+                not request.query_params.get('stream') and \
+                not routers.is_pinned():
+            # key is obtained before any database reads
+            cache_key = self.get_cache_key(response_cache)
+            resp = cache.get_response(response_cache, cache_key)
+            if resp is not None:
+                etag = resp['ETag']
+                last_modified = resp.get('Last-Modified')
+                if last_modified is not None:
+                    last_modified = parse_http_date(last_modified)
+                if conditional.is_not_modified(request, etag, last_modified):
+                    resp = conditional.set_validators(
+                        HttpResponseNotModified(), etag, last_modified)
+                return resp
+        else:
+            cache_key = None
+
+        instance = self.get_object()
+        validated = not nested and not recursive
+        if validated:
+            etag = conditional.get_etag(request, instance)
+            last_modified = conditional.get_last_modified(instance)
+        if validated and conditional.is_not_modified(request, etag,
+                                                     last_modified):
+            # children and metadata are not loaded at all
+            resp = HttpResponseNotModified()
+        elif request.query_params.get('stream') and not nested and \
+                instance.is_collection:
+            resp = streaming.stream_resource(
+                instance, self.get_descendants_queryset(instance),
+                self.get_serializer_context())
+        else:
+            with self.timing('serialize'):
+                data = self.get_serializer(instance).data
+            resp = Response(data)
+            for header, value in self.paginator.get_headers().items():
+                resp[header] = value
+            if cache_key is not None:
+                resp.add_post_render_callback(functools.partial(
+                    cache.store_response, response_cache, cache_key))
+        if not validated:
+            return resp
+        return conditional.set_validators(resp, etag, last_modified)
 
     def post(self, request, *args, **kwargs):
         return self.create(request, *args, **kwargs)
 
+    def copy(self, request, *args, **kwargs):
+        """
+        Copies resource with whole subtree to "parent" collection as
+        "name", with batched inserts.
+        """
+        instance = self.get_object()
+        serializer = serializers.CopySerializer(
+            data=request.data, context={'resource': instance})
+        serializer.is_valid(raise_exception=True)
+        parent = serializer.validated_data['parent']
+        name = serializer.validated_data['name']
+        try:
+            bulk.copy_tree(instance, parent, name)
+        except ValidationError as e:
+            raise exceptions.ValidationError(e.messages)
+        copy = models.Resource.objects.polymorphic().get(parent=parent,
+                                                         name=name)
+        data = serializers.PlainResourceSerializer(copy).data
+        return Response(data, status=status.HTTP_201_CREATED,
+                        headers=self.get_success_headers(data))
+
     def create(self, request, *args, **kwargs):
+        parent = self.get_object()
         serializer = self.get_serializer(data=request.data)
-        serializer.initial_data['parent'] = self.get_object().pk
-        serializer.is_valid(raise_exception=True)
-        if serializer.validated_data['is_collection']:
-            serializer = serializers.DirectorySerializer(data=request.data)
-        else:
-            serializer = serializers.FileSerializer(data=request.data)
-        serializer.initial_data['parent'] = self.get_object().pk
+        serializer.initial_data['parent'] = parent.pk
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
 
-        headers = self.get_success_headers(serializer.data)
-        resp = Response(serializer.data, status=status.HTTP_201_CREATED,
+        # fields depend on type of created resource
+        data = serializers.PlainResourceSerializer(serializer.instance).data
+        headers = self.get_success_headers(data)
+        resp = Response(data, status=status.HTTP_201_CREATED,
                         headers=headers)
         return resp
+
+
+class BulkCreateView(ResourceLookupMixin, generics.GenericAPIView):
+    """
+    Creates many resources under a collection in one transaction.
+
+    Accepts either JSON list of nested resources (with "children" lists)
+    or NDJSON manifest of resources with paths relative to collection.
+    """
+    queryset = models.Resource.objects.all()
+    parser_classes = (JSONParser, parsers.NDJSONParser)
+
+    def post(self, request, *args, **kwargs):
+        parent = self.get_object()
+        data = request.data
+        try:
+            media_type = parsers.NDJSONParser.media_type
+            if request.content_type.startswith(media_type):
+                data = bulk.manifest_to_tree(data)
+            if not isinstance(data, list):
+                raise ValidationError('Expected a list of resources')
+            created = bulk.create_tree(parent, data)
+        except ValidationError as e:
+            raise exceptions.ValidationError(e.messages)
+        return Response({'created': created}, status=status.HTTP_201_CREATED)
+
+
+class SearchView(ResourceLookupMixin, generics.GenericAPIView):
+    """
+    Searches resources in collection subtree by name and metadata.
+
+    Accepts same filters as collection listing, results are paginated
+    with the same cursor pagination.
+    """
+    queryset = models.Resource.objects.all()
+    pagination_class = pagination.DescendantsPagination
+    filter_backends = (filters.NameFilter, filters.MetadataFilter)
+
+    def get(self, request, *args, **kwargs):
+        instance = self.get_object()
+        if not instance.is_collection:
+            raise exceptions.ValidationError('Resource is not a collection')
+        if instance.parent_id is None:
+            # whole tree, no need to join closure table
+            queryset = models.Resource.objects.filter(
+                namespace=instance.namespace, parent__isnull=False)
+        else:
+            queryset = instance.descendants()
+        queryset = self.filter_queryset(queryset.with_metadata())
+        page = self.paginate_queryset(queryset.rows())
+        serializer = serializers.ResourceRowSerializer()
+        return Response({'results': serializer.to_representation(page)},
+                        headers=self.paginator.get_headers())
+
+
+class CursorExpired(exceptions.APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'Cursor has expired, full resync is required'
+
+
+class ChangesView(NamespaceMixin, generics.ListAPIView):
+    """
+    Feed of resource changes after a cursor.
+
+    Path limits feed to changes inside a subtree, including moves out of
+    it. Path is matched as a string, so feed of deleted subtree is still
+    available.
+    """
+    queryset = models.Change.objects.all()
+    serializer_class = serializers.ChangeSerializer
+    pagination_class = pagination.ChangesPagination
+
+    def get_queryset(self):
+        queryset = super(ChangesView, self).get_queryset()
+        path = (self.kwargs.get('path') or '').strip('/')
+        return queryset.in_subtree(path, self.get_namespace()).visible()
+
+    def list(self, request, *args, **kwargs):
+        cursor = self.paginator.get_cursor(request)
+        if cursor and not models.Change.objects.filter(pk=cursor).exists():
+            # entries after cursor may have been compacted
+            raise CursorExpired()
+        return super(ChangesView, self).list(request, *args, **kwargs)
@@ -1,10 +1,23 @@
 # coding: utf-8
+import base64
 import json
+from datetime import timedelta
 
+import mock
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
 from django.core.urlresolvers import reverse
-from rest_framework.test import APITestCase
+from django.test import override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework import serializers as rest_serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
 
-from fci.index import models
+from fci.index import bulk, models, pagination, serializers, views
+
+ROLLUP_FIELDS = ('total_size', 'file_count', 'child_count')
 
 
 class ResourceAPITestCase(APITestCase):
@@ -44,18 +57,32 @@ class ResourceAPITestCase(APITestCase):
         self.assertEqual(response.status_code, 200)
         data = response.data
         descendants = data.pop('descendants', None)
-        expected = self.dump_resource(self.root)
+        self.root.refresh_from_db()
+        expected = self.dump_resource(self.root, extra=ROLLUP_FIELDS)
         self.assertDictEqual(data, expected)
         self.assertIsNotNone(descendants)
         self.assertEqual(len(descendants), 2)
         d = descendants[0]
-        expected = self.dump_resource(self.dir)
+        self.dir.refresh_from_db()
+        expected = self.dump_resource(self.dir, extra=ROLLUP_FIELDS)
         self.assertDictEqual(d, expected)
 
         f = descendants[1]
-        expected = self.dump_resource(self.file)
+        expected = self.dump_resource(self.file, extra=('size',))
         self.assertDictEqual(f, expected)
 
+    def testDirectoryRollups(self):
+        """ Checks that directory rollups are exposed via API."""
+        models.File.objects.create(parent=self.dir, name='a.txt', size=5)
+        response = self.client.get(self.url(), format='json')
+        self.assertEqual(response.data['total_size'], 5)
+        self.assertEqual(response.data['file_count'], 2)
+        self.assertEqual(response.data['child_count'], 2)
+        response = self.client.get(self.url(self.dir.path), format='json')
+        self.assertEqual(response.data['total_size'], 5)
+        self.assertEqual(response.data['file_count'], 1)
+        self.assertEqual(response.data['child_count'], 1)
+
     def testGetChildDir(self):
         """ Check detail view for child directories."""
         response = self.client.get(self.url(path=self.dir.path), format='json')
@@ -68,6 +95,296 @@ class ResourceAPITestCase(APITestCase):
         data = response.data
         self.assertEqual(data['id'], self.dir2.id)
 
+    def testGetObjectSingleQuery(self):
+        """ Checks that path resolution costs one query at any depth."""
+        parent = self.dir
+        for i in range(10):
+            parent = models.Directory.objects.create(name='d%s' % i,
+                                                     parent=parent)
+        f = models.File.objects.create(name='f.txt', parent=parent, size=3)
+        view = views.ResourceView(kwargs={'path': f.path})
+        with self.assertNumQueries(1):
+            resource = view.get_object()
+        self.assertIsInstance(resource, models.File)
+        self.assertEqual(resource.size, 3)
+        self.assertEqual(resource.path, f.path)
+
+    def testListingMetadataQueries(self):
+        """ Checks that listing loads metadata of all children at once."""
+        for i in range(20):
+            f = models.File(name='f%02d.txt' % i, parent=self.dir, size=i)
+            f.metadata = {'n': i}
+            f.save()
+        ContentType.objects.get_for_models(
+            models.Resource, models.Directory, models.File)
+        # get_object, own metadata, children and children metadata
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url(self.dir.path),
+                                       format='json')
+        self.assertEqual(response.status_code, 200)
+        descendants = response.data['descendants']
+        self.assertListEqual([d['metadata'] for d in descendants],
+                             [{'n': i} for i in range(20)])
+        self.assertListEqual([d['size'] for d in descendants],
+                             list(range(20)))
+
+    def testListingPagination(self):
+        """ Checks keyset pagination of directory listing."""
+        for i in range(5):
+            models.File.objects.create(name='f%s.txt' % i, parent=self.dir)
+        names = []
+        url = self.url(self.dir.path) + '?page_size=2'
+        while url:
+            response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, 200)
+            page = [d['name'] for d in response.data['descendants']]
+            self.assertLessEqual(len(page), 2)
+            names.extend(page)
+            link = response.get('Link')
+            url = link and link[1:link.index('>')]
+        self.assertListEqual(names, ['f%s.txt' % i for i in range(5)])
+
+    def testListingPaginationOrdering(self):
+        """ Checks descending listing ordering."""
+        for i in range(3):
+            models.File.objects.create(name='f%s.txt' % i, parent=self.dir)
+        response = self.client.get(self.url(self.dir.path), format='json',
+                                   data={'ordering': '-modified',
+                                         'page_size': 2})
+        page = [d['name'] for d in response.data['descendants']]
+        self.assertListEqual(page, ['f2.txt', 'f1.txt'])
+        link = response['Link']
+        response = self.client.get(link[1:link.index('>')], format='json')
+        page = [d['name'] for d in response.data['descendants']]
+        self.assertListEqual(page, ['f0.txt'])
+        self.assertNotIn('Link', response)
+
+    def testPaginatedResponse(self):
+        """ Checks that page of children is returned with Link header."""
+        for i in range(3):
+            models.File.objects.create(name='f%s.txt' % i, parent=self.dir)
+        request = Request(APIRequestFactory().get('/', {'page_size': 2}))
+        paginator = pagination.DescendantsPagination()
+        page = paginator.paginate_queryset(self.dir.resource_set.all(),
+                                           request)
+        response = paginator.get_paginated_response([r.name for r in page])
+        self.assertListEqual(response.data, ['f0.txt', 'f1.txt'])
+        self.assertIn('cursor=', response['Link'])
+
+    def testListingInvalidCursor(self):
+        """ Checks that malformed cursor results in 404."""
+        response = self.client.get(self.url(self.dir.path), format='json',
+                                   data={'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+        for ordering, value in (('modified', 5), ('modified', 'x'),
+                                ('name', None)):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps([value, 1]).encode('utf-8')).decode('ascii')
+            response = self.client.get(
+                self.url(self.dir.path), format='json',
+                data={'cursor': cursor, 'ordering': ordering})
+            self.assertEqual(response.status_code, 404)
+
+    def testStreamListing(self):
+        """ Checks streaming JSON rendering of directory listing."""
+        for i in range(5):
+            f = models.File(name='f%s.txt' % i, parent=self.dir)
+            f.metadata = {'n': i}
+            f.save()
+        expected = self.client.get(self.url(self.dir.path),
+                                   format='json').data
+        with self.settings(FCI_STREAM_CHUNK_SIZE=2):
+            response = self.client.get(self.url(self.dir.path),
+                                       data={'stream': 1})
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(content.decode('utf-8'))
+        self.assertDictEqual(data, json.loads(json.dumps(expected)))
+
+    def create_photos(self):
+        sub = models.Directory.objects.create(name='sub', parent=self.dir)
+        specs = [
+            (self.dir, 'a.jpg', {'mime-type': 'image/jpeg', 'width': 640}),
+            (self.dir, 'b.png', {'mime-type': 'image/png', 'width': 1024}),
+            (self.dir, 'c.txt', {'mime-type': 'text/plain'}),
+            (sub, 'd.jpg', {'mime-type': 'image/jpeg', 'width': 2048}),
+        ]
+        for parent, name, meta in specs:
+            f = models.File(name=name, parent=parent)
+            f.metadata = meta
+            f.save()
+
+    def get_names(self, **params):
+        response = self.client.get(self.url(self.dir.path), format='json',
+                                   data=params)
+        self.assertEqual(response.status_code, 200)
+        return [d['name'] for d in response.data['descendants']]
+
+    def testMetadataFilter(self):
+        """ Checks listing filters by metadata values."""
+        self.create_photos()
+        self.assertListEqual(
+            self.get_names(**{'meta.mime-type': 'image/jpeg'}), ['a.jpg'])
+        self.assertListEqual(
+            self.get_names(**{'meta.mime-type__startswith': 'image/'}),
+            ['a.jpg', 'b.png'])
+        self.assertListEqual(
+            self.get_names(**{'meta.width__gte': '1000'}), ['b.png'])
+        self.assertListEqual(
+            self.get_names(**{'meta.width__lt': '1000',
+                              'meta.mime-type__startswith': 'image/'}),
+            ['a.jpg'])
+        self.assertListEqual(self.get_names(**{'meta.width': '640'}),
+                             ['a.jpg'])
+
+    def testMetadataFilterRecursive(self):
+        """ Checks metadata filters scoped to whole subtree."""
+        self.create_photos()
+        self.assertListEqual(
+            self.get_names(recursive=1, **{'meta.mime-type': 'image/jpeg'}),
+            ['a.jpg', 'd.jpg'])
+        self.assertListEqual(self.get_names(recursive=1),
+                             ['a.jpg', 'b.png', 'c.txt', 'd.jpg', 'sub'])
+
+    def create_tree(self):
+        bulk.create_tree(self.dir, [
+            {'name': 'a', 'children': [
+                {'name': 'b', 'children': [
+                    {'name': 'c', 'children': [{'name': 'deep.txt'}]}]},
+                {'name': 'a.txt'}]},
+            {'name': 'empty', 'is_collection': True},
+            {'name': 'x.txt'},
+        ])
+
+    def get_tree(self, data):
+        """ Returns nested names from listing response."""
+        return [(d['name'], self.get_tree(d['descendants']))
+                if 'descendants' in d else d['name'] for d in data]
+
+    def testNestedListing(self):
+        """ Checks depth limited nested listing."""
+        self.create_tree()
+        ContentType.objects.get_for_models(
+            models.Resource, models.Directory, models.File)
+        # get_object, own metadata, page, page metadata, nested resources
+        # and their metadata
+        with self.assertNumQueries(6):
+            response = self.client.get(self.url(self.dir.path),
+                                       data={'depth': 3}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(
+            self.get_tree(response.data['descendants']),
+            [('a', ['a.txt', ('b', ['c'])]), ('empty', []), 'x.txt'])
+        self.assertNotIn('ETag', response)
+
+    def testNestedListingMaxDepth(self):
+        """ Checks that listing depth is limited by server settings."""
+        self.create_tree()
+        with self.settings(FCI_MAX_DEPTH=2):
+            response = self.client.get(self.url(self.dir.path),
+                                       data={'depth': 10}, format='json')
+        self.assertListEqual(
+            self.get_tree(response.data['descendants']),
+            [('a', ['a.txt', 'b']), ('empty', []), 'x.txt'])
+
+    def testNestedListingTooLarge(self):
+        """ Checks limit of nested resources count."""
+        self.create_tree()
+        with self.settings(FCI_MAX_TREE_NODES=2):
+            response = self.client.get(self.url(self.dir.path),
+                                       data={'depth': 3}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def testConditionalGet(self):
+        """ Checks ETag based conditional GET."""
+        response = self.client.get(self.url(self.dir.path), format='json')
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url(self.dir.path),
+                                       format='json',
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        models.File.objects.create(name='new.txt', parent=self.dir)
+        response = self.client.get(self.url(self.dir.path), format='json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def testConditionalGetQueryParams(self):
+        """ Checks that ETag depends on requested page."""
+        url = self.url(self.dir.path)
+        etag = self.client.get(url, format='json')['ETag']
+        response = self.client.get(url, format='json', data={'page_size': 1},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def testConditionalGetNestedChange(self):
+        """ Checks that changes deep in subtree update root ETag."""
+        sub = models.Directory.objects.create(name='sub', parent=self.dir)
+        f = models.File.objects.create(name='f.txt', parent=sub)
+        etag = self.client.get(self.url(), format='json')['ETag']
+        f.size = 10
+        f.save()
+        response = self.client.get(self.url(), format='json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_size'], 10)
+
+    def testConditionalGetGrandchildRename(self):
+        """ Checks that listing ETag changes with modification time of a
+        child collection."""
+        sub = models.Directory.objects.create(name='sub', parent=self.dir)
+        etag = self.client.get(self.url(), format='json')['ETag']
+        sub.name = 'renamed'
+        sub.save()
+        response = self.client.get(self.url(), format='json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.dir.refresh_from_db()
+        self.assertEqual(response.data['descendants'][0]['modified'],
+                         self.dump_resource(self.dir)['modified'])
+
+    def testConditionalGetRecursive(self):
+        """ Checks that recursive listings have no validators, as changes
+        deep in subtree don't bump collection version."""
+        sub = models.Directory.objects.create(name='sub', parent=self.dir)
+        f = models.File.objects.create(name='f.txt', parent=sub)
+        for params in ({'recursive': 1}, {'recursive': 1, 'stream': 1}):
+            response = self.client.get(self.url(), data=params,
+                                       format='json')
+            self.assertNotIn('ETag', response)
+            self.assertNotIn('Last-Modified', response)
+        f.name = 'renamed.txt'
+        f.save()
+        response = self.client.get(self.url(), data={'recursive': 1},
+                                   format='json', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('renamed.txt',
+                      [d['name'] for d in response.data['descendants']])
+
+    def testIfModifiedSince(self):
+        """ Checks Last-Modified based conditional GET."""
+        response = self.client.get(self.url(self.file.path), format='json')
+        last_modified = response['Last-Modified']
+        response = self.client.get(self.url(self.file.path), format='json',
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def testIfModifiedSinceCollection(self):
+        """ Checks that collections are not validated by modification time,
+        as it doesn't change with modification time of children."""
+        sub = models.Directory.objects.create(name='sub', parent=self.dir)
+        response = self.client.get(self.url(self.dir.path), format='json')
+        self.assertNotIn('Last-Modified', response)
+        # parent of sub is touched, listing of dir changes
+        models.Directory.objects.create(name='new', parent=sub)
+        response = self.client.get(self.url(self.dir.path), format='json',
+                                   HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, 200)
+
     def testFileResourceDoesNotExist(self):
         """ Check that detail view correctly handles unexistent files."""
         response = self.client.get(self.url(path='dir/not_exists.txt'),
@@ -102,7 +419,7 @@ class ResourceAPITestCase(APITestCase):
             parent=self.dir, name='new_dir').exists())
         new = models.Directory.objects.get(parent=self.dir, name='new_dir')
 
-        expected = self.dump_resource(new)
+        expected = self.dump_resource(new, extra=ROLLUP_FIELDS)
         self.assertDictEqual(response.data, expected)
 
     def testCreateFile(self):
@@ -119,6 +436,17 @@ class ResourceAPITestCase(APITestCase):
         expected = self.dump_resource(new, extra=['size'])
         self.assertDictEqual(response.data, expected)
 
+    def testCreateFileSize(self):
+        """ Checks range of file size."""
+        for size, status in ((models.MAX_SIZE + 1, 400), (-1, 400),
+                             (10 ** 12, 201)):
+            response = self.client.post(self.url(self.dir.path), data={
+                'is_collection': False, 'name': 'f%s' % size, 'size': size,
+                'metadata': {}}, format='json')
+            self.assertEqual(response.status_code, status)
+        self.assertEqual(models.File.objects.get(name='f%s' % 10 ** 12).size,
+                         10 ** 12)
+
     def testRootAsAPIView(self):
         """ Checks that root resource works correctly with API format."""
         response = self.client.get(self.url(), data={'format': 'api'})
@@ -162,6 +490,19 @@ class ResourceAPITestCase(APITestCase):
         error = 'Invalid pk "%s" - object does not exist.' % self.file.id
         self.assertDictEqual(response.data, {'parent': [error]})
 
+    def testMoveIntoDescendant(self):
+        """ Checks that collection can't be moved into its own subtree."""
+        child = models.Directory.objects.create(parent=self.dir, name='child')
+        for parent in (child, self.dir):
+            response = self.client.patch(self.url(self.dir.path), data={
+                "parent": parent.id
+            })
+            self.assertEqual(response.status_code, 400)
+            self.assertDictEqual(response.data, {
+                'parent': ["Resource is a parent of itself"]})
+        self.dir.refresh_from_db()
+        self.assertEqual(self.dir.parent_id, self.root.id)
+
     def testChangeResourceTypeForbidden(self):
         """ Checks that is_collection flag can't be changed by PATCH request."""
         response = self.client.patch(self.url(self.dir.path), data={
@@ -171,6 +512,16 @@ class ResourceAPITestCase(APITestCase):
         error = 'Resource type cannot be changed after creation'
         self.assertDictEqual(response.data, {'is_collection': [error]})
 
+    def testDelete(self):
+        """ Checks deletion of directory with its contents."""
+        models.File.objects.create(parent=self.dir, name='inner.txt')
+        response = self.client.delete(self.url(self.dir.path))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(models.Resource.objects.filter(
+            path__in=['dir', 'dir/inner.txt']).exists())
+        self.assertTrue(models.Resource.objects.filter(
+            pk=self.file.pk).exists())
+
     def testChangeMetadata(self):
         """ Checks metadata update via PATCH request."""
         meta = {"new": "data"}
@@ -191,3 +542,707 @@ class ResourceAPITestCase(APITestCase):
         self.assertDictEqual(self.dir.metadata, meta)
 
 
+@override_settings(FCI_CACHE='default')
+class ResponseCacheTestCase(APITestCase):
+    """ Shared response cache test case."""
+
+    def setUp(self):
+        super(ResponseCacheTestCase, self).setUp()
+        caches['default'].clear()
+        self.root = models.Directory.objects.create(name='/')
+        self.dir = models.Directory.objects.create(parent=self.root,
+                                                   name='dir')
+        self.sub = models.Directory.objects.create(parent=self.dir,
+                                                   name='sub')
+        self.file = models.File.objects.create(parent=self.sub,
+                                               name='file.txt')
+
+    def url(self, path=''):
+        return reverse('resource-detail', kwargs={'path': path})
+
+    def get(self, path):
+        return self.client.get(self.url(path), format='json')
+
+    def names(self, path):
+        return [d['name'] for d in self.get(path).data['descendants']]
+
+    def testCacheHit(self):
+        """ Checks that cached responses are served without queries."""
+        response = self.get(self.sub.path)
+        with self.assertNumQueries(0):
+            cached = self.get(self.sub.path)
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url(self.sub.path),
+                                       HTTP_IF_NONE_MATCH=cached['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def testCacheVariants(self):
+        """ Checks that query parameters are part of cache key."""
+        models.File.objects.create(parent=self.sub, name='a.txt')
+        self.get(self.sub.path)
+        response = self.client.get(self.url(self.sub.path),
+                                   data={'page_size': 1}, format='json')
+        self.assertEqual(len(response.data['descendants']), 1)
+
+    def testInvalidateCreate(self):
+        """ Checks that new child invalidates parent and its listing."""
+        self.assertListEqual(self.names(self.sub.path), ['file.txt'])
+        etag = self.get(self.dir.path)['ETag']
+        self.get('')
+        models.Directory.objects.create(parent=self.sub, name='new')
+        self.assertListEqual(self.names(self.sub.path), ['file.txt', 'new'])
+        # grandparent lists new modification time of parent
+        response = self.get(self.dir.path)
+        self.assertNotEqual(response['ETag'], etag)
+        self.sub.refresh_from_db()
+        self.assertEqual(response.data['descendants'][0]['modified'],
+                         serializers.ResourceSerializer(
+                             self.sub).data['modified'])
+        # directory doesn't change totals of ancestors
+        with self.assertNumQueries(0):
+            self.get('')
+
+    def testInvalidateBulkCreateGrandparent(self):
+        """ Checks that bulk creation invalidates listing of parent."""
+        etag = self.get(self.dir.path)['ETag']
+        bulk.create_tree(self.sub, [{'name': 'new', 'is_collection': True}])
+        self.assertNotEqual(self.get(self.dir.path)['ETag'], etag)
+
+    def testInvalidateMetadata(self):
+        """ Checks that metadata change invalidates resource and parent."""
+        etag = self.get(self.sub.path)['ETag']
+        self.get(self.file.path)
+        self.file.metadata = {'a': 'b'}
+        self.file.save()
+        self.assertDictEqual(self.get(self.file.path).data['metadata'],
+                             {'a': 'b'})
+        response = self.get(self.sub.path)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertDictEqual(response.data['descendants'][0]['metadata'],
+                             {'a': 'b'})
+
+    def testInvalidateSaveMetadata(self):
+        """ Checks that metadata saved alone invalidates resource and parent.
+        """
+        etag = self.get(self.sub.path)['ETag']
+        file_etag = self.get(self.file.path)['ETag']
+        dir_etag = self.get(self.dir.path)['ETag']
+        self.file.metadata = {'a': 'b'}
+        self.assertTrue(self.file.save_metadata())
+        response = self.get(self.file.path)
+        self.assertDictEqual(response.data['metadata'], {'a': 'b'})
+        self.assertNotEqual(response['ETag'], file_etag)
+        response = self.get(self.sub.path)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertDictEqual(response.data['descendants'][0]['metadata'],
+                             {'a': 'b'})
+        self.assertNotEqual(self.get(self.dir.path)['ETag'], dir_etag)
+        self.assertFalse(self.file.save_metadata())
+
+    def testRecursiveNotCached(self):
+        """ Checks that recursive listing sees changes deep in subtree."""
+        deep = models.File.objects.create(parent=self.file.parent,
+                                          name='deep.txt')
+        params = {'recursive': 1}
+        self.client.get(self.url(''), data=params, format='json')
+        deep.metadata = {'a': 'b'}
+        deep.save()
+        response = self.client.get(self.url(''), data=params, format='json')
+        # cached response has no data, content is checked
+        descendants = json.loads(response.content.decode('utf-8'))[
+            'descendants']
+        metadata = dict((d['name'], d['metadata']) for d in descendants)
+        self.assertDictEqual(metadata['deep.txt'], {'a': 'b'})
+
+    def testInvalidateTotals(self):
+        """ Checks that resize invalidates all ancestors."""
+        self.assertEqual(self.get('').data['total_size'], 0)
+        self.file.size = 10
+        self.file.save()
+        self.assertEqual(self.get('').data['total_size'], 10)
+
+    def testInvalidateMove(self):
+        """ Checks that move invalidates old subtree paths."""
+        old_path = self.file.path
+        self.assertEqual(self.get(old_path).status_code, 200)
+        self.assertListEqual(self.names(''), ['dir'])
+        self.sub.parent = self.root
+        self.sub.save()
+        self.assertEqual(self.get(old_path).status_code, 404)
+        self.assertListEqual(self.names(''), ['dir', 'sub'])
+        self.assertListEqual(self.names(self.dir.path), [])
+
+    def testInvalidateDelete(self):
+        """ Checks that delete invalidates deleted subtree."""
+        path = self.file.path
+        self.assertEqual(self.get(path).status_code, 200)
+        self.dir.delete()
+        self.assertEqual(self.get(path).status_code, 404)
+        self.assertListEqual(self.names(''), [])
+
+    def testInvalidateBulkCreate(self):
+        """ Checks that bulk creation invalidates parent listing."""
+        self.assertListEqual(self.names(self.sub.path), ['file.txt'])
+        bulk.create_tree(self.sub, [{'name': 'a.txt', 'size': 1}])
+        self.assertListEqual(self.names(self.sub.path),
+                             ['a.txt', 'file.txt'])
+        self.assertEqual(self.get('').data['total_size'], 1)
+
+
+@override_settings(FCI_TIMING=True)
+class TimingAPITestCase(APITestCase):
+    """ Request instrumentation test case."""
+
+    def setUp(self):
+        super(TimingAPITestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        models.File.objects.create(parent=self.root, name='file.txt')
+
+    def url(self, path=''):
+        return reverse('resource-detail', kwargs={'path': path})
+
+    def testServerTiming(self):
+        """ Checks Server-Timing header and log record."""
+        with mock.patch('fci.index.timing.logger') as logger:
+            response = self.client.get(self.url(), format='json')
+        self.assertEqual(response.status_code, 200)
+        metrics = [m.split(';')[0]
+                   for m in response['Server-Timing'].split(', ')]
+        self.assertListEqual(metrics, ['db', 'resolve', 'serialize',
+                                       'render', 'total'])
+        self.assertIn('desc="4 queries"', response['Server-Timing'])
+        self.assertTrue(logger.info.called)
+        self.assertFalse(logger.warning.called)
+        stats = logger.info.call_args[1]['extra']['timing']
+        self.assertEqual(stats['queries'], 4)
+
+    def testSlowRequest(self):
+        """ Checks that slow requests are logged with slowest SQL."""
+        with self.settings(FCI_SLOW_REQUEST_MS=0):
+            with mock.patch('fci.index.timing.logger') as logger:
+                self.client.get(self.url(), format='json')
+        self.assertTrue(logger.warning.called)
+        slowest = logger.warning.call_args[1]['extra']['slowest_queries']
+        self.assertEqual(len(slowest), 3)
+        self.assertIn('SELECT', slowest[0][1])
+
+    def testDisabled(self):
+        """ Checks that instrumentation is off by default."""
+        with self.settings(FCI_TIMING=False):
+            response = self.client.get(self.url(), format='json')
+        self.assertNotIn('Server-Timing', response)
+
+
+@override_settings(FCI_CHANGES_VISIBILITY_LAG=0)
+class ChangesAPITestCase(APITestCase):
+    """ Change feed view test case."""
+
+    def setUp(self):
+        super(ChangesAPITestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        self.dir = models.Directory.objects.create(parent=self.root,
+                                                   name='dir')
+        self.other = models.Directory.objects.create(parent=self.root,
+                                                     name='other')
+
+    def url(self, path=''):
+        return reverse('resource-changes', kwargs={'path': path})
+
+    def feed(self, path='', **params):
+        response = self.client.get(self.url(path), data=params,
+                                   format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def testFeed(self):
+        """ Checks incremental sync by cursor."""
+        data = self.feed()
+        self.assertListEqual([c['path'] for c in data['changes']],
+                             ['', 'dir', 'other'])
+        cursor = data['cursor']
+        f = models.File.objects.create(parent=self.dir, name='f.txt')
+        data = self.feed(cursor=cursor)
+        self.assertEqual(len(data['changes']), 1)
+        change = data['changes'][0]
+        self.assertEqual(change['action'], 'create')
+        self.assertEqual(change['resource_id'], f.pk)
+        self.assertEqual(data['cursor'], change['id'])
+        data = self.feed(cursor=data['cursor'])
+        self.assertListEqual(data['changes'], [])
+        self.assertEqual(data['cursor'], change['id'])
+
+    def testFeedPagination(self):
+        """ Checks that feed is paginated with Link header."""
+        response = self.client.get(self.url(), data={'page_size': 2})
+        self.assertEqual(len(response.data['changes']), 2)
+        link = response['Link']
+        response = self.client.get(link[1:link.index('>')])
+        self.assertListEqual([c['path'] for c in response.data['changes']],
+                             ['other'])
+
+    def testFeedSubtree(self):
+        """ Checks feed limited to subtree, including moves out of it."""
+        cursor = self.feed()['cursor']
+        f = models.File.objects.create(parent=self.dir, name='f.txt')
+        models.File.objects.create(parent=self.other, name='g.txt')
+        f.parent = self.other
+        f.save()
+        data = self.feed('dir', cursor=cursor)
+        self.assertListEqual(
+            [(c['action'], c['path']) for c in data['changes']],
+            [('create', 'dir/f.txt'), ('move', 'other/f.txt')])
+
+    @override_settings(FCI_CHANGES_VISIBILITY_LAG=60)
+    def testFeedVisibilityLag(self):
+        """ Checks that entries are served only after visibility lag."""
+        self.assertListEqual(self.feed()['changes'], [])
+        models.Change.objects.exclude(path='other').update(
+            created=timezone.now() - timedelta(seconds=61))
+        data = self.feed()
+        self.assertListEqual([c['path'] for c in data['changes']],
+                             ['', 'dir'])
+        # newer entries are served once they are older than lag
+        models.Change.objects.update(
+            created=timezone.now() - timedelta(seconds=61))
+        data = self.feed(cursor=data['cursor'])
+        self.assertListEqual([c['path'] for c in data['changes']],
+                             ['other'])
+        self.assertFalse(models.Change.exists_after(data['cursor']))
+
+    def testFeedSaveMetadata(self):
+        """ Checks that metadata saved alone is journaled."""
+        cursor = self.feed()['cursor']
+        self.dir.metadata = {'a': 'b'}
+        self.dir.save_metadata()
+        self.dir.save_metadata()
+        data = self.feed(cursor=cursor)
+        self.assertListEqual(
+            [(c['action'], c['path']) for c in data['changes']],
+            [('metadata', 'dir')])
+
+    def testFeedExpiredCursor(self):
+        """ Checks that compacted cursor requires full resync."""
+        cursor = self.feed()['changes'][0]['id']
+        models.Change.compact(timezone.now() + timedelta(seconds=1))
+        response = self.client.get(self.url(), data={'cursor': cursor})
+        self.assertEqual(response.status_code, 410)
+        response = self.client.get(self.url(), data={'cursor': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+
+class BulkCreateAPITestCase(APITestCase):
+    """ Bulk create view test case."""
+
+    def setUp(self):
+        super(BulkCreateAPITestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        self.dir = models.Directory.objects.create(parent=self.root,
+                                                   name='dir')
+
+    def url(self, path=''):
+        return reverse('resource-bulk', kwargs={'path': path})
+
+    def testCreateNestedTree(self):
+        """ Checks creation of nested resources."""
+        data = [
+            {'name': 'a', 'is_collection': True, 'metadata': {'k': 'v'},
+             'children': [
+                 {'name': 'b', 'is_collection': True, 'children': [
+                     {'name': 'c.txt', 'size': 10}]},
+                 {'name': 'd.txt', 'size': 5, 'metadata': {'x': 1}}]},
+            {'name': 'e.txt'},
+        ]
+        response = self.client.post(self.url(self.dir.path), data=data,
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertDictEqual(response.data, {'created': 5})
+
+        a = models.Directory.objects.get(path='dir/a')
+        self.assertDictEqual(a.metadata, {'k': 'v'})
+        c = models.File.objects.get(path='dir/a/b/c.txt')
+        self.assertEqual(c.size, 10)
+        self.assertFalse(c.is_collection)
+        self.assertListEqual([p.name for p in c.parents],
+                             ['b', 'a', 'dir', '/'])
+        d = models.File.objects.get(path='dir/a/d.txt')
+        self.assertDictEqual(d.metadata, {'x': 1})
+        self.assertEqual(self.dir.descendants().count(), 5)
+
+        response = self.client.get(
+            reverse('resource-detail', kwargs={'path': 'dir/a/b/c.txt'}),
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['size'], 10)
+
+    def testCreateFromManifest(self):
+        """ Checks creation of resources from NDJSON manifest."""
+        lines = [
+            {'path': 'x/y/z.txt', 'size': 3},
+            {'path': 'x', 'is_collection': True, 'metadata': {'a': 'b'}},
+            {'path': 'w', 'is_collection': True},
+        ]
+        body = '\n'.join(json.dumps(line) for line in lines)
+        response = self.client.post(self.url(self.dir.path), data=body,
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertDictEqual(response.data, {'created': 4})
+        x = models.Directory.objects.get(path='dir/x')
+        self.assertDictEqual(x.metadata, {'a': 'b'})
+        self.assertTrue(models.Directory.objects.filter(path='dir/x/y',
+                                                        parent=x).exists())
+        self.assertEqual(models.File.objects.get(path='dir/x/y/z.txt').size, 3)
+
+    def testCreateConflict(self):
+        """ Checks that existing resource conflict rolls back whole request."""
+        data = [{'name': 'new', 'is_collection': True}, {'name': 'dir'}]
+        response = self.client.post(self.url(), data=data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.Resource.objects.filter(name='new').exists())
+
+    def testCreateValidation(self):
+        """ Checks validation of resource specs."""
+        data = [{'name': 'a/b'}]
+        response = self.client.post(self.url(), data=data, format='json')
+        self.assertEqual(response.status_code, 400)
+        data = [{'name': 'f.txt', 'is_collection': False,
+                 'children': [{'name': 'x'}]}]
+        response = self.client.post(self.url(), data=data, format='json')
+        self.assertEqual(response.status_code, 400)
+        for data in ([{'name': 'd', 'children': 5}],
+                     [{'name': 'd', 'is_collection': 'false'}],
+                     [{'name': 'd', 'size': models.MAX_SIZE + 1}]):
+            response = self.client.post(self.url(), data=data, format='json')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url(), data='{"path": 5}',
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.Resource.objects.filter(name='d').exists())
+
+    def testCreateLargeFile(self):
+        """ Checks that sizes above 32-bit range are stored."""
+        data = [{'name': 'large.iso', 'size': 10 ** 12}]
+        response = self.client.post(self.url(), data=data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(models.File.objects.get(name='large.iso').size,
+                         10 ** 12)
+        self.root.refresh_from_db()
+        self.assertEqual(self.root.total_size, 10 ** 12)
+
+    def testCreateQueryCount(self):
+        """ Checks that number of queries doesn't depend on tree width."""
+        data = [{'name': 'f%s' % i, 'metadata': {'i': i}} for i in range(50)]
+        ContentType.objects.get_for_models(models.Directory, models.File)
+        # get_object, ancestors, resources, ids, closure, metadata, metadata
+        # index, name trigrams, journal, rollups, touch of parents and
+        # savepoint handling
+        with self.assertNumQueries(13):
+            response = self.client.post(self.url(self.dir.path), data=data,
+                                        format='json')
+        self.assertEqual(response.status_code, 201)
+
+
+
+class CopyAPITestCase(APITestCase):
+    """ Subtree copy test case."""
+
+    def setUp(self):
+        super(CopyAPITestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        self.dir = models.Directory.objects.create(parent=self.root,
+                                                   name='dir')
+        self.target = models.Directory.objects.create(parent=self.root,
+                                                      name='target')
+        bulk.create_tree(self.dir, [
+            {'name': 'a', 'is_collection': True, 'metadata': {'k': 'v'},
+             'children': [{'name': 'b.txt', 'size': 10,
+                           'metadata': {'x': 1}},
+                          {'name': 'empty', 'is_collection': True}]},
+            {'name': 'c.txt', 'size': 5},
+        ])
+
+    @staticmethod
+    def url(path=''):
+        return reverse('resource-detail', kwargs={'path': path})
+
+    def copy(self, path, **data):
+        return self.client.generic('COPY', self.url(path), json.dumps(data),
+                                   content_type='application/json')
+
+    def testCopy(self):
+        """ Checks that subtree is copied with sizes and metadata."""
+        with self.assertNumQueries(36):
+            response = self.copy('dir', parent=self.target.pk, name='copy')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['url'], '/fci/resources/target/copy')
+        self.assertEqual(response.data['total_size'], 15)
+        self.assertEqual(response.data['file_count'], 2)
+        self.assertListEqual(
+            list(models.Resource.objects.filter(
+                path__startswith='target/copy').order_by('path').values_list(
+                'path', 'is_collection', 'size')),
+            [('target/copy', True, 0), ('target/copy/a', True, 0),
+             ('target/copy/a/b.txt', False, 10),
+             ('target/copy/a/empty', True, 0),
+             ('target/copy/c.txt', False, 5)])
+        a = models.Directory.objects.get(path='target/copy/a')
+        self.assertDictEqual(a.metadata, {'k': 'v'})
+        b = models.File.objects.get(path='target/copy/a/b.txt')
+        self.assertDictEqual(b.metadata, {'x': 1})
+        self.assertListEqual([p.name for p in b.parents],
+                             ['a', 'copy', 'target', '/'])
+        self.root.refresh_from_db()
+        self.assertEqual(self.root.total_size, 30)
+
+    def testCopyDefaults(self):
+        """ Checks copy to another parent with same name."""
+        response = self.copy('dir/c.txt', parent=self.target.pk)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['url'], '/fci/resources/target/c.txt')
+        response = self.copy('dir/c.txt', name='d.txt')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['url'], '/fci/resources/dir/d.txt')
+
+    def testCopyConflict(self):
+        """ Checks that existing resource is not overwritten."""
+        count = models.Resource.objects.count()
+        response = self.copy('dir/a', parent=self.dir.pk)
+        self.assertEqual(response.status_code, 400)
+        self.assertListEqual(response.data, ['Resource already exists'])
+        self.assertEqual(models.Resource.objects.count(), count)
+
+    def testCopyInvalid(self):
+        """ Checks validation of copy destination."""
+        response = self.copy('dir', parent=self.dir.pk, name='copy')
+        self.assertEqual(response.status_code, 400)
+        self.assertListEqual(response.data,
+                             ['Resource cannot be copied into itself'])
+        response = self.copy('dir', parent=self.target.pk, name='a/b')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('name', response.data)
+        file_id = models.File.objects.get(path='dir/c.txt').pk
+        response = self.copy('dir', parent=file_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertDictEqual(response.data,
+                             {'parent': ['Parent must be a collection']})
+        response = self.copy('', name='copy')
+        self.assertEqual(response.status_code, 400)
+        self.assertDictEqual(response.data,
+                             {'parent': ['This field is required.']})
+
+
+class SearchAPITestCase(APITestCase):
+    """ Search view test case."""
+
+    def setUp(self):
+        super(SearchAPITestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        self.dir = models.Directory.objects.create(parent=self.root,
+                                                   name='dir')
+        self.sub = models.Directory.objects.create(parent=self.dir,
+                                                   name='sub')
+        for parent, name in ((self.root, 'a.log'), (self.dir, 'b.log'),
+                             (self.sub, 'c.log'), (self.sub, 'c.txt')):
+            models.File.objects.create(parent=parent, name=name)
+
+    def url(self, path=''):
+        return reverse('resource-search', kwargs={'path': path})
+
+    def search(self, path='', **params):
+        response = self.client.get(self.url(path), data=params,
+                                   format='json')
+        self.assertEqual(response.status_code, 200)
+        return [d['name'] for d in response.data['results']]
+
+    def testSearchTree(self):
+        """ Checks name search across whole tree."""
+        self.assertListEqual(self.search(glob='*.log'),
+                             ['a.log', 'b.log', 'c.log'])
+        self.assertListEqual(self.search(prefix='c.'), ['c.log', 'c.txt'])
+        self.assertListEqual(self.search(contains='.tx'), ['c.txt'])
+
+    def testSearchSubtree(self):
+        """ Checks name search limited to collection subtree."""
+        self.assertListEqual(self.search('dir', suffix='.log'),
+                             ['b.log', 'c.log'])
+        self.assertListEqual(self.search('dir/sub', glob='*.log'),
+                             ['c.log'])
+
+    def testSearchPagination(self):
+        """ Checks that search results are paginated."""
+        response = self.client.get(self.url(), data={'glob': '*.log',
+                                                     'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        link = response['Link']
+        response = self.client.get(link[1:link.index('>')])
+        self.assertListEqual([d['name'] for d in response.data['results']],
+                             ['c.log'])
+
+    def testSearchInFile(self):
+        """ Checks that files can't be searched in."""
+        response = self.client.get(self.url('a.log'), data={'glob': '*'})
+        self.assertEqual(response.status_code, 400)
+
+
+class NamespaceAPITestCase(APITestCase):
+    """ Independent resource trees test case."""
+
+    def setUp(self):
+        super(NamespaceAPITestCase, self).setUp()
+        caches['default'].clear()
+        self.root = models.Directory.objects.create(name='/')
+        self.dir = models.Directory.objects.create(parent=self.root,
+                                                   name='dir')
+        self.other = models.Directory.objects.create(name='/',
+                                                     namespace='other')
+        self.other_dir = models.Directory.objects.create(parent=self.other,
+                                                         name='dir')
+        models.File.objects.create(parent=self.other_dir, name='f.txt')
+
+    @staticmethod
+    def url(path='', name='resource-detail'):
+        return reverse('namespace-' + name,
+                       kwargs={'namespace': 'other', 'path': path})
+
+    def testRetrieve(self):
+        """ Checks that path is resolved in namespace from URL."""
+        response = self.client.get(self.url('dir'), format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], self.other_dir.pk)
+        self.assertEqual(response.data['url'], '/fci/ns/other/resources/dir')
+        self.assertListEqual(
+            [d['url'] for d in response.data['descendants']],
+            ['/fci/ns/other/resources/dir/f.txt'])
+        response = self.client.get(
+            reverse('resource-detail', kwargs={'path': 'dir'}))
+        self.assertEqual(response.data['id'], self.dir.pk)
+        response = self.client.get(reverse(
+            'namespace-resource-detail',
+            kwargs={'namespace': 'missing', 'path': ''}))
+        self.assertEqual(response.status_code, 404)
+
+    def testCreate(self):
+        """ Checks that created resource inherits namespace of parent."""
+        response = self.client.post(self.url('dir'), data={
+            'is_collection': False, 'name': 'g.txt', 'metadata': {}
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['url'],
+                         '/fci/ns/other/resources/dir/g.txt')
+        resource = models.Resource.objects.get(pk=response.data['id'])
+        self.assertEqual(resource.namespace, 'other')
+
+    def testMoveToOtherNamespace(self):
+        """ Checks that resource can't be moved to other namespace."""
+        response = self.client.patch(self.url('dir/f.txt'), data={
+            'parent': self.dir.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent', response.data)
+
+    def testSearch(self):
+        """ Checks that search doesn't leave namespace."""
+        models.File.objects.create(parent=self.dir, name='f.txt')
+        response = self.client.get(self.url(name='resource-search'),
+                                   data={'glob': '*.txt'})
+        self.assertListEqual([d['url'] for d in response.data['results']],
+                             ['/fci/ns/other/resources/dir/f.txt'])
+
+    @override_settings(FCI_CHANGES_VISIBILITY_LAG=0)
+    def testChanges(self):
+        """ Checks that change feed is separate for namespace."""
+        response = self.client.get(self.url(name='resource-changes'))
+        self.assertListEqual([c['path'] for c in response.data['changes']],
+                             ['', 'dir', 'dir/f.txt'])
+        response = self.client.get(
+            reverse('resource-changes', kwargs={'path': 'dir'}))
+        self.assertListEqual([c['path'] for c in response.data['changes']],
+                             ['dir'])
+
+    @override_settings(FCI_CACHE='default')
+    def testCache(self):
+        """ Checks that cached responses are separate for namespace."""
+        default_url = reverse('resource-detail', kwargs={'path': 'dir'})
+        self.client.get(default_url)
+        self.client.get(self.url('dir'))
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url('dir'))
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['id'], self.other_dir.pk)
+        models.File.objects.create(parent=self.other_dir, name='g.txt')
+        response = self.client.get(self.url('dir'))
+        self.assertEqual(len(response.data['descendants']), 2)
+
+
+class RowSerializerTestCase(APITestCase):
+    """ Fast listing serializer test case."""
+
+    def setUp(self):
+        super(RowSerializerTestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        parent = models.Directory.objects.create(name='dir with spaces',
+                                                 parent=self.root)
+        parent.metadata = {'owner': 'me'}
+        parent.save()
+        f = models.File(name='ф@й:л%(1)~#?.txt', parent=parent, size=3)
+        f.metadata = {'mime-type': 'text/plain', 'size': [1, 2]}
+        f.save()
+        empty = models.File.objects.create(name='empty', parent=parent)
+        # whole seconds are rendered without fraction
+        models.Resource.objects.filter(pk=empty.pk).update(
+            created=timezone.now().replace(microsecond=0))
+
+    def testSameRepresentation(self):
+        """ Checks rows are rendered exactly as model serializer does."""
+        queryset = models.Resource.objects.filter(
+            parent__isnull=False).order_by('pk').with_metadata()
+        expected = [serializers.PlainResourceSerializer(r).data
+                    for r in queryset]
+        rows = serializers.ResourceRowSerializer().to_representation(
+            queryset.rows())
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(rows), renderer.render(expected))
+        # metadata saved through proxy models is found for rows
+        self.assertListEqual([r['metadata'] for r in rows], [
+            {'owner': 'me'}, {'mime-type': 'text/plain', 'size': [1, 2]}, {}])
+
+    @override_settings(TIME_ZONE='Europe/Moscow')
+    def testTimezoneRepresentation(self):
+        """ Checks rows are rendered as detail view with non-UTC timezone.
+        """
+        resource = models.Resource.objects.polymorphic().get(
+            name='empty')
+        expected = serializers.PlainResourceSerializer(resource).data
+        row = models.Resource.objects.filter(pk=resource.pk).rows()[0]
+        data = serializers.ResourceRowSerializer().to_representation([row])
+        self.assertEqual(data[0]['created'], expected['created'])
+        self.assertEqual(data[0]['modified'], expected['modified'])
+
+        # datetime field converting to current timezone is used as is
+        def to_representation(field, value):
+            return timezone.localtime(value).isoformat()
+
+        with mock.patch.object(rest_serializers.DateTimeField,
+                               'to_representation', to_representation):
+            data = serializers.ResourceRowSerializer().to_representation(
+                [row])
+        self.assertEqual(data[0]['modified'],
+                         timezone.localtime(row['modified']).isoformat())
+        self.assertTrue(data[0]['modified'].endswith('+03:00'))
+
+    def testConcreteRepresentation(self):
+        """ Checks rows are rendered as concrete resources."""
+        d = models.Directory.objects.create(name='d', parent=self.root)
+        f = models.File(name='f', parent=d, size=10)
+        f.metadata = {'a': 1}
+        f.save()
+        queryset = models.Resource.objects.filter(
+            pk__in=[d.pk, f.pk]).order_by('pk').with_metadata()
+        resources = list(queryset.polymorphic())
+        expected = [serializers.DirectorySerializer(resources[0]).data,
+                    serializers.FileSerializer(resources[1]).data]
+        rows = serializers.ResourceRowSerializer().to_representation(
+            queryset.rows())
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(rows), renderer.render(expected))
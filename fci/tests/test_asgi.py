@@ -0,0 +1,192 @@
+# coding: utf-8
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipIf
+
+import mock
+from django.core.urlresolvers import reverse
+from django.test import TransactionTestCase, override_settings
+
+from fci.index import models
+
+try:
+    import asyncio
+    from standalone import asgi
+except (ImportError, SyntaxError):
+    # Python 2
+    asgi = None
+
+
+@skipIf(asgi is None, "ASGI requires Python 3.5+")
+class ASGITestCase(TransactionTestCase):
+    """ ASGI application test case."""
+
+    def setUp(self):
+        super(ASGITestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        self.dir = models.Directory.objects.create(parent=self.root,
+                                                   name='dir')
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.app = asgi.Application(executor=self.executor)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        self.executor.shutdown()
+        super(ASGITestCase, self).tearDown()
+
+    def request(self, url, method='GET', query=b'', body=b'',
+                disconnect=False, send_error=None):
+        """
+        Runs ASGI request, returns status, headers and body.
+
+        :param disconnect: client goes away right after request.
+        :param send_error: exception raised by send() of response body.
+        """
+        scope = {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': method,
+            'path': url,
+            'query_string': query,
+            'headers': [(b'host', b'testserver'),
+                        (b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode())],
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 12345),
+        }
+        received = [{'type': 'http.request', 'body': body}]
+        if disconnect:
+            received.append({'type': 'http.disconnect'})
+        messages = []
+
+        def completed(result):
+            future = self.loop.create_future()
+            future.set_result(result)
+            return future
+
+        def receive():
+            if not received:
+                # client is still connected
+                return self.loop.create_future()
+            return completed(received.pop(0))
+
+        def send(message):
+            if send_error is not None and messages:
+                raise send_error
+            messages.append(message)
+            return completed(None)
+
+        self.loop.run_until_complete(asyncio.wait_for(
+            self.app(scope, receive, send), 5, loop=self.loop))
+        if disconnect or send_error is not None:
+            return messages
+        start = messages[0]
+        self.assertEqual(start['type'], 'http.response.start')
+        self.assertFalse(messages[-1].get('more_body'))
+        body = b''.join(m['body'] for m in messages[1:])
+        return start['status'], dict(start['headers']), body
+
+    def testRetrieve(self):
+        """ Checks that resource is served from thread pool."""
+        url = reverse('resource-detail', kwargs={'path': 'dir'})
+        status, headers, body = self.request(url)
+        self.assertEqual(status, 200)
+        self.assertIn(b'etag', headers)
+        self.assertEqual(json.loads(body.decode('utf-8'))['id'], self.dir.pk)
+
+    def testCreate(self):
+        """ Checks that request body is passed to view."""
+        url = reverse('resource-detail', kwargs={'path': 'dir'})
+        body = b'{"name": "f.txt", "is_collection": false, "metadata": {}}'
+        status, _, _ = self.request(url, method='POST', body=body)
+        self.assertEqual(status, 201)
+        self.assertTrue(models.File.objects.filter(path='dir/f.txt').exists())
+
+    def testStream(self):
+        """ Checks that streamed listing is sent in chunks."""
+        for i in range(3):
+            models.File.objects.create(parent=self.dir, name='%s.txt' % i)
+        url = reverse('resource-detail', kwargs={'path': 'dir'})
+        status, _, body = self.request(url, query=b'stream=1')
+        self.assertEqual(status, 200)
+        data = json.loads(body.decode('utf-8'))
+        self.assertEqual(len(data['descendants']), 3)
+
+    def stream(self, **kwargs):
+        """
+        Runs streamed listing request with endless response, returns sent
+        messages, number of generated chunks and whether generator was
+        closed.
+        """
+        generated = []
+        closed = []
+
+        def iter_resource_json(*args, **kwargs):
+            try:
+                while True:
+                    generated.append(1)
+                    yield '[]'
+            finally:
+                closed.append(1)
+
+        url = reverse('resource-detail', kwargs={'path': 'dir'})
+        with mock.patch('fci.index.streaming.iter_resource_json',
+                        iter_resource_json):
+            messages = self.request(url, query=b'stream=1', **kwargs)
+        return messages, len(generated), bool(closed)
+
+    def testStreamSendError(self):
+        """ Checks that response is closed when send fails."""
+        messages, generated, closed = self.stream(send_error=OSError())
+        self.assertListEqual([m['type'] for m in messages],
+                             ['http.response.start'])
+        self.assertTrue(closed)
+        # worker is paced by send queue
+        self.assertLessEqual(generated, asgi.Application.queue_size + 2)
+
+    def testStreamDisconnect(self):
+        """ Checks that streaming stops when client disconnects."""
+        messages, generated, closed = self.stream(disconnect=True)
+        self.assertTrue(closed)
+        self.assertLessEqual(len(messages), asgi.Application.queue_size + 1)
+        self.assertLessEqual(generated, asgi.Application.queue_size + 2)
+
+    def feed(self, path, query):
+        url = reverse('resource-changes', kwargs={'path': path})
+        status, _, body = self.request(url, query=query)
+        self.assertEqual(status, 200)
+        return json.loads(body.decode('utf-8'))
+
+    @override_settings(FCI_LONG_POLL_INTERVAL=0.01,
+                       FCI_CHANGES_VISIBILITY_LAG=0)
+    def testLongPollTimeout(self):
+        """ Checks that long poll returns empty feed after wait time."""
+        cursor = models.Change.objects.latest('pk').pk
+        start = self.loop.time()
+        data = self.feed('dir', b'wait=0.1&cursor=%d' % cursor)
+        self.assertGreaterEqual(self.loop.time() - start, 0.1)
+        self.assertListEqual(data['changes'], [])
+
+    @override_settings(FCI_LONG_POLL_INTERVAL=0.01,
+                       FCI_CHANGES_VISIBILITY_LAG=0)
+    def testLongPollChange(self):
+        """ Checks that long poll returns as soon as subtree changes."""
+        cursor = models.Change.objects.latest('pk').pk
+
+        def change():
+            models.Directory.objects.create(parent=self.root, name='other')
+            models.File.objects.create(parent=self.dir, name='f.txt')
+
+        self.loop.call_later(0.05, change)
+        start = self.loop.time()
+        data = self.feed('dir', b'wait=10&cursor=%d' % cursor)
+        self.assertLess(self.loop.time() - start, 5)
+        self.assertListEqual([c['path'] for c in data['changes']],
+                             ['dir/f.txt'])
+
+    def testLongPollExpiredCursor(self):
+        """ Checks that expired cursor is not waited for."""
+        url = reverse('resource-changes', kwargs={'path': ''})
+        status, _, _ = self.request(url, query=b'wait=10&cursor=100000')
+        self.assertEqual(status, 410)
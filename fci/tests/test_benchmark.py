@@ -0,0 +1,60 @@
+# coding: utf-8
+from collections import OrderedDict
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from fci.index import benchmark, models
+
+SMALL_TREES = OrderedDict([
+    ('chain', {'depth': 20}),
+    ('wide', {'width': 200}),
+    ('mixed', {'depth': 3, 'fanout': 3, 'files': 5}),
+])
+
+
+class QueryBudgetTestCase(TestCase):
+    """ Checks that hot paths stay within their query budgets."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super(QueryBudgetTestCase, cls).setUpTestData()
+        ContentType.objects.get_for_models(
+            models.Resource, models.Directory, models.File)
+        cls.results = benchmark.run(trees=SMALL_TREES, repeat=3)
+
+    def assertWithinBudget(self, scenario):
+        results = [r for r in self.results if r['scenario'] == scenario]
+        self.assertEqual(len(results), len(SMALL_TREES))
+        for result in results:
+            self.assertLessEqual(
+                result['queries'], result['budget'],
+                '%(scenario)s on %(tree)s tree: %(queries)s queries' % result)
+
+    def testGetObject(self):
+        self.assertWithinBudget('get_object')
+
+    def testRetrieve(self):
+        self.assertWithinBudget('retrieve')
+
+    def testCreate(self):
+        self.assertWithinBudget('create')
+
+    def testRename(self):
+        self.assertWithinBudget('rename')
+
+    def testMove(self):
+        self.assertWithinBudget('move')
+
+    def testPath(self):
+        self.assertWithinBudget('path')
+
+    def testCleanParent(self):
+        self.assertWithinBudget('clean_parent')
+
+    def testQueriesDoNotDependOnTreeShape(self):
+        """ Checks that query counts are same for all kinds of trees."""
+        for scenario in ('get_object', 'path', 'clean_parent'):
+            counts = set(r['queries'] for r in self.results
+                         if r['scenario'] == scenario)
+            self.assertEqual(len(counts), 1, scenario)
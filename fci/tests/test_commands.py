@@ -0,0 +1,225 @@
+# coding: utf-8
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+from six import StringIO
+
+from fci.index import benchmark, bulk, models
+
+
+class IndexTreeCommandTestCase(TestCase):
+    """ index_tree management command test case."""
+
+    def setUp(self):
+        super(IndexTreeCommandTestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        self.source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source)
+        os.makedirs(os.path.join(self.source, 'a', 'b'))
+        os.makedirs(os.path.join(self.source, 'c'))
+        self.write('a/b/file.txt', b'12345')
+        self.write('a/image.jpg', b'123')
+        self.write('top.txt', b'')
+
+    def write(self, path, content):
+        with open(os.path.join(self.source, path), 'wb') as f:
+            f.write(content)
+
+    def index(self, *args, **kwargs):
+        out = StringIO()
+        call_command('index_tree', self.source, *args, stdout=out,
+                     stderr=StringIO(), **kwargs)
+        return out.getvalue()
+
+    def assertIndexed(self):
+        paths = set(models.Resource.objects.exclude(
+            pk=self.root.pk).values_list('path', flat=True))
+        self.assertSetEqual(paths, {'a', 'a/b', 'a/b/file.txt',
+                                    'a/image.jpg', 'c', 'top.txt'})
+        self.assertEqual(models.File.objects.get(path='a/b/file.txt').size, 5)
+        self.assertTrue(models.Directory.objects.filter(path='a/b').exists())
+        b = models.Resource.objects.get(path='a/b')
+        self.assertListEqual([p.name for p in b.parents], ['a', '/'])
+
+    def testIndexTree(self):
+        """ Checks indexing of local directory tree."""
+        out = self.index(batch_size=2, mime_type=True, mtime=True)
+        self.assertIn('Indexed 6 resources', out)
+        self.assertIndexed()
+        image = models.File.objects.get(path='a/image.jpg')
+        self.assertEqual(image.metadata['mime-type'], 'image/jpeg')
+        self.assertIn('mtime', image.metadata)
+
+    def testIndexTreeThreads(self):
+        """ Checks indexing with thread pool."""
+        self.index(threads=3)
+        self.assertIndexed()
+
+    def testResume(self):
+        """ Checks that resumed run indexes only missing resources."""
+        a = models.Directory.objects.create(name='a', parent=self.root)
+        models.Directory.objects.create(name='b', parent=a)
+        out = self.index(resume=True)
+        self.assertIn('Indexed 4 resources', out)
+        self.assertIndexed()
+        out = self.index(resume=True)
+        self.assertIn('Indexed 0 resources', out)
+
+    def testTarget(self):
+        """ Checks indexing into nested collection."""
+        target = models.Directory.objects.create(name='t', parent=self.root)
+        self.index(target='t')
+        self.assertEqual(target.descendants().count(), 6)
+        self.assertTrue(models.File.objects.filter(
+            path='t/a/b/file.txt').exists())
+
+
+class CompactChangesCommandTestCase(TestCase):
+    """ compact_changes management command test case."""
+
+    def testCompact(self):
+        """ Checks that old entries except the latest one are deleted."""
+        root = models.Directory.objects.create(name='/')
+        for i in range(3):
+            models.File.objects.create(name='f%s' % i, parent=root)
+        models.Change.objects.update(
+            created=timezone.now() - timedelta(days=10))
+        models.File.objects.create(name='new', parent=root)
+        out = StringIO()
+        call_command('compact_changes', days=5, stdout=out)
+        self.assertIn('Deleted 4 journal entries', out.getvalue())
+        self.assertListEqual(
+            list(models.Change.objects.values_list('path', flat=True)),
+            ['new'])
+
+        models.Change.objects.update(
+            created=timezone.now() - timedelta(days=10))
+        call_command('compact_changes', days=5, stdout=out)
+        self.assertEqual(models.Change.objects.count(), 1)
+
+
+class SnapshotCommandsTestCase(TestCase):
+    """ export_tree and import_tree management commands test case."""
+
+    def setUp(self):
+        super(SnapshotCommandsTestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        bulk.create_tree(self.root, [
+            {'name': 'a', 'is_collection': True, 'metadata': {'k': 'v'},
+             'children': [
+                 {'name': 'b', 'is_collection': True, 'children': [
+                     {'name': 'file.txt', 'size': 5,
+                      'metadata': {'width': 10}}]},
+                 {'name': 'empty', 'is_collection': True}]},
+            # sorts between "a" and "a/b"
+            {'name': 'a-c.txt', 'size': 3},
+        ])
+        self.root.metadata = {'owner': 'me'}
+        self.root.save()
+        self.other = models.Directory.objects.create(name='/',
+                                                     namespace='other')
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.snapshot = os.path.join(self.dir, 'snapshot.ndjson')
+
+    def export(self, **kwargs):
+        out = StringIO()
+        call_command('export_tree', stdout=out, **kwargs)
+        return out.getvalue()
+
+    def load(self, **kwargs):
+        out = StringIO()
+        call_command('import_tree', self.snapshot, stdout=out, **kwargs)
+        return out.getvalue()
+
+    @staticmethod
+    def dump(namespace):
+        resources = models.Resource.objects.filter(
+            namespace=namespace).with_metadata().order_by('path')
+        return [(r.path, r.is_collection, r.size, r.total_size,
+                 r.file_count, r.child_count, r.metadata,
+                 sorted(r.name_trigrams.values_list('trigram', flat=True)),
+                 sorted(r.metadata_index.values_list('key', 'value')),
+                 sorted(r.ancestors().values_list('path', flat=True)))
+                for r in resources]
+
+    def testExportFormat(self):
+        """ Checks that parents precede children in snapshot."""
+        lines = [json.loads(l) for l in self.export(path='a').splitlines()]
+        self.assertDictEqual(lines[0], {'format': 'fci-tree', 'version': 1,
+                                        'namespace': '', 'path': 'a'})
+        self.assertDictEqual(lines[1], {
+            'id': models.Resource.objects.get(path='a').pk, 'parent': None,
+            'name': 'a', 'is_collection': True, 'metadata': {'k': 'v'}})
+        self.assertListEqual([l['name'] for l in lines[2:]],
+                             ['b', 'file.txt', 'empty'])
+        self.assertEqual(lines[3]['size'], 5)
+
+    def testRoundTrip(self):
+        """ Checks that whole tree is restored in other namespace."""
+        self.assertIn('Exported 6 resources',
+                      self.export(output=self.snapshot, chunk_size=2))
+        # snapshot root is replaced by target
+        self.assertIn('Imported 5 resources',
+                      self.load(namespace='other', batch_size=2))
+        # including metadata of root
+        self.assertListEqual(self.dump('other'), self.dump(''))
+        self.assertListEqual(
+            list(models.Change.objects.filter(namespace='other').order_by(
+                'pk').values_list('action', 'path')),
+            [('create', ''), ('metadata', ''), ('create', 'a'),
+             ('create', 'a-c.txt'), ('create', 'a/b'),
+             ('create', 'a/b/file.txt'), ('create', 'a/empty')])
+
+    def testImportSubtree(self):
+        """ Checks that subtree is restored as child of target."""
+        self.export(path='a/b', output=self.snapshot)
+        self.load(target='a/empty')
+        b = models.Directory.objects.get(path='a/empty/b')
+        self.assertEqual(b.total_size, 5)
+        a = models.Directory.objects.get(path='a')
+        self.assertEqual((a.total_size, a.file_count), (10, 2))
+        self.assertTrue(models.File.objects.filter(
+            path='a/empty/b/file.txt', name_trigrams__trigram='fil',
+            metadata_index__key='width').exists())
+
+    def testImportConflict(self):
+        """ Checks that import is rolled back on name conflict."""
+        self.export(path='a', output=self.snapshot)
+        count = models.Resource.objects.count()
+        with self.assertRaisesRegexp(CommandError, 'already exists'):
+            self.load()
+        self.assertEqual(models.Resource.objects.count(), count)
+        with open(self.snapshot, 'w') as f:
+            f.write('{"format": "other"}\n')
+        with self.assertRaisesRegexp(CommandError, 'Unsupported'):
+            self.load()
+
+
+class BenchmarkCommandTestCase(TestCase):
+    """ benchmark management command test case."""
+
+    def testJSONOutput(self):
+        """ Checks machine-readable output and rollback of changes."""
+        out = StringIO()
+        call_command('benchmark', repeat=1, tree=['chain', 'wide'],
+                     depth=5, width=10, scenario=['get_object', 'move'],
+                     stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertListEqual(
+            [(r['tree'], r['scenario']) for r in results],
+            [('chain', 'get_object'), ('chain', 'move'),
+             ('wide', 'get_object'), ('wide', 'move')])
+        self.assertDictEqual(results[0]['params'], {'depth': 5})
+        for result in results:
+            self.assertGreaterEqual(result['mean_ms'], 0)
+            self.assertEqual(result['budget'],
+                             benchmark.QUERY_BUDGETS[result['scenario']])
+        self.assertEqual(models.Resource.objects.count(), 0)
@@ -4,7 +4,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 from django.test import TestCase
 
-from fci.index import models
+from fci.index import bulk, models
 
 
 class ResourceTestCaseBase(TestCase):
@@ -55,6 +55,184 @@ class ResourceModelTestCase(ResourceTestCaseBase):
                                            is_collection=False)
         self.assertEqual(c.path, 'a/b/c')
 
+    def testResourcePathRename(self):
+        """ Checks that rename updates paths of the whole subtree."""
+        a = models.Resource.objects.create(parent=self.root, name='a',
+                                           is_collection=True)
+        b = models.Resource.objects.create(parent=a, name='b',
+                                           is_collection=True)
+        c = models.Resource.objects.create(parent=b, name='c',
+                                           is_collection=False)
+        ab = models.Resource.objects.create(parent=self.root, name='ab',
+                                            is_collection=True)
+        a.name = 'A'
+        a.save()
+        for r in (a, b, c, ab):
+            r.refresh_from_db()
+        self.assertEqual(a.path, 'A')
+        self.assertEqual(b.path, 'A/b')
+        self.assertEqual(c.path, 'A/b/c')
+        self.assertEqual(ab.path, 'ab')
+
+    def testResourcePathMove(self):
+        """ Checks that move updates paths of the whole subtree."""
+        a = models.Resource.objects.create(parent=self.root, name='a',
+                                           is_collection=True)
+        b = models.Resource.objects.create(parent=a, name='b',
+                                           is_collection=True)
+        c = models.Resource.objects.create(parent=b, name='c',
+                                           is_collection=False)
+        d = models.Resource.objects.create(parent=self.root, name='d',
+                                           is_collection=True)
+        b.parent = d
+        b.save(update_fields=['parent'])
+        for r in (b, c):
+            r.refresh_from_db()
+        self.assertEqual(b.path, 'd/b')
+        self.assertEqual(c.path, 'd/b/c')
+
+    def testPathHash(self):
+        """ Checks that path digests follow renames and moves of subtrees."""
+        a = models.Directory.objects.create(parent=self.root, name='a')
+        b = models.Directory.objects.create(parent=a, name='b')
+        models.File.objects.create(parent=b, name='c')
+        d = models.Directory.objects.create(parent=self.root, name='d')
+        a.name = 'x'
+        a.save()
+        b.parent = d
+        b.save()
+        rows = models.Resource.objects.values_list('path', 'path_hash')
+        for path, path_hash in rows:
+            self.assertEqual(path_hash, models.hash_path(path))
+        c = models.Resource.objects.at_path('d/b/c').get()
+        self.assertEqual(c.name, 'c')
+        self.assertFalse(models.Resource.objects.at_path('x/b/c').exists())
+
+    def testStaleInstanceSave(self):
+        """ Checks that stale instance doesn't write back its old path."""
+        a = models.Directory.objects.create(parent=self.root, name='a')
+        b = models.Directory.objects.create(parent=a, name='b')
+        models.File.objects.create(parent=b, name='f', size=1)
+        f = models.File.objects.get(path='a/b/f')
+        stale_b = models.Directory.objects.get(pk=b.pk)
+        a.name = 'x'
+        a.save()
+        f.size = 2
+        f.save()
+        f.refresh_from_db()
+        self.assertEqual(f.path, 'x/b/f')
+        self.assertEqual(models.File.objects.get(path='x/b/f').size, 2)
+        # rollups are not overwritten either
+        self.assertEqual(stale_b.total_size, 1)
+        stale_b.save()
+        stale_b.refresh_from_db()
+        self.assertEqual(stale_b.path, 'x/b')
+        self.assertEqual(stale_b.total_size, 2)
+
+    def testStaleInstanceRename(self):
+        """ Checks that stale instance is renamed under actual parent path."""
+        a = models.Directory.objects.create(parent=self.root, name='a')
+        b = models.Directory.objects.create(parent=a, name='b')
+        c = models.File.objects.create(parent=b, name='c')
+        a.name = 'x'
+        a.save()
+        b.name = 'y'
+        b.save()
+        c.refresh_from_db()
+        self.assertEqual(c.path, 'x/y/c')
+        change = models.Change.objects.order_by('-pk')[0]
+        self.assertEqual((change.old_path, change.path), ('x/b', 'x/y'))
+
+    def testResourceAncestors(self):
+        """ Checks ancestors and descendants querysets."""
+        a = models.Resource.objects.create(parent=self.root, name='a',
+                                           is_collection=True)
+        b = models.Resource.objects.create(parent=a, name='b',
+                                           is_collection=True)
+        c = models.Resource.objects.create(parent=b, name='c',
+                                           is_collection=False)
+        with self.assertNumQueries(1):
+            parents = list(c.parents)
+        self.assertListEqual(parents, [b, a, self.root])
+        self.assertSetEqual(set(self.root.descendants()), {a, b, c})
+        self.assertSetEqual(set(a.descendants(max_depth=1)), {b})
+        self.assertEqual(a.descendants(include_self=True).count(), 3)
+
+    def testResourceMoveClosure(self):
+        """ Checks that move relinks subtree to new ancestors."""
+        a = models.Resource.objects.create(parent=self.root, name='a',
+                                           is_collection=True)
+        b = models.Resource.objects.create(parent=a, name='b',
+                                           is_collection=True)
+        c = models.Resource.objects.create(parent=b, name='c',
+                                           is_collection=False)
+        d = models.Resource.objects.create(parent=self.root, name='d',
+                                           is_collection=True)
+        b = models.Resource.objects.get(pk=b.pk)
+        b.parent = d
+        b.save()
+        self.assertListEqual(list(c.parents), [b, d, self.root])
+        self.assertSetEqual(set(a.descendants()), set())
+        self.assertSetEqual(set(d.descendants()), {b, c})
+        self.assertEqual(
+            models.ResourceClosure.objects.get(ancestor=self.root,
+                                               descendant=c).depth, 3)
+
+    def testCircularReferenceSingleQuery(self):
+        """ Checks that cycle detection doesn't depend on tree depth."""
+        parent = a = models.Resource.objects.create(
+            parent=self.root, name='a', is_collection=True)
+        for i in range(30):
+            parent = models.Resource.objects.create(
+                parent=parent, name='d%s' % i, is_collection=True)
+        a.parent = parent
+        with self.assertNumQueries(1):
+            errors = a.clean_parent()
+        self.assertListEqual(errors['parent'],
+                             ["Resource is a parent of itself"])
+
+    def testDeleteSubtree(self):
+        """ Checks set-based deletion of subtree with metadata."""
+        a = models.Directory.objects.create(parent=self.root, name='a')
+        b = models.Directory.objects.create(parent=a, name='b')
+        for i in range(5):
+            f = models.File(parent=b, name='f%s' % i)
+            f.metadata = {'i': i}
+            f.save()
+        a.metadata = {'a': 'b'}
+        a.save()
+        other = models.File.objects.create(parent=self.root, name='other')
+        count = a.delete_subtree(batch_size=2)
+        self.assertEqual(count, 7)
+        self.assertListEqual(
+            list(models.Resource.objects.values_list('pk', flat=True)),
+            [self.root.pk, other.pk])
+        self.assertListEqual(
+            list(models.Directory.objects.values_list('pk', flat=True)),
+            [self.root.pk])
+        self.assertEqual(models.File.objects.count(), 1)
+        self.assertEqual(models.Metadata.objects.count(), 0)
+        self.assertEqual(models.MetadataIndex.objects.count(), 0)
+        self.assertSetEqual(
+            set(models.ResourceClosure.objects.values_list(
+                'ancestor_id', 'descendant_id')),
+            {(self.root.pk, self.root.pk), (other.pk, other.pk),
+             (self.root.pk, other.pk)})
+
+    def testDeleteQueryCount(self):
+        """ Checks that delete doesn't load subtree into memory."""
+        a = models.Directory.objects.create(parent=self.root, name='a')
+        for i in range(20):
+            models.File.objects.create(parent=a, name='f%s' % i)
+        ContentType.objects.get_for_models(
+            models.Resource, models.Directory, models.File)
+        # ids batch, file totals, 2 rollup updates, touch of parents,
+        # journal entry, 5 deletes, empty batch and savepoints
+        with self.assertNumQueries(16):
+            result = a.delete()
+        self.assertEqual(result, (21, {'index.Resource': 21}))
+        self.assertIsNone(a.pk)
+
     def testRootPathIsOK(self):
         """ Checks that root path is returned correctly."""
         self.assertEqual(self.root.path, '')
@@ -125,6 +303,313 @@ class FileModelTestCase(ResourceTestCaseBase):
         self.assertFalse(f.is_collection)
 
 
+class PolymorphicQuerySetTestCase(ResourceTestCaseBase):
+
+    def testConcreteInstances(self):
+        """ Checks that resources are returned with concrete types."""
+        d = models.Directory.objects.create(name='d', parent=self.root)
+        f = models.File(name='f', parent=d, size=3)
+        f.metadata = {'a': 1}
+        f.save()
+        ContentType.objects.get_for_models(
+            models.Resource, models.Directory, models.File)
+        queryset = models.Resource.objects.order_by('pk')
+        with self.assertNumQueries(2):
+            resources = list(queryset.polymorphic().with_metadata())
+            self.assertEqual(resources[2].size, 3)
+            self.assertDictEqual(resources[2].metadata, {'a': 1})
+            self.assertEqual(resources[2].path, 'd/f')
+        self.assertListEqual([type(r) for r in resources],
+                             [models.Directory, models.Directory, models.File])
+
+    def testRows(self):
+        """ Checks that rows carry fields of both resource types."""
+        d = models.Directory.objects.create(name='d', parent=self.root)
+        models.File.objects.create(name='f', parent=d, size=3)
+        rows = list(models.Resource.objects.order_by('pk').rows())
+        self.assertEqual(rows[1]['total_size'], 3)
+        self.assertEqual(rows[1]['file_count'], 1)
+        self.assertEqual(rows[2]['size'], 3)
+
+
+class NamespaceTestCase(TestCase):
+    """ Independent resource trees test case."""
+
+    def setUp(self):
+        super(NamespaceTestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        self.other = models.Directory.objects.create(name='/',
+                                                     namespace='other')
+
+    def testInheritNamespace(self):
+        """ Checks that resources belong to namespace of their root."""
+        a = models.Directory.objects.create(parent=self.other, name='a')
+        f = models.File.objects.create(parent=a, name='f')
+        bulk.create_tree(a, [{'name': 'b', 'children': [{'name': 'g'}]}])
+        self.assertEqual(f.namespace, 'other')
+        self.assertSetEqual(
+            set(models.Resource.objects.filter(
+                namespace='other').values_list('path', flat=True)),
+            {'', 'a', 'a/f', 'a/b', 'a/b/g'})
+        self.assertSetEqual(
+            set(models.Change.objects.in_subtree('a', 'other').values_list(
+                'path', flat=True)),
+            {'a', 'a/f', 'a/b', 'a/b/g'})
+        self.assertFalse(models.Change.objects.in_subtree('a').exists())
+
+    def testSamePath(self):
+        """ Checks that paths are unique within namespace only."""
+        a = models.Directory.objects.create(parent=self.root, name='a')
+        models.File.objects.create(parent=a, name='f')
+        b = models.Directory.objects.create(parent=self.other, name='a')
+        models.File.objects.create(parent=b, name='f')
+        a.name = 'renamed'
+        a.save()
+        self.assertListEqual(
+            sorted(models.Resource.objects.values_list('namespace', 'path')),
+            [('', ''), ('', 'renamed'), ('', 'renamed/f'),
+             ('other', ''), ('other', 'a'), ('other', 'a/f')])
+
+    def testMoveToOtherNamespace(self):
+        """ Checks that resource can't be moved to other namespace."""
+        a = models.Directory.objects.create(parent=self.root, name='a')
+        a.parent = self.other
+        with self.assertRaises(ValidationError) as e:
+            a.clean()
+        self.assertDictContainsSubset(
+            {'parent': ["Parent must be in the same namespace"]},
+            e.exception.message_dict)
+
+
+class DirectoryRollupTestCase(TestCase):
+
+    def setUp(self):
+        super(DirectoryRollupTestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        self.a = models.Directory.objects.create(name='a', parent=self.root)
+        self.b = models.Directory.objects.create(name='b', parent=self.a)
+        self.c = models.Directory.objects.create(name='c', parent=self.root)
+
+    def assertRollups(self, directory, total_size, file_count, child_count):
+        directory.refresh_from_db()
+        self.assertTupleEqual(
+            (directory.total_size, directory.file_count,
+             directory.child_count),
+            (total_size, file_count, child_count))
+
+    def testVersions(self):
+        """ Checks that changes of children bump collection versions."""
+        def versions():
+            return dict(models.Resource.objects.values_list('name',
+                                                            'version'))
+        f = models.File.objects.create(name='f', parent=self.b)
+        self.assertDictEqual(versions(), {'/': 5, 'a': 3, 'b': 2, 'c': 1,
+                                          'f': 1})
+        self.a.refresh_from_db()
+        f.name = 'g'
+        f.save()
+        self.assertEqual(f.version, 2)
+        # "a" lists "b" with new modification time
+        self.assertDictEqual(versions(), {'/': 5, 'a': 4, 'b': 3, 'c': 1,
+                                          'g': 2})
+        self.assertEqual(models.Resource.objects.get(pk=self.a.pk).modified,
+                         self.a.modified)
+        f.parent = self.c
+        f.save()
+        self.assertDictEqual(versions(), {'/': 7, 'a': 5, 'b': 4, 'c': 2,
+                                          'g': 3})
+        self.b.delete()
+        self.assertDictEqual(versions(), {'/': 8, 'a': 6, 'c': 2, 'g': 3})
+
+    def testCreateFile(self):
+        """ Checks that file creation updates all ancestors."""
+        models.File.objects.create(name='f', parent=self.b, size=10)
+        self.assertRollups(self.b, 10, 1, 1)
+        self.assertRollups(self.a, 10, 1, 1)
+        self.assertRollups(self.root, 10, 1, 2)
+        self.assertRollups(self.c, 0, 0, 0)
+
+    def testResizeFile(self):
+        """ Checks that file resize updates all ancestors."""
+        f = models.File.objects.create(name='f', parent=self.b, size=10)
+        f = models.File.objects.get(pk=f.pk)
+        f.size = 3
+        f.save()
+        self.assertRollups(self.b, 3, 1, 1)
+        self.assertRollups(self.root, 3, 1, 2)
+
+    def testMoveDirectory(self):
+        """ Checks that subtree move updates old and new ancestors."""
+        models.File.objects.create(name='f', parent=self.b, size=10)
+        models.File.objects.create(name='g', parent=self.a, size=1)
+        self.b.parent = self.c
+        self.b.save()
+        self.assertRollups(self.a, 1, 1, 1)
+        self.assertRollups(self.c, 10, 1, 1)
+        self.assertRollups(self.root, 11, 2, 2)
+
+    def testMoveAndResizeFile(self):
+        """ Checks file moved and resized with a single save."""
+        f = models.File.objects.create(name='f', parent=self.b, size=10)
+        f.parent = self.c
+        f.size = 7
+        f.save()
+        self.assertRollups(self.b, 0, 0, 0)
+        self.assertRollups(self.a, 0, 0, 1)
+        self.assertRollups(self.c, 7, 1, 1)
+        self.assertRollups(self.root, 7, 1, 2)
+
+    def testDeleteSubtree(self):
+        """ Checks that subtree deletion updates ancestors."""
+        models.File.objects.create(name='f', parent=self.b, size=10)
+        models.File.objects.create(name='g', parent=self.c, size=1)
+        self.a.delete_subtree(batch_size=1)
+        self.assertRollups(self.root, 1, 1, 1)
+
+    def testBulkCreate(self):
+        """ Checks rollups of trees created in bulk."""
+        bulk.create_tree(self.b, [
+            {'name': 'x', 'is_collection': True, 'children': [
+                {'name': 'y', 'size': 2}, {'name': 'z', 'size': 3}]},
+            {'name': 'w', 'size': 4}], batch_size=2)
+        x = models.Directory.objects.get(path='a/b/x')
+        self.assertRollups(x, 5, 2, 2)
+        self.assertRollups(self.b, 9, 3, 2)
+        self.assertRollups(self.root, 9, 3, 2)
+
+    def testRebuild(self):
+        """ Checks rebuilding of drifted rollups."""
+        models.File.objects.create(name='f', parent=self.b, size=10)
+        models.Directory.objects.update(total_size=100, file_count=100,
+                                        child_count=100)
+        models.Directory.objects.filter(pk=self.c.pk).update(
+            total_size=0, file_count=0, child_count=0)
+        versions = dict(models.Resource.objects.values_list('pk', 'version'))
+        self.assertEqual(models.rebuild_rollups(), 3)
+        self.assertRollups(self.b, 10, 1, 1)
+        self.assertRollups(self.root, 10, 1, 2)
+        self.assertRollups(self.c, 0, 0, 0)
+        # drifted directories and their parents listing them
+        bumped = set(pk for pk, version in models.Resource.objects.values_list(
+            'pk', 'version') if version != versions[pk])
+        self.assertSetEqual(bumped, {self.root.pk, self.a.pk, self.b.pk})
+
+
+class NameSearchTestCase(TestCase):
+
+    def setUp(self):
+        super(NameSearchTestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        self.logs = models.Directory.objects.create(name='logs',
+                                                    parent=self.root)
+        for name in ('app.log', 'App.log', 'error.log', 'app.txt'):
+            models.File.objects.create(name=name, parent=self.logs)
+        bulk.create_tree(self.root, [{'name': 'bulk.log'},
+                                     {'name': 'backup.tar.gz'}])
+
+    def search(self, method, *args):
+        queryset = getattr(models.Resource.objects, method)(*args)
+        return sorted(queryset.values_list('name', flat=True))
+
+    def testPrefix(self):
+        """ Checks case-sensitive name prefix search."""
+        self.assertListEqual(self.search('name_prefix', 'app'),
+                             ['app.log', 'app.txt'])
+
+    def testSuffix(self):
+        """ Checks name suffix search via reversed name."""
+        self.assertListEqual(self.search('name_suffix', '.log'),
+                             ['App.log', 'app.log', 'bulk.log', 'error.log'])
+
+    def testContains(self):
+        """ Checks substring search via trigrams."""
+        self.assertListEqual(self.search('name_contains', 'rro'),
+                             ['error.log'])
+        self.assertListEqual(self.search('name_contains', 'ckup.tar'),
+                             ['backup.tar.gz'])
+        self.assertListEqual(self.search('name_contains', 'p.'),
+                             ['App.log', 'app.log', 'app.txt',
+                              'backup.tar.gz'])
+        # trigrams present in name, but not as continuous substring
+        self.assertListEqual(self.search('name_contains', 'app.tar'), [])
+
+    def testGlob(self):
+        """ Checks glob pattern search."""
+        self.assertListEqual(self.search('name_glob', '*.log'),
+                             ['App.log', 'app.log', 'bulk.log', 'error.log'])
+        self.assertListEqual(self.search('name_glob', '[aA]pp.*'),
+                             ['App.log', 'app.log', 'app.txt'])
+        self.assertListEqual(self.search('name_glob', 'b*ar*'),
+                             ['backup.tar.gz'])
+        self.assertListEqual(self.search('name_glob', '???.log'),
+                             ['App.log', 'app.log'])
+        self.assertListEqual(self.search('name_glob', 'app.log'),
+                             ['app.log'])
+
+    def testRename(self):
+        """ Checks that search index follows resource renames."""
+        f = models.File.objects.get(name='error.log')
+        f.name = 'warning.txt'
+        f.save(update_fields=['name'])
+        self.assertListEqual(self.search('name_contains', 'rro'), [])
+        self.assertListEqual(self.search('name_glob', 'warn*.txt'),
+                             ['warning.txt'])
+        self.assertEqual(
+            models.NameTrigram.objects.filter(resource=f.pk).count(), 9)
+
+
+class ChangeJournalTestCase(TestCase):
+
+    def setUp(self):
+        super(ChangeJournalTestCase, self).setUp()
+        self.root = models.Directory.objects.create(name='/')
+        self.dir = models.Directory.objects.create(name='dir',
+                                                   parent=self.root)
+
+    def changes(self):
+        return list(models.Change.objects.order_by('pk').values_list(
+            'action', 'path', 'old_path'))
+
+    def testJournal(self):
+        """ Checks journal entries for all kinds of changes."""
+        models.Change.objects.all().delete()
+        f = models.File(name='f.txt', parent=self.dir)
+        f.metadata = {'a': 1}
+        f.save()
+        f.metadata = {'a': 2}
+        f.size = 10
+        f.save()
+        # unchanged metadata is not written again
+        f.save()
+        f.name = 'g.txt'
+        f.save()
+        f.parent = self.root
+        f.save()
+        dir_id = self.dir.pk
+        self.dir.delete()
+        self.assertListEqual(self.changes(), [
+            ('create', 'dir/f.txt', None),
+            ('update', 'dir/f.txt', None),
+            ('metadata', 'dir/f.txt', None),
+            ('rename', 'dir/g.txt', 'dir/f.txt'),
+            ('move', 'g.txt', 'dir/g.txt'),
+            ('delete', 'dir', None),
+        ])
+        delete = models.Change.objects.last()
+        self.assertEqual(delete.resource_id, dir_id)
+        self.assertTrue(delete.is_collection)
+
+    def testJournalBulkCreate(self):
+        """ Checks journal entries of bulk created resources."""
+        models.Change.objects.all().delete()
+        bulk.create_tree(self.dir, [{'name': 'a', 'children': [
+            {'name': 'b.txt'}]}])
+        self.assertListEqual(self.changes(), [
+            ('create', 'dir/a', None),
+            ('create', 'dir/a/b.txt', None),
+        ])
+
+
 class MetadataModelTestCase(ResourceModelTestCase):
 
     def setUp(self):
@@ -190,3 +675,35 @@ class MetadataModelTestCase(ResourceModelTestCase):
             new_data = self.root.metadata
         self.assertFalse(p.called)
         self.assertIs(data, new_data)
+
+    def testMetadataIndex(self):
+        """ Checks that metadata index follows metadata changes."""
+        self.root.metadata = {'s': 'text', 'n': 5, 'f': 1.5, 'b': True,
+                              'nested': {'a': 1}, 'list': [1], 'none': None}
+        self.root.save()
+        self.assertSetEqual(
+            set(models.MetadataIndex.objects.values_list(
+                'resource_id', 'key', 'value', 'number')),
+            {(self.root.pk, 's', 'text', None),
+             (self.root.pk, 'n', '5', 5.0),
+             (self.root.pk, 'f', '1.5', 1.5),
+             (self.root.pk, 'b', 'true', None)})
+        self.root.metadata = {'s': 'other'}
+        self.root.save()
+        self.assertListEqual(
+            list(models.MetadataIndex.objects.values_list('key', 'value')),
+            [('s', 'other')])
+        self.root.metadata = {}
+        self.root.save()
+        self.assertEqual(models.MetadataIndex.objects.count(), 0)
+
+    def testMetadataIndexBulkCreate(self):
+        """ Checks that bulk created resources have indexed metadata."""
+        bulk.create_tree(self.root, [
+            {'name': 'a', 'children': [
+                {'name': 'b', 'metadata': {'mime-type': 'text/plain'}}]}])
+        b = models.Resource.objects.get(path='a/b')
+        self.assertListEqual(
+            list(models.MetadataIndex.objects.values_list(
+                'resource_id', 'key', 'value')),
+            [(b.pk, 'mime-type', 'text/plain')])
@@ -0,0 +1,90 @@
+# coding: utf-8
+from django.core.cache import caches
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APITransactionTestCase
+
+from fci.index import models, routers, timing
+
+
+@override_settings(FCI_READ_DATABASES=['replica'])
+class ReplicaRouterTestCase(APITransactionTestCase):
+    """ Read replica routing test case."""
+    multi_db = True
+
+    def setUp(self):
+        super(ReplicaRouterTestCase, self).setUp()
+        # replica lags behind: "dir" is not replicated yet
+        self.root = models.Directory.objects.create(name='/')
+        self.dir = models.Directory.objects.create(parent=self.root,
+                                                   name='dir')
+        models.Directory.objects.db_manager('replica').create(name='/')
+        self.router = routers.ReplicaRouter()
+
+    def url(self, path):
+        return reverse('resource-detail', kwargs={'path': path})
+
+    def testRouting(self):
+        """ Checks that reads go to replica, writes to primary."""
+        self.assertEqual(self.router.db_for_read(models.Resource), 'replica')
+        self.assertEqual(self.router.db_for_write(models.Resource),
+                         'default')
+        with routers.use_primary():
+            self.assertEqual(self.router.db_for_read(models.Resource),
+                             'default')
+        with override_settings(FCI_READ_DATABASES=[]):
+            self.assertEqual(self.router.db_for_read(models.Resource),
+                             'default')
+
+    def testTransaction(self):
+        """ Checks that reads inside transaction go to primary."""
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(models.Resource),
+                             'default')
+
+    def testReadFromReplica(self):
+        """ Checks that path is resolved in replica."""
+        response = self.client.get(self.url(''))
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(response.data['descendants'], [])
+        response = self.client.get(self.url('dir'))
+        self.assertEqual(response.status_code, 404)
+
+    def testReadYourWrites(self):
+        """ Checks that client is pinned to primary after a write."""
+        response = self.client.post(self.url('dir'), data={
+            'is_collection': False, 'name': 'f.txt', 'metadata': {}
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        cookie = response.cookies[routers.PrimaryPinMiddleware.cookie_name]
+        self.assertEqual(cookie['max-age'], routers.get_pin_seconds())
+        response = self.client.get(self.url('dir'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['descendants']), 1)
+        response = self.client.get(self.url('dir'), data={'stream': 1})
+        self.assertEqual(response.status_code, 200)
+
+        self.client.cookies.clear()
+        response = self.client.get(self.url('dir'))
+        self.assertEqual(response.status_code, 404)
+
+    def testTimingDatabases(self):
+        """ Checks that request timer captures queries of all databases."""
+        with timing.RequestTimer() as timer:
+            list(models.Resource.objects.using('default').all())
+            list(models.Resource.objects.using('replica').all())
+        self.assertEqual(timer.query_count, 2)
+
+    @override_settings(FCI_CACHE='default')
+    def testReadYourWritesCache(self):
+        """ Checks that pinned client doesn't get response cached from
+        replica."""
+        caches['default'].clear()
+        response = self.client.get(self.url(''))
+        self.assertListEqual(response.data['descendants'], [])
+        cookie = routers.PrimaryPinMiddleware.cookie_name
+        self.client.cookies[cookie] = '1'
+        response = self.client.get(self.url(''))
+        self.assertListEqual(
+            [d['name'] for d in response.data['descendants']], ['dir'])
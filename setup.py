@@ -5,6 +5,8 @@ setup(
     version='0.0.1',
     packages=['fci',
               'fci.index',
+              'fci.index.management',
+              'fci.index.management.commands',
               'fci.index.migrations'
               ],
     url='https://github.com/tumb1er/fci',
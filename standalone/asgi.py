@@ -0,0 +1,265 @@
+# coding: utf-8
+"""
+ASGI entry point (Python 3.5+).
+
+Django views are run in a thread pool, so event loop is never blocked by
+database access. Change feed requests with "wait" parameter are held on
+event loop until new changes appear, without occupying a thread.
+"""
+
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "standalone.settings")
+
+CHANGES_URL_NAMES = ('resource-changes', 'namespace-resource-changes')
+
+
+class ClientDisconnected(Exception):
+    """ Raised in worker thread when response can't be sent anymore."""
+
+
+def has_changes(path, namespace, cursor):
+    """ Checks change journal from a worker thread."""
+    from fci.index.models import Change
+    try:
+        return Change.exists_after(cursor, path, namespace)
+    finally:
+        close_old_connections()
+
+
+class Application(object):
+    """ ASGI application serving Django views from a thread pool."""
+
+    # response messages passed from worker thread and not sent yet
+    queue_size = 8
+
+    def __init__(self, wsgi_application=None, executor=None):
+        self.wsgi_application = wsgi_application or get_wsgi_application()
+        if executor is None:
+            threads = getattr(settings, 'FCI_ASGI_THREADS', 20)
+            executor = ThreadPoolExecutor(max_workers=threads)
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError("Unsupported scope type %s" % scope['type'])
+        await self.wait_for_changes(scope)
+        await self.serve(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def wait_for_changes(self, scope):
+        """
+        Holds change feed request with "wait" parameter.
+
+        Journal is polled every FCI_LONG_POLL_INTERVAL seconds until there
+        are changes after cursor or wait time (limited by
+        FCI_LONG_POLL_TIMEOUT) is over. Request is served as usual after
+        that, so malformed parameters are reported by the view.
+        """
+        if scope['method'] != 'GET':
+            return
+        path = scope['path'][len(scope.get('root_path', '')):]
+        try:
+            match = resolve(path)
+        except Resolver404:
+            return
+        if match.url_name not in CHANGES_URL_NAMES:
+            return
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        try:
+            wait = float(query['wait'][0])
+            cursor = int(query.get('cursor', ['0'])[0] or 0)
+        except (KeyError, ValueError):
+            return
+        timeout = min(wait, getattr(settings, 'FCI_LONG_POLL_TIMEOUT', 30))
+        interval = getattr(settings, 'FCI_LONG_POLL_INTERVAL', 1)
+        path = (match.kwargs.get('path') or '').strip('/')
+        namespace = match.kwargs.get('namespace') or ''
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while True:
+            found = await loop.run_in_executor(
+                self.executor, has_changes, path, namespace, cursor)
+            remaining = deadline - loop.time()
+            if found or remaining <= 0:
+                return
+            await asyncio.sleep(min(interval, remaining))
+
+    async def serve(self, scope, receive, send):
+        """ Runs WSGI application in thread pool and sends its response."""
+        body = await self.read_body(receive)
+        if body is None:
+            # client has gone away
+            return
+        environ = self.get_environ(scope, body)
+        loop = asyncio.get_event_loop()
+        messages = asyncio.Queue(maxsize=self.queue_size)
+        disconnected = threading.Event()
+
+        def put(message):
+            # waits for free slot, so worker is paced by the client
+            asyncio.run_coroutine_threadsafe(
+                messages.put(message), loop).result()
+
+        def emit(message):
+            if disconnected.is_set():
+                raise ClientDisconnected()
+            put(message)
+
+        def run():
+            try:
+                self.run_wsgi(environ, emit)
+            except ClientDisconnected:
+                pass
+            finally:
+                put(None)
+
+        future = loop.run_in_executor(self.executor, run)
+        watcher = asyncio.ensure_future(
+            self.watch_disconnect(receive, disconnected))
+        finished = False
+        try:
+            while True:
+                message = await messages.get()
+                if message is None:
+                    finished = True
+                    break
+                if disconnected.is_set():
+                    # queue is drained until worker stops
+                    continue
+                try:
+                    await send(message)
+                except Exception:
+                    disconnected.set()
+        finally:
+            watcher.cancel()
+            if not finished:
+                # cancelled: worker must not wait for a free slot forever
+                disconnected.set()
+                while not messages.empty():
+                    messages.get_nowait()
+        await future
+
+    @staticmethod
+    async def watch_disconnect(receive, disconnected):
+        """ Sets disconnected event when client goes away."""
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    @staticmethod
+    async def read_body(receive):
+        """ Returns request body or None if client has disconnected."""
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    @staticmethod
+    def get_environ(scope, body):
+        """ Builds WSGI environ from ASGI connection scope."""
+        script_name = scope.get('root_path', '')
+        path_info = scope['path'][len(script_name):]
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': script_name.encode('utf-8').decode('latin-1'),
+            'PATH_INFO': path_info.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        server = scope.get('server') or ('localhost', 80)
+        environ['SERVER_NAME'] = server[0]
+        environ['SERVER_PORT'] = str(server[1])
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1')
+            if name == 'content-length':
+                key = 'CONTENT_LENGTH'
+            elif name == 'content-type':
+                key = 'CONTENT_TYPE'
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if key in environ:
+                value = environ[key] + ',' + value
+            environ[key] = value
+        return environ
+
+    def run_wsgi(self, environ, emit):
+        """
+        Calls WSGI application in a worker thread.
+
+        Response is passed to event loop as ASGI messages chunk by chunk.
+        emit() blocks while send queue is full, so streamed listings are
+        generated as fast as client reads them, and raises
+        ClientDisconnected when client has gone away: iteration stops and
+        response is closed.
+        """
+        pending = []
+
+        def start_response(status, headers, exc_info=None):
+            pending[:] = [{
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'),
+                             value.encode('latin-1'))
+                            for name, value in headers],
+            }]
+            return write
+
+        def write(data):
+            if pending:
+                emit(pending.pop())
+            if data:
+                emit({'type': 'http.response.body', 'body': data,
+                      'more_body': True})
+
+        response = self.wsgi_application(environ, start_response)
+        try:
+            for chunk in response:
+                write(chunk)
+            write(b'')
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        emit({'type': 'http.response.body', 'body': b''})
+
+
+application = Application()
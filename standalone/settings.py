@@ -54,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'fci.index.routers.PrimaryPinMiddleware',
 ]
 
 ROOT_URLCONF = 'standalone.urls'
@@ -84,9 +85,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.abspath(os.path.join(BASE_DIR, '..', 'db.sqlite3')),
-    }
+    },
+    # point to a read replica and add to FCI_READ_DATABASES to offload reads
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.abspath(os.path.join(BASE_DIR, '..', 'db.sqlite3')),
+    },
 }
 
+DATABASE_ROUTERS = ['fci.index.routers.ReplicaRouter']
+
+FCI_READ_DATABASES = []
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators